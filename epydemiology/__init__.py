@@ -24,6 +24,7 @@ from .phjCalculateProportions import phjCalculateBinomialConfInts
 from .phjCalculateProportions import phjCalculateMultinomialProportions
 from .phjCalculateProportions import phjSummaryTableToBinaryOutcomes
 from .phjCalculateProportions import phjAnnualDiseaseTrend
+from .phjCalculateProportions import phjBatchAnnualDiseaseTrend
 
 from .phjCleanUKPostcodes import phjCleanUKPostcodeVariable
 from .phjCleanUKPostcodes import phjPostcodeFormat7
@@ -44,7 +45,10 @@ from .phjExtFuncs import getJenksBreaks
 
 from .phjRROR import phjOddsRatio
 from .phjRROR import phjRelativeRisk
+from .phjRROR import phjMatchedOddsRatio
+from .phjRROR import phjScreenRiskFactors
 
 from .phjSelectData import phjSelectCaseControlDataset
 from .phjSelectData import phjGenerateCaseControlDataset
+from .phjSelectData import phjGenerateCaseControlDatasetFromPartitions
 from .phjSelectData import phjCollapseOnPatientID
@@ -38,6 +38,8 @@ except pkg_resources.DistributionNotFound:
 else:
     scipyPresent = True
     from scipy.stats import norm
+    from scipy.stats import chi2
+    from scipy.stats import beta
 
 
 try:
@@ -49,6 +51,7 @@ else:
     statsmodelsPresent = True
     import statsmodels.api as sm
     import statsmodels.stats.proportion as smprop
+    from statsmodels.tools.sm_exceptions import PerfectSeparationWarning
 
 
 try:
@@ -63,6 +66,9 @@ else:
 
 import collections
 import inspect
+import itertools
+import warnings
+import concurrent.futures
 
 from .phjTestFunctionParameters import phjAssert
 
@@ -236,14 +242,13 @@ def phjCalculateBinomialProportions(phjDF,
                                           phjMissingValue = phjMissingValue)
         
         else:
-            # Copy required columns to new dataframe
-            phjDF = phjDF[phjColumnsList + [phjGroupVarName]].copy()
-            
-            # Calculate number of successes for each level of group variable and return summary dataframe
-            phjPropDF = phjDF.groupby(phjGroupVarName).apply(lambda x: phjCountSuccesses(x,
-                                                                                         phjColumnsList = phjColumnsList,
-                                                                                         phjSuccessValue = phjSuccess,
-                                                                                         phjMissingValue = phjMissingValue))
+            # Calculate number of successes for each level of group variable and return summary
+            # dataframe (all groups are counted at once; see phjCountSuccesses())
+            phjPropDF = phjCountSuccesses(x = phjDF[phjColumnsList + [phjGroupVarName]],
+                                          phjColumnsList = phjColumnsList,
+                                          phjSuccessValue = phjSuccess,
+                                          phjMissingValue = phjMissingValue,
+                                          phjGroupVarName = phjGroupVarName)
         
         # Calculate confidence intervals
         phjPropDF = phjCalculateBinomialConfInts(phjDF = phjPropDF,
@@ -251,6 +256,7 @@ def phjCalculateBinomialProportions(phjDF,
                                                  phjTotalVarName = phjSuffixDict['numbertrials'],
                                                  phjBinomialConfIntMethod = phjBinomialConfIntMethod,
                                                  phjAlpha = phjAlpha,
+                                                 phjInPlace = True,
                                                  phjPrintResults = phjPrintResults)
         
         
@@ -481,66 +487,43 @@ def phjCalculateMultinomialProportions(phjDF,
                                                    phjPrintResults = phjPrintResults)
         
         
-        # Create empty dataframe (no columns) with index consisting of all category levels
-        phjRelFreqDF = pd.DataFrame(index = phjCategoryLevelsList)
+        # Count the number of observations in each combination of category level
+        # (rows) and group level (columns) in a single pass.
+        phjCatCodesArr = pd.Index(phjCategoryLevelsList).get_indexer(phjDF[phjCategoryVarName])
         
+        if phjGroupVarName is None:
+            phjGroupCodesArr = np.zeros(len(phjDF.index),dtype = np.int64)
+        else:
+            phjGroupCodesArr = pd.Index(phjGroupLevelsList).get_indexer(phjDF[phjGroupVarName])
         
-        # Define which suffix indicates normalization of value_counts() function
-        # (i.e. which is absolute counts and which is relative frequency):
-        phjSuffixNormOrderedDict = collections.OrderedDict()
-        phjSuffixNormOrderedDict[phjSuffixDict['absfreq']] = False
-        phjSuffixNormOrderedDict[phjSuffixDict['proportion']] = True
+        phjCountsArr = np.bincount(phjCatCodesArr * len(phjGroupLevelsList) + phjGroupCodesArr,
+                                   minlength = len(phjCategoryLevelsList) * len(phjGroupLevelsList)).reshape(len(phjCategoryLevelsList),
+                                                                                                             len(phjGroupLevelsList))
         
+        # Calculate relative frequencies and simultaneous confidence intervals for all groups
+        phjPropArr = phjCountsArr / phjCountsArr.sum(axis = 0)
         
-        # Create temporary dataframes consisting of output from value_counts() function
-        # applied to slices of dataframe based on group levels
-        for phjSuffix, phjNormalize in phjSuffixNormOrderedDict.items():
-            
-            # Calculate frequencies and relative frequencies for each group
+        phjCILowLimArr, phjCIUppLimArr = phjCalculateMultinomialConfInts(phjCountsArr = phjCountsArr,
+                                                                         phjMultinomialConfIntMethod = phjMultinomialConfIntMethod,
+                                                                         phjAlpha = phjAlpha)
+        
+        # Assemble summary dataframe with index consisting of all category levels.
+        # If no group variable is given, column names are not prefixed with a group name.
+        phjRelFreqDict = collections.OrderedDict()
+        
+        for phjGroupIndex, phjGroup in enumerate(phjGroupLevelsList):
             if phjGroupVarName is None:
-                phjTempRelFreqDF = pd.DataFrame(phjDF[phjCategoryVarName].value_counts(normalize = phjNormalize))
-                phjTempRelFreqDF = phjTempRelFreqDF.rename(columns = {phjCategoryVarName: phjSuffix})
-                
-                # Use non-normalized data to calculate simultaneous confidence intervals
-                if phjNormalize == False:
-                    phjTempRelFreqDF = phjCalculateMultinomialConfInts(phjDF = phjTempRelFreqDF,
-                                                                       phjAbsFreqColumnName = phjSuffix,
-                                                                       phjSimultConfIntColumnName = phjSuffixDict['cisuffix'],
-                                                                       phjMultinomialConfIntMethod = phjMultinomialConfIntMethod,
-                                                                       phjAlpha = phjAlpha,
-                                                                       phjPrintResults = phjPrintResults)
-                
-                # Join temporary data frame to complete dataframe based on index value.
-                phjRelFreqDF = phjRelFreqDF.join(phjTempRelFreqDF)
-                
-                # Cells in summary dataframe with missing values are converted to zero
-                # (N.B. In this bit (when phjGroupVarName is None) the following may not be required
-                # but I haven't confirmed that for certain so have included it anyway.)
-                phjRelFreqDF = phjRelFreqDF.fillna(0)
-            
-            
+                phjPrefixList = []
             else:
-                for phjGroup in phjGroupLevelsList:
-                    phjTempRelFreqDF = pd.DataFrame(phjDF.loc[phjDF[phjGroupVarName] == phjGroup,phjCategoryVarName].value_counts(normalize = phjNormalize))
-                    phjTempRelFreqDF = phjTempRelFreqDF.rename(columns = {phjCategoryVarName: phjSuffixDict['joinstr'].join([str(phjGroup),phjSuffix])})
-                    
-                    # Use non-normalized data to calculate simultaneous confidence intervals
-                    if phjNormalize == False:
-                        phjTempRelFreqDF = phjCalculateMultinomialConfInts(phjDF = phjTempRelFreqDF,
-                                                                           phjAbsFreqColumnName = phjSuffixDict['joinstr'].join([str(phjGroup),phjSuffix]),
-                                                                           phjSimultConfIntColumnName = phjSuffixDict['joinstr'].join([str(phjGroup),phjSuffixDict['cisuffix']]),
-                                                                           phjMultinomialConfIntMethod = phjMultinomialConfIntMethod,
-                                                                           phjAlpha = phjAlpha,
-                                                                           phjPrintResults = phjPrintResults)
-                    
-                    
-                    # Join temporary data frame to complete dataframe based on index value.
-                    phjRelFreqDF = phjRelFreqDF.join(phjTempRelFreqDF)
-                
-                # Cells in summary dataframe with missing values are converted to zero
-                phjRelFreqDF = phjRelFreqDF.fillna(0)
-        
+                phjPrefixList = [str(phjGroup)]
+            
+            phjRelFreqDict[phjSuffixDict['joinstr'].join(phjPrefixList + [phjSuffixDict['absfreq']])] = phjCountsArr[:,phjGroupIndex]
+            phjRelFreqDict[phjSuffixDict['joinstr'].join(phjPrefixList + [phjSuffixDict['proportion']])] = phjPropArr[:,phjGroupIndex]
+            phjRelFreqDict[phjSuffixDict['joinstr'].join(phjPrefixList + [phjSuffixDict['cisuffix'],phjSuffixDict['cilowlim']])] = phjCILowLimArr[:,phjGroupIndex]
+            phjRelFreqDict[phjSuffixDict['joinstr'].join(phjPrefixList + [phjSuffixDict['cisuffix'],phjSuffixDict['ciupplim']])] = phjCIUppLimArr[:,phjGroupIndex]
         
+        phjRelFreqDF = pd.DataFrame(phjRelFreqDict,
+                                    index = phjCategoryLevelsList)
         
         phjRelFreqDF = phjReorderCols(phjDF = phjRelFreqDF,
                                       phjGroupVarName = phjGroupVarName,
@@ -578,10 +561,14 @@ def phjCalculateBinomialConfInts(phjDF,
                                  phjTotalVarName = None,
                                  phjBinomialConfIntMethod = 'normal',
                                  phjAlpha = 0.05,
+                                 phjInPlace = False,
+                                 phjFloat32 = False,
                                  phjPrintResults = False):
     
     # Deep copy dataframe to ensure columns not added to passed dataframe
-    phjDF = phjDF.copy(deep = True)
+    # unless the columns are required to be added to the passed dataframe.
+    if phjInPlace == False:
+        phjDF = phjDF.copy(deep = True)
     
     # Get a list of the terms used to head columns in summary tables
     phjSuffixDict = phjDefineSuffixDict(phjAlpha = phjAlpha)
@@ -605,6 +592,8 @@ def phjCalculateBinomialConfInts(phjDF,
         
         phjAssert('phjBinomialConfIntMethod',phjBinomialConfIntMethod,str,phjAllowedOptions = ['normal','agresti_coull','beta','wilson','jeffreys','binom_test'])
         phjAssert('phjAlpha',phjAlpha,float,phjAllowedOptions = {'min':0.0001,'max':0.9999})
+        phjAssert('phjInPlace',phjInPlace,bool)
+        phjAssert('phjFloat32',phjFloat32,bool)
         phjAssert('phjPrintResults',phjPrintResults,bool)
         
         # Bespoke asserts
@@ -653,31 +642,39 @@ def phjCalculateBinomialConfInts(phjDF,
         # If 2 column names entered and 1 is failures then calculate either the successes or the totals column.
         if (nArgs == 2) & (phjFailVarName is not None):
             if phjSuccVarName is None:
-                phjSuccVarName = phjSuffixDict['numbersuccess']
+                phjSuccVarName = phjSuffixDict['numbersuccesses']
                 phjDF[phjSuccVarName] = phjDF[phjTotalVarName] - phjDF[phjFailVarName]
             elif phjTotalVarName is None:
                 phjTotalVarName = phjSuffixDict['numbertrials']
                 phjDF[phjTotalVarName] = phjDF[phjSuccVarName] + phjDF[phjFailVarName]
  
-        # Ensure count data is stored as integer values. Otherwise,
-        # for some reason, calculations with object columns can go awry.
-        phjDF[phjSuccVarName] = phjDF[phjSuccVarName].astype(int)
-        phjDF[phjTotalVarName] = phjDF[phjTotalVarName].astype(int)
- 
+        # Calculations are made on arrays of counts rather than the columns themselves
+        # (which may be stored as objects) and the results are added to the dataframe
+        # directly, as either 64-bit or 32-bit floats.
+        if phjFloat32 == True:
+            phjDtype = np.float32
+        else:
+            phjDtype = np.float64
+        
+        phjSuccArr = phjDF[phjSuccVarName].to_numpy(dtype = np.float64)
+        phjTotalArr = phjDF[phjTotalVarName].to_numpy(dtype = np.float64)
+        
         # Calculate proportions
-        phjDF[phjProbName] = phjDF[phjSuccVarName] / phjDF[phjTotalVarName]
- 
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            phjPropArr = phjSuccArr / phjTotalArr
+        
         # Get binomial confidence intervals
-        phjBinomConfIntArr = smprop.proportion_confint(count = phjDF[phjSuccVarName],
-                                                       nobs = phjDF[phjTotalVarName],
-                                                       alpha = phjAlpha,
-                                                       method = phjBinomialConfIntMethod)
- 
-        phjDF[phjProbCILowLimName] = [i for i in phjBinomConfIntArr[0]]
-        phjDF[phjProbCIUppLimName] = [i for i in phjBinomConfIntArr[1]]
+        phjCILowLimArr, phjCIUppLimArr = phjCalculateBinomialConfIntLimits(phjSuccArr = phjSuccArr,
+                                                                           phjTotalArr = phjTotalArr,
+                                                                           phjBinomialConfIntMethod = phjBinomialConfIntMethod,
+                                                                           phjAlpha = phjAlpha)
         
-        phjDF[phjProbCILowIntName] = phjDF[phjProbName] - phjDF[phjProbCILowLimName]
-        phjDF[phjProbCIUppIntName] = phjDF[phjProbCIUppLimName] - phjDF[phjProbName]
+        phjDF[phjProbName] = phjPropArr.astype(phjDtype,copy = False)
+        phjDF[phjProbCILowLimName] = phjCILowLimArr.astype(phjDtype,copy = False)
+        phjDF[phjProbCIUppLimName] = phjCIUppLimArr.astype(phjDtype,copy = False)
+        
+        phjDF[phjProbCILowIntName] = (phjPropArr - phjCILowLimArr).astype(phjDtype,copy = False)
+        phjDF[phjProbCIUppIntName] = (phjCIUppLimArr - phjPropArr).astype(phjDtype,copy = False)
         
     finally:
         if phjPrintResults == True:
@@ -696,13 +693,14 @@ def phjSummaryTableToBinaryOutcomes(phjDF,
                                     phjFailVarName = None,
                                     phjTotalVarName = None,
                                     phjOutcomeVarName = 'outcome',
+                                    phjFreqVarName = None,
+                                    phjChunkSizeInt = None,
                                     phjPrintResults = False):
     
     """
     Converts a table containing summary count data (e.g. number of cases of disease
     per year) and converts it to a dataframe containing binary outcome data. This is
-    useful when creating logistic regression models but the function does not have an
-    option to include frequency weights.
+    useful when creating logistic regression models.
     
     The format of the original table of summary results may take the following format:
     
@@ -726,6 +724,22 @@ def phjSummaryTableToBinaryOutcomes(phjDF,
         7519  2014        0
         7520  2014        0
     
+    For large summary tables, expanding to one row per subject may not be practical.
+    If phjFreqVarName is entered, a compact frequency-weighted dataframe is returned
+    instead, containing one row for each combination of variables and outcome (rows
+    with zero frequency are excluded) and a column, named phjFreqVarName, containing
+    the number of subjects:
+        
+             year  outcome  freq
+        0    2010        1    23
+        1    2011        1    34
+        ...   ...      ...   ...
+        9    2014        0  1876
+    
+    If phjChunkSizeInt is entered, a generator is returned which yields consecutive
+    dataframes of binary outcome data with, at most, phjChunkSizeInt rows. Concatenated
+    together, the chunks are identical to the full dataframe of binary outcomes.
+    
     See Also
     --------
     A more detailed description of the function and its usage can be found at:
@@ -748,6 +762,13 @@ def phjSummaryTableToBinaryOutcomes(phjDF,
             phjAssert('phjTotalVarName',phjTotalVarName,str,phjMustBePresentColumnList = list(phjDF.columns))
         
         phjAssert('phjOutcomeVarName',phjOutcomeVarName,str,phjMustBeAbsentColumnList = list(phjDF.columns))
+        
+        if phjFreqVarName is not None:
+            phjAssert('phjFreqVarName',phjFreqVarName,str,phjMustBeAbsentColumnList = list(phjDF.columns) + [phjOutcomeVarName])
+        
+        if phjChunkSizeInt is not None:
+            phjAssert('phjChunkSizeInt',phjChunkSizeInt,int,phjAllowedOptions = {'min':1})
+        
         phjAssert('phjPrintResults',phjPrintResults,bool)
         
         # Bespoke asserts
@@ -760,6 +781,9 @@ def phjSummaryTableToBinaryOutcomes(phjDF,
         # If all three parameters have been entered, check that successes + failures = total
         if nArgs == 3:
             assert (phjDF[phjSuccVarName] + phjDF[phjFailVarName]).equals(phjDF[phjTotalVarName]), "The '{0}' and '{1}' columns do not add up to the values in the '{2}' column.".format(phjSuccVarName,phjFailVarName,phjTotalVarName)
+        
+        # The compact frequency-weighted output and the chunked output are alternatives
+        assert (phjFreqVarName is None) | (phjChunkSizeInt is None), "Only one of phjFreqVarName and phjChunkSizeInt can be entered."
     
     except AssertionError as e:
         
@@ -815,15 +839,25 @@ def phjSummaryTableToBinaryOutcomes(phjDF,
                                    var_name = phjOutcomeVarName,
                                    value_name = 'count').reset_index(drop = True)
         
-        phjDF = phjDF.loc[phjDF.index.repeat(phjDF['count'])]
+        phjDF[phjOutcomeVarName] = np.where(phjDF[phjOutcomeVarName] == phjSuccVarName,1,0)
+        
+        if phjFreqVarName is not None:
+            # Return one row per combination of variables and outcome, with frequency weights
+            phjDF = phjDF.loc[phjDF['count'] > 0].rename(columns = {'count': phjFreqVarName}).reset_index(drop = True)
         
-        phjDF[phjOutcomeVarName] = phjDF[phjOutcomeVarName].replace({phjSuccVarName: 1,
-                                                                     phjFailVarName: 0})
+        elif phjChunkSizeInt is not None:
+            # Return a generator that expands the stacked table one chunk at a time
+            phjDF = phjGenerateBinaryOutcomeChunks(phjDF = phjDF,
+                                                   phjCountVarName = 'count',
+                                                   phjChunkSizeInt = phjChunkSizeInt)
         
-        phjDF = phjDF[[x for x in phjDF.columns if x != 'count']].reset_index(drop = True)
+        else:
+            phjDF = phjDF.loc[phjDF.index.repeat(phjDF['count'])]
+            
+            phjDF = phjDF[[x for x in phjDF.columns if x != 'count']].reset_index(drop = True)
         
     finally:
-        if phjPrintResults == True:
+        if (phjPrintResults == True) & isinstance(phjDF,pd.DataFrame):
             print('Final dataframe\n')
             with pd.option_context('display.max_rows',6, 'display.max_columns',2):
                 print(phjDF)
@@ -842,6 +876,7 @@ def phjAnnualDiseaseTrend(phjDF,
                           phjAlpha = 0.05,
                           phjPlotProportions = True,
                           phjPlotPrediction = True,
+                          phjForecastYearsList = None,
                           phjGraphTitleStr = None,
                           phjPrintResults = False):
     
@@ -868,6 +903,14 @@ def phjAnnualDiseaseTrend(phjDF,
         phjAssert('phjPlotProportions',phjPlotProportions,bool)
         phjAssert('phjPlotPrediction',phjPlotPrediction,bool)
         
+        if phjForecastYearsList is not None:
+            phjAssert('phjForecastYearsList',phjForecastYearsList,(int,float,list))
+            
+            if not isinstance(phjForecastYearsList,list):
+                phjForecastYearsList = [phjForecastYearsList]
+            
+            assert all([isinstance(i,(int,float,np.integer,np.floating)) for i in phjForecastYearsList]), "The years in phjForecastYearsList need to be numeric values."
+        
         if phjGraphTitleStr is not None:
             phjAssert('phjGraphTitleStr',phjGraphTitleStr,str)
         
@@ -899,7 +942,7 @@ def phjAnnualDiseaseTrend(phjDF,
         phjProbCILowIntName = phjSuffixDict['joinstr'].join([phjSuffixDict['cisuffix'],phjSuffixDict['cilowint']])   # Created by phjCalculateBinomialConfInts
         phjProbCIUppIntName = phjSuffixDict['joinstr'].join([phjSuffixDict['cisuffix'],phjSuffixDict['ciuppint']])   # Created by phjCalculateBinomialConfInts
         
-        # N.B. Also a column called 'Intercept' will be created by patsy
+        # N.B. Also a column called 'Intercept' will be created in the design matrix
         phjPredProbName = ''.join([phjSuffixDict['predicted'],phjSuffixDict['probability']])
         phjPredProbSEName = phjSuffixDict['joinstr'].join([phjPredProbName,phjSuffixDict['stderr']])
         phjPredProbCILowLimName = phjSuffixDict['joinstr'].join([phjPredProbName,phjSuffixDict['cisuffix'],phjSuffixDict['cilowlim']])
@@ -936,15 +979,6 @@ def phjAnnualDiseaseTrend(phjDF,
                                                      phjBinomialConfIntMethod = phjConfIntMethod,
                                                      phjAlpha = phjAlpha,
                                                      phjPrintResults = phjPrintResults)
-            
-            # Try to convert to table of binary outcomes
-            phjLongDF = phjSummaryTableToBinaryOutcomes(phjDF = phjPropDF,
-                                                        phjVarsToIncludeList = [phjYearVarName],
-                                                        phjSuccVarName = phjPositivesVarName,
-                                                        phjFailVarName = phjNegativesVarName,
-                                                        phjTotalVarName = phjTotalVarName,
-                                                        phjOutcomeVarName = phjSuffixDict['outcome'],
-                                                        phjPrintResults = False)
         
         except AssertionError as e:
             
@@ -963,122 +997,221 @@ def phjAnnualDiseaseTrend(phjDF,
                 raise
         
         else:
-            #import pdb; pdb.set_trace()
-            
-            # Logistic regression model
-            phjFormulaStr = '{} ~ {}'.format(phjSuffixDict['outcome'],phjYearVarName)
-            
-            # Calculating post-estimation using matrices
-            y, X = patsy.dmatrices(formula_like = phjFormulaStr,
-                                   data = phjLongDF,
-                                   NA_action = 'drop',
-                                   return_type = 'dataframe')
-            
-            model = sm.Logit(endog = y,
-                             exog = X,
-                             missing = 'drop').fit()
+            # Fit logistic regression model and calculate predicted probabilities
+            model, phjPropDF = phjFitDiseaseTrend(phjPropDF = phjPropDF,
+                                                  phjYearVarName = phjYearVarName,
+                                                  phjPositivesVarName = phjPositivesVarName,
+                                                  phjNegativesVarName = phjNegativesVarName,
+                                                  phjTotalVarName = phjTotalVarName,
+                                                  phjForecastYearsList = phjForecastYearsList,
+                                                  phjAlpha = phjAlpha)
             
             if phjPrintResults == True:
                 print(model.summary2())
                 print('\n')
-            else:
-                model.summary2()    # It seems that the .summary2() method needs to be run even if not printed, otherwise an error occurs.
-            
-            # Calculate predicted probabilities
-            X[phjPredProbName] = model.predict() # predicted probability
             
-            # Estimate confidence interval for predicted probabilities using Delta method
-            # This method is taken from an answer by David Dale on StackOverflow (see https://stackoverflow.com/questions/47414842/confidence-interval-of-probability-prediction-from-logistic-regression-statsmode/47419474).
-            cov = model.cov_params()
-            gradient = (X[phjPredProbName] * (1 - X[phjPredProbName]) * X[[x for x in X if x != phjPredProbName]].T).T.values # matrix of gradients for each observation
-            
-            # Add column containing SE of predicted probabilities
-            X[phjPredProbSEName] = [np.sqrt(np.dot(np.dot(g, cov), g)) for g in gradient]
+            # Plot actual proportion as barchart and predicted probabilities as line
+            if (phjPlotProportions == True) | (phjPlotPrediction == True):
+                phjPlotDiseaseTrend(phjPropDF = phjPropDF,
+                                    phjYearVarName = phjYearVarName,
+                                    phjConvergedBool = model.converged,
+                                    phjTrendPValue = model.pvalues[phjYearVarName],
+                                    phjPlotProportions = phjPlotProportions,
+                                    phjPlotPrediction = phjPlotPrediction,
+                                    phjGraphTitleStr = phjGraphTitleStr,
+                                    phjAlpha = phjAlpha)
+        
+    finally:
+        
+        return phjPropDF
+ 
+ 
+ 
+def phjBatchAnnualDiseaseTrend(phjDF,
+                               phjSeriesVarNamesList,
+                               phjYearVarName,
+                               phjPositivesVarName = None,
+                               phjNegativesVarName = None,
+                               phjTotalVarName = None,
+                               phjConfIntMethod = 'normal',
+                               phjAlpha = 0.05,
+                               phjForecastYearsList = None,
+                               phjNumberOfWorkersInt = 1,           # Number of worker processes used to fit the models for each series
+                               phjPlotResults = False,
+                               phjPrintResults = False):
+    
+    # Fits the same binomial trend model as phjAnnualDiseaseTrend() to many time series
+    # (e.g. each combination of syndrome and region) contained in a single long table with
+    # one row for each series and year. Binomial confidence intervals are calculated for
+    # all rows at once, the model for each series is fitted (in separate processes if
+    # phjNumberOfWorkersInt is greater than 1) and the results are returned as a single
+    # dataframe with one row for each series and year containing the observed proportions,
+    # the predicted probabilities (with confidence intervals) and, repeated on each row of
+    # the series, the model coefficients, the p-value for the trend and whether the model
+    # converged. Graphs are only plotted if phjPlotResults is set to True.
+    
+    # Get a list of the terms used to head columns in summary tables
+    phjSuffixDict = phjDefineSuffixDict(phjAlpha = phjAlpha)
+    
+    # Check whether required parameters have been set to correct type
+    # and check whether arguments are set to allowable values.
+    try:
+        phjAssert('phjDF',phjDF,pd.DataFrame)
+        phjAssert('phjSeriesVarNamesList',phjSeriesVarNamesList,(str,list),phjMustBePresentColumnList = list(phjDF.columns))
+        
+        # If the series is identified by a single variable entered as a string,
+        # convert to a list before going any further.
+        if isinstance(phjSeriesVarNamesList,str):
+            phjSeriesVarNamesList = [phjSeriesVarNamesList]
+        
+        phjAssert('phjYearVarName',phjYearVarName,str,phjMustBePresentColumnList = list(phjDF.columns),phjMustBeAbsentColumnList = phjSeriesVarNamesList)
+        
+        if phjPositivesVarName is not None:
+            phjAssert('phjPositivesVarName',phjPositivesVarName,str,phjMustBePresentColumnList = list(phjDF.columns))
             
-            # Add column containing CI lower and upper limits
-            # The format of ci_limit = np.maximum(0, np.minimum(1, prob + std_errors * c)) ensures limit lies between 0 and 1.
-            # Multiplier for standard error calculated as:
-            #     norm.ppf(.025) = -1.960063984540054
-            #     norm.ppf(.975) = 1.959963984540054
+        if phjNegativesVarName is not None:
+            phjAssert('phjNegativesVarName',phjNegativesVarName,str,phjMustBePresentColumnList = list(phjDF.columns))
             
-            # Calculate confidence intervals. The max(0,min(1,interval)) construct ensures that
-            # the interval does not extend beyond 1 or 0. Again this was taken from the answer
-            # by David Dale on StackOverflow (see https://stackoverflow.com/questions/47414842/confidence-interval-of-probability-prediction-from-logistic-regression-statsmode/47419474).
-            # Lower interval
-            X[phjPredProbCILowLimName] = np.maximum(0,np.minimum(1,X[phjPredProbName] + (norm.ppf(phjAlpha/2) * X[phjPredProbSEName])))   # N.B. The norm.pdf(0.025) is negative therefore equates to mean minus interval.
-            # Upper interval
-            X[phjPredProbCIUppLimName] = np.maximum(0,np.minimum(1,X[phjPredProbName] + (norm.ppf(1 - (phjAlpha/2)) * X[phjPredProbSEName])))
+        if phjTotalVarName is not None:
+            phjAssert('phjTotalVarName',phjTotalVarName,str,phjMustBePresentColumnList = list(phjDF.columns))
             
-            # Keep only a single value for each group
-            X = X.drop_duplicates(keep = 'first')
+        phjAssert('phjConfIntMethod',phjConfIntMethod,str,phjAllowedOptions = ['normal','agresti_coull','beta','wilson','jeffreys','binom_test'])
+        phjAssert('phjAlpha',phjAlpha,float,phjAllowedOptions = {'min':0.0001,'max':0.9999})
+        
+        if phjForecastYearsList is not None:
+            phjAssert('phjForecastYearsList',phjForecastYearsList,(int,float,list))
             
-            # Join predicted probabilities with original dataframe
-            phjPropDF = phjPropDF.merge(right = X,
-                                        left_on = phjYearVarName,
-                                        right_on = phjYearVarName)
+            if not isinstance(phjForecastYearsList,list):
+                phjForecastYearsList = [phjForecastYearsList]
             
-            #if phjPrintResults == True:
-            #    print(phjPropDF)
-            #    print('\n')
+            assert all([isinstance(i,(int,float,np.integer,np.floating)) for i in phjForecastYearsList]), "The years in phjForecastYearsList need to be numeric values."
+        
+        phjAssert('phjNumberOfWorkersInt',phjNumberOfWorkersInt,int,phjAllowedOptions = {'min':1})
+        phjAssert('phjPlotResults',phjPlotResults,bool)
+        phjAssert('phjPrintResults',phjPrintResults,bool)
+        
+        # Bespoke asserts
+        # ---------------
+        assert len(phjDF.index) > 0, "The dataframe does not contain any rows."
+        
+        # The user can enter two of three parameters in list of successes, failures or total.
+        # Check that at least 2 parameters are entered.
+        nArgs = len([i for i in [phjPositivesVarName,phjNegativesVarName,phjTotalVarName] if i is not None])
+        assert nArgs >= 2, "At least 2 variables from phjPositivesVarName, phjNegativesVarName and phjTotalVarName need to be entered but only {} has been entered.".format(nArgs)
+        
+        # If all three parameters have been entered, check that successes + failures = total
+        if nArgs == 3:
+            assert (phjDF[phjPositivesVarName] + phjDF[phjNegativesVarName]).equals(phjDF[phjTotalVarName]), "The '{0}' and '{1}' columns do not add up to the values in the '{2}' column.".format(phjPositivesVarName,phjNegativesVarName,phjTotalVarName)
+        
+        # Each year should only occur once in each series
+        assert not phjDF.duplicated(subset = phjSeriesVarNamesList + [phjYearVarName]).any(), "Each year can only occur once in each series."
+        
+        # New columns
+        # Columns relating to proportions and predicted probabilities are checked in the
+        # same way as phjAnnualDiseaseTrend() and columns relating to model coefficients
+        # are also checked.
+        phjPredProbName = ''.join([phjSuffixDict['predicted'],phjSuffixDict['probability']])
+        
+        phjAssert('New column names',
+                  [phjSuffixDict['proportion'],
+                   phjPredProbName,
+                   phjSuffixDict['joinstr'].join([phjPredProbName,phjSuffixDict['stderr']]),
+                   phjSuffixDict['joinstr'].join(['Intercept',phjSuffixDict['coefficient']]),
+                   phjSuffixDict['joinstr'].join([phjYearVarName,phjSuffixDict['coefficient']]),
+                   phjSuffixDict['joinstr'].join([phjYearVarName,phjSuffixDict['pvalue']]),
+                   phjSuffixDict['converged']],
+                  list,
+                  phjMustBeAbsentColumnList = list(phjDF.columns))
+    
+    except AssertionError as e:
+        
+        phjTrendDF = None
+        
+        # If function has been called directly, present message.
+        if inspect.stack()[1][3] == '<module>':
+            print("An AssertionError occurred in {fname}() function. ({msg})\n".format(msg = e,
+                                                                                       fname = inspect.stack()[0][3]))
+        
+        # If function has been called by another function then modify message and re-raise exception
+        else:
+            print("An AssertionError occurred in {fname}() function when called by {callfname}() function. ({msg})\n".format(msg = e,
+                                                                                                                             fname = inspect.stack()[0][3],
+                                                                                                                             callfname = inspect.stack()[1][3]))
+            raise
+    
+    else:
+        # Calculate binomial confidence intervals for all series at once.
+        # (N.B. Columns are added to a new dataframe containing only the required columns
+        # and, therefore, the passed dataframe is not altered.)
+        phjPropDF = phjCalculateBinomialConfInts(phjDF = phjDF[phjSeriesVarNamesList + [phjYearVarName] + [i for i in [phjPositivesVarName,phjNegativesVarName,phjTotalVarName] if i is not None]],
+                                                 phjSuccVarName = phjPositivesVarName,
+                                                 phjFailVarName = phjNegativesVarName,
+                                                 phjTotalVarName = phjTotalVarName,
+                                                 phjBinomialConfIntMethod = phjConfIntMethod,
+                                                 phjAlpha = phjAlpha,
+                                                 phjInPlace = True,
+                                                 phjPrintResults = False)
+        
+        # Split the table into separate series
+        phjSeriesKeysList = []
+        phjSeriesDFList = []
+        
+        for phjKey, phjSeriesDF in phjPropDF.groupby(phjSeriesVarNamesList,sort = True):
+            phjSeriesKeysList.append(phjKey)
+            phjSeriesDFList.append(phjSeriesDF.drop(columns = phjSeriesVarNamesList).sort_values(by = phjYearVarName).reset_index(drop = True))
+        
+        # Fit trend model for each series
+        if (phjNumberOfWorkersInt > 1) and (len(phjSeriesDFList) > 1):
+            with concurrent.futures.ProcessPoolExecutor(max_workers = phjNumberOfWorkersInt) as phjExecutor:
+                phjSeriesDFList = list(phjExecutor.map(phjFitDiseaseTrendSeries,
+                                                       phjSeriesDFList,
+                                                       itertools.repeat(phjYearVarName),
+                                                       itertools.repeat(phjPositivesVarName),
+                                                       itertools.repeat(phjNegativesVarName),
+                                                       itertools.repeat(phjTotalVarName),
+                                                       itertools.repeat(phjForecastYearsList),
+                                                       itertools.repeat(phjAlpha),
+                                                       chunksize = max(1,len(phjSeriesDFList) // (4 * phjNumberOfWorkersInt))))
+        
+        else:
+            phjSeriesDFList = [phjFitDiseaseTrendSeries(phjSeriesDF = phjSeriesDF,
+                                                        phjYearVarName = phjYearVarName,
+                                                        phjPositivesVarName = phjPositivesVarName,
+                                                        phjNegativesVarName = phjNegativesVarName,
+                                                        phjTotalVarName = phjTotalVarName,
+                                                        phjForecastYearsList = phjForecastYearsList,
+                                                        phjAlpha = phjAlpha) for phjSeriesDF in phjSeriesDFList]
+        
+        # Add the series identifiers back to each table (including rows of forecast years)
+        for phjKey, phjSeriesDF in zip(phjSeriesKeysList,phjSeriesDFList):
+            for phjPosition, (phjVarName, phjValue) in enumerate(zip(phjSeriesVarNamesList,phjKey)):
+                phjSeriesDF.insert(loc = phjPosition,
+                                   column = phjVarName,
+                                   value = phjValue)
             
             # Plot actual proportion as barchart and predicted probabilities as line
-            if (phjPlotProportions == True) | (phjPlotPrediction == True):
-                
-                fig = plt.figure(figsize = (10,6))
-                ax = fig.add_subplot(111)
-                
-                if phjPlotProportions == True:
-                    rects = ax.bar(phjPropDF[phjYearVarName],
-                                   phjPropDF[phjProbName],
-                                   yerr = [phjPropDF[phjProbCILowIntName],
-                                           phjPropDF[phjProbCIUppIntName]],
-                                   capsize = 4)
-                
-                if phjPlotPrediction == True:
-                    # Only plot trend line if logistic regression model converge. Otherwise, just plot bars.
-                    if model.mle_retvals['converged']:
-                        # Plot pred prob
-                        pprobline = ax.plot(phjPropDF[phjYearVarName],
-                                            phjPropDF[phjPredProbName],
-                                            linestyle = 'solid',
-                                            color = 'green')
-                        
-                        # Plot lower limit of ci for pred prob
-                        pprobllimline = ax.plot(phjPropDF[phjYearVarName],
-                                                phjPropDF[phjPredProbCILowLimName],
-                                                linestyle = 'dashed',
-                                                color = 'red')
-                        
-                        # Plot upper limit of ci for pred prob
-                        pprobulimline = ax.plot(phjPropDF[phjYearVarName],
-                                                phjPropDF[phjPredProbCIUppLimName],
-                                                linestyle = 'dashed',
-                                                color = 'red')
-                        
-                        phjText = "Trend line p-value = {0:.4f}".format(model.pvalues[phjYearVarName])
-                    
-                    else:
-                        phjText = "Logistic regression model failed to converge"
-                    
-                    # Add p value for logistic regression model (or failure-to-converge notice)
-                    ax.text(ax.get_xlim()[1],
-                            ax.get_ylim()[1],
-                            phjText,
-                            horizontalalignment = 'right',
-                            verticalalignment = 'bottom')
-                
-                ax.set_xlabel(phjYearVarName)
-                ax.set_ylabel('Proportion / probability')
-                ax.set_title(phjGraphTitleStr)
-                
-                major_xticks = phjPropDF[phjYearVarName].tolist()
-                ax.set_xticks(major_xticks, minor = False)
-                
-                plt.show()
+            if phjPlotResults == True:
+                phjPlotDiseaseTrend(phjPropDF = phjSeriesDF,
+                                    phjYearVarName = phjYearVarName,
+                                    phjConvergedBool = bool(phjSeriesDF[phjSuffixDict['converged']].iloc[0]),
+                                    phjTrendPValue = phjSeriesDF[phjSuffixDict['joinstr'].join([phjYearVarName,phjSuffixDict['pvalue']])].iloc[0],
+                                    phjPlotProportions = True,
+                                    phjPlotPrediction = True,
+                                    phjGraphTitleStr = ', '.join([str(i) for i in phjKey]),
+                                    phjAlpha = phjAlpha)
+        
+        phjTrendDF = pd.concat(phjSeriesDFList,
+                               ignore_index = True,
+                               sort = False)
         
+        if phjPrintResults == True:
+            with pd.option_context('display.max_rows',10, 'display.max_columns',10):
+                print(phjTrendDF)
+            print('\n')
+    
     finally:
         
-        return phjPropDF
+        return phjTrendDF
  
  
  
@@ -1116,6 +1249,21 @@ def phjDefineSuffixDict(phjAlpha = 0.05):
                      'katz':'katz',                                    # Used to describe Katz confidence interval of RR
                      'kooperman':'kooperman',                          # Used to describe Kooperman confidence interval of RR
                      'adj_log':'adj_log',                              # Used to estimate CI for relative risk is cells contain zero
+                     'bootpercentile':'bootpct',                       # Used to describe bootstrap percentile CI of RR or OR
+                     'bootbca':'bootbca',                              # Used to describe bootstrap bias-corrected and accelerated CI of RR or OR
+                     'exact':'exact',                                  # Used to describe exact conditional (Fisher) CI of OR
+                     'midp':'midp',                                    # Used to describe mid-p exact CI of OR
+                     'rbg':'rbg',                                      # Used to describe Robins-Breslow-Greenland CI of Mantel-Haenszel OR
+                     'gr':'gr',                                        # Used to describe Greenland-Robins CI of Mantel-Haenszel RR
+                     'matchedsets':'sets',                             # Number of matched sets
+                     'strata':'strata',                                # Number of strata
+                     'homogeneity':'homog',                            # Test of homogeneity across strata
+                     'chisquare':'chi2',                               # Chi-square statistic
+                     'degreesfreedom':'df',                            # Degrees of freedom
+                     'pvalue':'pvalue',                                # P-value
+                     'cimethod':'cimethod',                            # Method used to calculate confidence interval
+                     'coefficient':'coef',                             # Regression model coefficient
+                     'converged':'converged',                          # Indicates whether regression model converged
                      'risk':'risk',                                    # Risk suffix
                      'relrisk':'rr',                                   # Relative risk suffix
                      'odds':'odds',                                    # Odds suffix
@@ -1137,21 +1285,82 @@ def phjCISuffix(phjAlpha,
  
  
  
+def phjGetNonMissingMask(phjDF,
+                         phjVarNamesList,
+                         phjMissingValue = np.nan,
+                         phjWhiteSpaceIsMissing = True):
+ 
+    # Returns a boolean numpy array that is True for rows in which none of the listed
+    # variables is missing. A value is missing if it is np.nan (or None), if it equals
+    # phjMissingValue or, if phjWhiteSpaceIsMissing is True, if it is an empty string
+    # (or a string consisting only of white-space). This function is used by all functions
+    # that need to remove missing values: only the listed columns are examined, the
+    # white-space regex is only applied to object and string columns and the dataframe is
+    # never copied; the returned mask can be used to select the required rows.
+    phjMaskArr = np.ones(len(phjDF.index),dtype = bool)
+ 
+    phjCheckMissingValue = isinstance(phjMissingValue,str) or not np.isnan(phjMissingValue)
+ 
+    for phjVarName in phjVarNamesList:
+        phjSer = phjDF[phjVarName]
+ 
+        phjMaskArr &= phjSer.notna().to_numpy()
+ 
+        if phjWhiteSpaceIsMissing and ((phjSer.dtype == object) or pd.api.types.is_string_dtype(phjSer.dtype)):
+            try:
+                phjMaskArr &= ~(phjSer.str.fullmatch(r'\s*',na = False).to_numpy(dtype = bool))
+            except AttributeError:
+                # Object column that does not contain any strings
+                pass
+ 
+        if phjCheckMissingValue:
+            phjMaskArr &= (phjSer != phjMissingValue).to_numpy()
+ 
+    return phjMaskArr
+ 
+ 
+ 
 def phjCountSuccesses(x,
                       phjColumnsList,
                       phjSuccessValue = 'yes',
-                      phjMissingValue = 'missing'):
+                      phjMissingValue = 'missing',
+                      phjGroupVarName = None):
  
     # Get a list of the terms used to head columns in summary tables.
     # (The alpha value is not required and can be left as default.)
     phjSuffixDict = phjDefineSuffixDict()
  
-    phjSummaryDF = pd.DataFrame(index = phjColumnsList, columns = [phjSuffixDict['numbertrials'],
-                                                                   phjSuffixDict['numbersuccesses']])
+    # The numbers of trials and successes for all columns are calculated at once. A 2-D
+    # array (rows x columns) indicates which values are not missing and a second array
+    # indicates which values are successes (and not missing).
+    phjValidArr = np.column_stack([phjGetNonMissingMask(phjDF = x,
+                                                        phjVarNamesList = [var],
+                                                        phjMissingValue = phjMissingValue,
+                                                        phjWhiteSpaceIsMissing = False) for var in phjColumnsList])
+ 
+    phjSuccessArr = (x[phjColumnsList] == phjSuccessValue).to_numpy(dtype = bool) & phjValidArr
+ 
+    if phjGroupVarName is None:
+        phjSummaryDF = pd.DataFrame({phjSuffixDict['numbertrials']: phjValidArr.sum(axis = 0).astype(np.int64),
+                                     phjSuffixDict['numbersuccesses']: phjSuccessArr.sum(axis = 0).astype(np.int64)},
+                                    index = phjColumnsList)
+ 
+    else:
+        # A single grouped sum of both arrays gives the counts for every group and column.
+        # The returned dataframe has a (group, column) multi-index, as would be produced by
+        # applying this function to each group in turn. (Rows with a missing group value
+        # are excluded, as in groupby().)
+        phjCountsDF = pd.DataFrame(np.hstack([phjValidArr,phjSuccessArr]).astype(np.int64),
+                                   index = x.index)
+ 
+        phjCountsDF = phjCountsDF.groupby(x[phjGroupVarName],sort = True).sum()
+ 
+        phjNumColsInt = len(phjColumnsList)
  
-    for var in phjColumnsList:
-        phjSummaryDF.loc[var,phjSuffixDict['numbertrials']] = ((x[var].replace(phjMissingValue,np.nan).dropna()) == phjSuccessValue).count()
-        phjSummaryDF.loc[var,phjSuffixDict['numbersuccesses']] = ((x[var].replace(phjMissingValue,np.nan).dropna()) == phjSuccessValue).sum()
+        phjSummaryDF = pd.DataFrame({phjSuffixDict['numbertrials']: phjCountsDF.iloc[:,:phjNumColsInt].to_numpy().ravel(),
+                                     phjSuffixDict['numbersuccesses']: phjCountsDF.iloc[:,phjNumColsInt:].to_numpy().ravel()},
+                                    index = pd.MultiIndex.from_product([phjCountsDF.index,phjColumnsList],
+                                                                       names = [phjGroupVarName,None]))
  
     return phjSummaryDF
  
@@ -1162,15 +1371,16 @@ def phjKeepRequiredData(phjDF,
                         phjGroupVarName = None,
                         phjMissingValue = 'missing'):
  
-    # Copy required columns to dataframe
+    # Retain required columns and remove rows with missing values
     if phjGroupVarName is not None:
-        phjDF = phjDF.loc[:,[phjGroupVarName] + phjColumnsList].copy()
-    else:
-        phjDF = phjDF.loc[:,phjColumnsList].copy()
+        phjColumnsList = [phjGroupVarName] + phjColumnsList
  
-    # Remove rows with missing values
-    phjDF = phjDF.replace(phjMissingValue,np.nan)
-    phjDF = phjDF.dropna(axis = 0, how = 'any')
+    phjMaskArr = phjGetNonMissingMask(phjDF = phjDF,
+                                      phjVarNamesList = phjColumnsList,
+                                      phjMissingValue = phjMissingValue,
+                                      phjWhiteSpaceIsMissing = False)
+ 
+    phjDF = phjDF.loc[phjMaskArr,phjColumnsList]
  
     return phjDF
  
@@ -1210,25 +1420,132 @@ def phjGetGroupLevelsList(phjDF,
  
  
  
-def phjCalculateMultinomialConfInts(phjDF,
-                                    phjAbsFreqColumnName = None,
-                                    phjSimultConfIntColumnName = None,
+def phjCalculateBinomialConfIntLimits(phjSuccArr,
+                                     phjTotalArr,
+                                     phjBinomialConfIntMethod = 'normal',
+                                     phjAlpha = 0.05):
+ 
+    # Binomial confidence intervals are calculated over whole arrays using the same
+    # formulae as statsmodels proportion_confint() but without converting to and from
+    # pandas objects.
+    phjSuccArr = np.asarray(phjSuccArr,dtype = np.float64)
+    phjTotalArr = np.asarray(phjTotalArr,dtype = np.float64)
+ 
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        phjPropArr = phjSuccArr / phjTotalArr
+ 
+        if phjBinomialConfIntMethod == 'normal':
+            phjDistArr = norm.isf(phjAlpha/2) * np.sqrt(phjPropArr * (1 - phjPropArr) / phjTotalArr)
+            phjCILowLimArr = phjPropArr - phjDistArr
+            phjCIUppLimArr = phjPropArr + phjDistArr
+ 
+        elif phjBinomialConfIntMethod == 'agresti_coull':
+            phjCrit = norm.isf(phjAlpha/2)
+            phjTotalAdjArr = phjTotalArr + phjCrit**2
+            phjPropAdjArr = (phjSuccArr + phjCrit**2 / 2) / phjTotalAdjArr
+            phjDistArr = phjCrit * np.sqrt(phjPropAdjArr * (1 - phjPropAdjArr) / phjTotalAdjArr)
+            phjCILowLimArr = phjPropAdjArr - phjDistArr
+            phjCIUppLimArr = phjPropAdjArr + phjDistArr
+ 
+        elif phjBinomialConfIntMethod == 'wilson':
+            phjCrit2 = norm.isf(phjAlpha/2)**2
+            phjDenomArr = 1 + phjCrit2 / phjTotalArr
+            phjCentreArr = (phjPropArr + phjCrit2 / (2 * phjTotalArr)) / phjDenomArr
+            phjDistArr = np.sqrt(phjCrit2) * np.sqrt(phjPropArr * (1 - phjPropArr) / phjTotalArr + phjCrit2 / (4 * phjTotalArr**2)) / phjDenomArr
+            phjCILowLimArr = phjCentreArr - phjDistArr
+            phjCIUppLimArr = phjCentreArr + phjDistArr
+ 
+        else:
+            # The remaining intervals require numerical inversion of the beta distribution
+            # (or an iterative search in the case of binom_test) which is slow. However,
+            # in large tables, the same combinations of successes and trials occur many
+            # times and, therefore, limits are only calculated once for each unique
+            # combination and then mapped back to all rows.
+            # (N.B. Missing values are coded as -1 by factorize() and are shifted to zero
+            # before the codes for successes and trials are combined.)
+            phjSuccCodesArr = pd.factorize(phjSuccArr)[0].astype(np.int64) + 1
+            phjTotalCodesArr = pd.factorize(phjTotalArr)[0].astype(np.int64) + 1
+            
+            phjPairCodesArr, phjPairUniqueArr = pd.factorize(phjSuccCodesArr * (phjTotalCodesArr.max(initial = 0) + 1) + phjTotalCodesArr)
+            
+            # Identify a row containing each unique combination (it doesn't matter which)
+            phjRowArr = np.zeros(len(phjPairUniqueArr),dtype = np.int64)
+            phjRowArr[phjPairCodesArr] = np.arange(len(phjPairCodesArr))
+            
+            phjUniqueSuccArr = phjSuccArr[phjRowArr]
+            phjUniqueTotalArr = phjTotalArr[phjRowArr]
+            phjUniquePropArr = phjUniqueSuccArr / phjUniqueTotalArr
+            
+            if phjBinomialConfIntMethod == 'jeffreys':
+                phjCILowLimArr = beta.ppf(phjAlpha/2,phjUniqueSuccArr + 0.5,phjUniqueTotalArr - phjUniqueSuccArr + 0.5)
+                phjCIUppLimArr = beta.isf(phjAlpha/2,phjUniqueSuccArr + 0.5,phjUniqueTotalArr - phjUniqueSuccArr + 0.5)
+            
+            elif phjBinomialConfIntMethod == 'beta':
+                # Clopper-Pearson interval. The limits are undefined when there are no successes
+                # or no failures and are set to 0 and 1 respectively.
+                phjCILowLimArr = np.where(phjUniquePropArr == 0,0,beta.ppf(phjAlpha/2,phjUniqueSuccArr,phjUniqueTotalArr - phjUniqueSuccArr + 1))
+                phjCIUppLimArr = np.where(phjUniquePropArr == 1,1,beta.isf(phjAlpha/2,phjUniqueSuccArr + 1,phjUniqueTotalArr - phjUniqueSuccArr))
+            
+            else:
+                phjCILowLimArr, phjCIUppLimArr = smprop.proportion_confint(count = phjUniqueSuccArr,
+                                                                           nobs = phjUniqueTotalArr,
+                                                                           alpha = phjAlpha,
+                                                                           method = phjBinomialConfIntMethod)
+            
+            phjCILowLimArr = np.asarray(phjCILowLimArr,dtype = np.float64)[phjPairCodesArr]
+            phjCIUppLimArr = np.asarray(phjCIUppLimArr,dtype = np.float64)[phjPairCodesArr]
+ 
+    # Intervals based on the normal approximation are truncated to lie between 0 and 1
+    if phjBinomialConfIntMethod in ['normal','agresti_coull','wilson']:
+        phjCILowLimArr = np.clip(phjCILowLimArr,0,1)
+        phjCIUppLimArr = np.clip(phjCIUppLimArr,0,1)
+ 
+    return np.asarray(phjCILowLimArr,dtype = np.float64), np.asarray(phjCIUppLimArr,dtype = np.float64)
+ 
+ 
+ 
+def phjCalculateMultinomialConfInts(phjCountsArr,
                                     phjMultinomialConfIntMethod = 'goodman',
-                                    phjAlpha = 0.05,
-                                    phjPrintResults = False):
+                                    phjAlpha = 0.05):
  
-    # Get a list of the terms used to head columns in summary tables
-    phjSuffixDict = phjDefineSuffixDict(phjAlpha = phjAlpha)
+    # Simultaneous confidence intervals are calculated separately for each column
+    # (group) of the 2-dimensional array of counts (categories x groups) using only
+    # those categories that were observed in the group. Categories that were not
+    # observed in a group are given limits of zero.
+    phjCountsArr = np.asarray(phjCountsArr,dtype = float)
+    phjObservedArr = phjCountsArr > 0
  
-    # Get simultaneous confidence intervals
-    phjSimultConfIntArr = smprop.multinomial_proportions_confint(phjDF[phjAbsFreqColumnName],
-                                                                 alpha = phjAlpha,
-                                                                 method = phjMultinomialConfIntMethod)
+    phjCILowLimArr = np.zeros(phjCountsArr.shape)
+    phjCIUppLimArr = np.zeros(phjCountsArr.shape)
  
-    phjDF[phjSuffixDict['joinstr'].join([phjSimultConfIntColumnName,phjSuffixDict['cilowlim']])] = [i[0] for i in phjSimultConfIntArr]
-    phjDF[phjSuffixDict['joinstr'].join([phjSimultConfIntColumnName,phjSuffixDict['ciupplim']])] = [i[1] for i in phjSimultConfIntArr]
+    if phjMultinomialConfIntMethod == 'goodman':
+        # Goodman intervals have a closed form and are calculated for all groups at
+        # once using the same formula as statsmodels multinomial_proportions_confint().
+        phjNArr = phjCountsArr.sum(axis = 0)
+        phjKArr = phjObservedArr.sum(axis = 0)
  
-    return phjDF
+        phjChi2Arr = chi2.ppf(1 - (phjAlpha / np.maximum(phjKArr,1)),1)
+        phjPropArr = phjCountsArr / np.maximum(phjNArr,1)
+ 
+        phjDeltaArr = phjChi2Arr**2 + (4 * phjNArr * phjPropArr * phjChi2Arr * (1 - phjPropArr))
+ 
+        phjCILowLimArr = np.where(phjObservedArr,(2 * phjNArr * phjPropArr + phjChi2Arr - np.sqrt(phjDeltaArr)) / (2 * (phjChi2Arr + phjNArr)),0)
+        phjCIUppLimArr = np.where(phjObservedArr,(2 * phjNArr * phjPropArr + phjChi2Arr + np.sqrt(phjDeltaArr)) / (2 * (phjChi2Arr + phjNArr)),0)
+ 
+    else:
+        # Sison-Glaz intervals require an iterative search for each group
+        for phjGroupIndex in range(phjCountsArr.shape[1]):
+            phjRowsArr = phjObservedArr[:,phjGroupIndex]
+ 
+            if phjRowsArr.any():
+                phjSimultConfIntArr = smprop.multinomial_proportions_confint(phjCountsArr[phjRowsArr,phjGroupIndex],
+                                                                             alpha = phjAlpha,
+                                                                             method = phjMultinomialConfIntMethod)
+ 
+                phjCILowLimArr[phjRowsArr,phjGroupIndex] = phjSimultConfIntArr[:,0]
+                phjCIUppLimArr[phjRowsArr,phjGroupIndex] = phjSimultConfIntArr[:,1]
+ 
+    return phjCILowLimArr, phjCIUppLimArr
  
  
  
@@ -1374,6 +1691,328 @@ def phjGetYErrors(phjDF,
     #    print(phjYErrors)
  
     return phjYErrors
+ 
+ 
+ 
+def phjPredictTrendProbabilities(phjModel,
+                                 phjExogDF,
+                                 phjPredProbName,
+                                 phjPredProbSEName,
+                                 phjPredProbCILowLimName,
+                                 phjPredProbCIUppLimName,
+                                 phjAlpha = 0.05):
+    
+    # Predicted probabilities and their standard errors are only calculated
+    # once for each unique row of the design matrix.
+    phjExogDF = phjExogDF.drop_duplicates(keep = 'first').reset_index(drop = True)
+    phjExogArr = phjExogDF.to_numpy(dtype = float)
+    
+    # Calculate predicted probabilities
+    phjPredProbArr = phjModel.predict(phjExogArr)
+    
+    # Estimate confidence interval for predicted probabilities using Delta method
+    # This method is taken from an answer by David Dale on StackOverflow (see https://stackoverflow.com/questions/47414842/confidence-interval-of-probability-prediction-from-logistic-regression-statsmode/47419474).
+    # The gradient of the predicted probability with respect to the parameters is p(1-p)x
+    # and the variance of each prediction (g.cov.g) is calculated for all rows at once.
+    phjCovArr = np.asarray(phjModel.cov_params())
+    phjGradientArr = (phjPredProbArr * (1 - phjPredProbArr))[:,np.newaxis] * phjExogArr
+    phjPredProbSEArr = np.sqrt(np.einsum('ij,jk,ik->i',phjGradientArr,phjCovArr,phjGradientArr))
+    
+    phjExogDF[phjPredProbName] = phjPredProbArr
+    phjExogDF[phjPredProbSEName] = phjPredProbSEArr
+    
+    # Calculate confidence intervals. The max(0,min(1,interval)) construct ensures that
+    # the interval does not extend beyond 1 or 0. Again this was taken from the answer
+    # by David Dale on StackOverflow.
+    # N.B. The norm.ppf(0.025) is negative therefore equates to mean minus interval.
+    phjExogDF[phjPredProbCILowLimName] = np.maximum(0,np.minimum(1,phjPredProbArr + (norm.ppf(phjAlpha/2) * phjPredProbSEArr)))
+    phjExogDF[phjPredProbCIUppLimName] = np.maximum(0,np.minimum(1,phjPredProbArr + (norm.ppf(1 - (phjAlpha/2)) * phjPredProbSEArr)))
+    
+    return phjExogDF
+ 
+ 
+ 
+def phjFitDiseaseTrend(phjPropDF,
+                       phjYearVarName,
+                       phjPositivesVarName = None,
+                       phjNegativesVarName = None,
+                       phjTotalVarName = None,
+                       phjForecastYearsList = None,
+                       phjAlpha = 0.05):
+    
+    # Get a list of the terms used to head columns in summary tables
+    phjSuffixDict = phjDefineSuffixDict(phjAlpha = phjAlpha)
+    
+    phjPredProbName = ''.join([phjSuffixDict['predicted'],phjSuffixDict['probability']])
+    phjPredProbSEName = phjSuffixDict['joinstr'].join([phjPredProbName,phjSuffixDict['stderr']])
+    phjPredProbCILowLimName = phjSuffixDict['joinstr'].join([phjPredProbName,phjSuffixDict['cisuffix'],phjSuffixDict['cilowlim']])
+    phjPredProbCIUppLimName = phjSuffixDict['joinstr'].join([phjPredProbName,phjSuffixDict['cisuffix'],phjSuffixDict['ciupplim']])
+    
+    # Logistic regression model
+    # The model is fitted as a binomial GLM using the number of successes and
+    # failures in each year rather than by expanding the summary table to one
+    # row per subject and fitting a Logit model. The log-likelihoods differ only
+    # by a constant and, therefore, the estimates are identical but the design
+    # matrix contains one row per year rather than one row per subject.
+    if phjPositivesVarName is not None:
+        phjSuccSer = phjPropDF[phjPositivesVarName]
+    else:
+        phjSuccSer = phjPropDF[phjTotalVarName] - phjPropDF[phjNegativesVarName]
+    
+    if phjNegativesVarName is not None:
+        phjFailSer = phjPropDF[phjNegativesVarName]
+    else:
+        phjFailSer = phjPropDF[phjTotalVarName] - phjPropDF[phjPositivesVarName]
+    
+    phjSuccArr = phjSuccSer.to_numpy(dtype = np.float64)
+    phjFailArr = phjFailSer.to_numpy(dtype = np.float64)
+    phjYearArr = phjPropDF[phjYearVarName].to_numpy(dtype = np.float64)
+    
+    # Rows with missing values are not included in the model
+    phjMaskArr = ~(np.isnan(phjSuccArr) | np.isnan(phjFailArr) | np.isnan(phjYearArr))
+    
+    # The design matrix (intercept and year) is created directly rather than from a
+    # patsy formula; when many series are fitted by phjBatchAnnualDiseaseTrend(), building
+    # the design matrices with patsy takes longer than fitting the models. The endogenous
+    # variable consists of two columns (successes and failures).
+    y = np.column_stack([phjSuccArr[phjMaskArr],phjFailArr[phjMaskArr]])
+    X = pd.DataFrame({'Intercept': np.ones(phjMaskArr.sum()),
+                      phjYearVarName: phjYearArr[phjMaskArr]})
+    
+    model = sm.GLM(endog = y,
+                   exog = X,
+                   family = sm.families.Binomial()).fit()
+    
+    # Calculate predicted probabilities and associated confidence intervals.
+    # Predictions are only calculated once for each year.
+    phjPredDF = phjPredictTrendProbabilities(phjModel = model,
+                                             phjExogDF = X,
+                                             phjPredProbName = phjPredProbName,
+                                             phjPredProbSEName = phjPredProbSEName,
+                                             phjPredProbCILowLimName = phjPredProbCILowLimName,
+                                             phjPredProbCIUppLimName = phjPredProbCIUppLimName,
+                                             phjAlpha = phjAlpha)
+    
+    # Join predicted probabilities with original dataframe
+    phjPropDF = phjPropDF.merge(right = phjPredDF,
+                                left_on = phjYearVarName,
+                                right_on = phjYearVarName)
+    
+    # Predictions for years that were not included in the original data (e.g.
+    # forecasts for future years) are calculated from the fitted model and
+    # appended to the dataframe.
+    if phjForecastYearsList is not None:
+        phjForecastYearsList = [i for i in dict.fromkeys(phjForecastYearsList) if i not in phjPropDF[phjYearVarName].tolist()]
+        
+        if len(phjForecastYearsList) > 0:
+            phjForecastX = pd.DataFrame({'Intercept': np.ones(len(phjForecastYearsList)),
+                                         phjYearVarName: np.asarray(phjForecastYearsList,dtype = np.float64)})
+            
+            phjForecastDF = phjPredictTrendProbabilities(phjModel = model,
+                                                         phjExogDF = phjForecastX,
+                                                         phjPredProbName = phjPredProbName,
+                                                         phjPredProbSEName = phjPredProbSEName,
+                                                         phjPredProbCILowLimName = phjPredProbCILowLimName,
+                                                         phjPredProbCIUppLimName = phjPredProbCIUppLimName,
+                                                         phjAlpha = phjAlpha)
+            
+            # The design matrix stores years as floats so replace with original values
+            phjForecastDF[phjYearVarName] = phjForecastYearsList
+            
+            # Forecast rows do not contain counts and appending them converts integer
+            # count columns to floats; these columns are converted to nullable integers
+            # so that observed counts are still shown as integers.
+            phjCountVarNamesList = [i for i in [phjPositivesVarName,phjNegativesVarName,phjTotalVarName] if (i is not None) and pd.api.types.is_integer_dtype(phjPropDF[i])]
+            
+            phjPropDF = pd.concat([phjPropDF,phjForecastDF],
+                                  ignore_index = True,
+                                  sort = False)
+            
+            phjPropDF = phjPropDF.astype({i: 'Int64' for i in phjCountVarNamesList})
+    
+    return model, phjPropDF
+ 
+ 
+ 
+def phjFitDiseaseTrendSeries(phjSeriesDF,
+                             phjYearVarName,
+                             phjPositivesVarName = None,
+                             phjNegativesVarName = None,
+                             phjTotalVarName = None,
+                             phjForecastYearsList = None,
+                             phjAlpha = 0.05):
+    
+    # Fits the trend model for a single series (called by phjBatchAnnualDiseaseTrend())
+    # and adds the coefficients, their confidence intervals and the trend p-value to
+    # every row of the returned table.
+    phjSuffixDict = phjDefineSuffixDict(phjAlpha = phjAlpha)
+    
+    phjInterceptCoefName = phjSuffixDict['joinstr'].join(['Intercept',phjSuffixDict['coefficient']])
+    phjYearCoefName = phjSuffixDict['joinstr'].join([phjYearVarName,phjSuffixDict['coefficient']])
+    phjYearSEName = phjSuffixDict['joinstr'].join([phjYearVarName,phjSuffixDict['stderr']])
+    phjYearCILowLimName = phjSuffixDict['joinstr'].join([phjYearVarName,phjSuffixDict['cisuffix'],phjSuffixDict['cilowlim']])
+    phjYearCIUppLimName = phjSuffixDict['joinstr'].join([phjYearVarName,phjSuffixDict['cisuffix'],phjSuffixDict['ciupplim']])
+    phjYearPValueName = phjSuffixDict['joinstr'].join([phjYearVarName,phjSuffixDict['pvalue']])
+    
+    # A failure to fit the model for one series (e.g. a series containing a single
+    # year) should not prevent the remaining series being fitted; the coefficients for
+    # that series are recorded as missing values instead. A series in which there are
+    # no positives (or no negatives) in any year is perfectly separated: the model
+    # appears to converge but the estimates are meaningless and, therefore, these series
+    # are not fitted. (Surveillance data commonly contain many such series.)
+    if phjPositivesVarName is not None:
+        phjSuccSer = phjSeriesDF[phjPositivesVarName]
+    else:
+        phjSuccSer = phjSeriesDF[phjTotalVarName] - phjSeriesDF[phjNegativesVarName]
+    
+    if phjNegativesVarName is not None:
+        phjFailSer = phjSeriesDF[phjNegativesVarName]
+    else:
+        phjFailSer = phjSeriesDF[phjTotalVarName] - phjSeriesDF[phjPositivesVarName]
+    
+    try:
+        if phjSeriesDF[phjYearVarName].nunique() < 2:
+            raise ValueError("A trend cannot be estimated from fewer than 2 years.")
+        
+        if (phjSuccSer.sum() == 0) or (phjFailSer.sum() == 0):
+            raise ValueError("A trend cannot be estimated if all observations are positive or all are negative.")
+        
+        # Warnings about (quasi-)separation in individual series are not shown
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore',PerfectSeparationWarning)
+            
+            phjModel, phjSeriesDF = phjFitDiseaseTrend(phjPropDF = phjSeriesDF,
+                                                       phjYearVarName = phjYearVarName,
+                                                       phjPositivesVarName = phjPositivesVarName,
+                                                       phjNegativesVarName = phjNegativesVarName,
+                                                       phjTotalVarName = phjTotalVarName,
+                                                       phjForecastYearsList = phjForecastYearsList,
+                                                       phjAlpha = phjAlpha)
+    
+    except (ValueError,np.linalg.LinAlgError):
+        phjSeriesDF[phjInterceptCoefName] = np.nan
+        phjSeriesDF[phjYearCoefName] = np.nan
+        phjSeriesDF[phjYearSEName] = np.nan
+        phjSeriesDF[phjYearCILowLimName] = np.nan
+        phjSeriesDF[phjYearCIUppLimName] = np.nan
+        phjSeriesDF[phjYearPValueName] = np.nan
+        phjSeriesDF[phjSuffixDict['converged']] = False
+    
+    else:
+        phjConfIntDF = phjModel.conf_int(alpha = phjAlpha)
+        
+        phjSeriesDF = phjSeriesDF.drop(columns = ['Intercept'])
+        phjSeriesDF[phjInterceptCoefName] = phjModel.params['Intercept']
+        phjSeriesDF[phjYearCoefName] = phjModel.params[phjYearVarName]
+        phjSeriesDF[phjYearSEName] = phjModel.bse[phjYearVarName]
+        phjSeriesDF[phjYearCILowLimName] = phjConfIntDF.loc[phjYearVarName,0]
+        phjSeriesDF[phjYearCIUppLimName] = phjConfIntDF.loc[phjYearVarName,1]
+        phjSeriesDF[phjYearPValueName] = phjModel.pvalues[phjYearVarName]
+        phjSeriesDF[phjSuffixDict['converged']] = bool(phjModel.converged)
+    
+    return phjSeriesDF
+ 
+ 
+ 
+def phjPlotDiseaseTrend(phjPropDF,
+                        phjYearVarName,
+                        phjConvergedBool,
+                        phjTrendPValue,
+                        phjPlotProportions = True,
+                        phjPlotPrediction = True,
+                        phjGraphTitleStr = None,
+                        phjAlpha = 0.05):
+    
+    # Get a list of the terms used to head columns in summary tables
+    phjSuffixDict = phjDefineSuffixDict(phjAlpha = phjAlpha)
+    
+    phjProbName = phjSuffixDict['proportion']
+    phjProbCILowIntName = phjSuffixDict['joinstr'].join([phjSuffixDict['cisuffix'],phjSuffixDict['cilowint']])
+    phjProbCIUppIntName = phjSuffixDict['joinstr'].join([phjSuffixDict['cisuffix'],phjSuffixDict['ciuppint']])
+    
+    phjPredProbName = ''.join([phjSuffixDict['predicted'],phjSuffixDict['probability']])
+    phjPredProbCILowLimName = phjSuffixDict['joinstr'].join([phjPredProbName,phjSuffixDict['cisuffix'],phjSuffixDict['cilowlim']])
+    phjPredProbCIUppLimName = phjSuffixDict['joinstr'].join([phjPredProbName,phjSuffixDict['cisuffix'],phjSuffixDict['ciupplim']])
+    
+    fig = plt.figure(figsize = (10,6))
+    ax = fig.add_subplot(111)
+    
+    if phjPlotProportions == True:
+        rects = ax.bar(phjPropDF[phjYearVarName],
+                       phjPropDF[phjProbName],
+                       yerr = [phjPropDF[phjProbCILowIntName],
+                               phjPropDF[phjProbCIUppIntName]],
+                       capsize = 4)
+    
+    if phjPlotPrediction == True:
+        # Only plot trend line if logistic regression model converge. Otherwise, just plot bars.
+        if phjConvergedBool == True:
+            # Plot pred prob
+            pprobline = ax.plot(phjPropDF[phjYearVarName],
+                                phjPropDF[phjPredProbName],
+                                linestyle = 'solid',
+                                color = 'green')
+            
+            # Plot lower limit of ci for pred prob
+            pprobllimline = ax.plot(phjPropDF[phjYearVarName],
+                                    phjPropDF[phjPredProbCILowLimName],
+                                    linestyle = 'dashed',
+                                    color = 'red')
+            
+            # Plot upper limit of ci for pred prob
+            pprobulimline = ax.plot(phjPropDF[phjYearVarName],
+                                    phjPropDF[phjPredProbCIUppLimName],
+                                    linestyle = 'dashed',
+                                    color = 'red')
+            
+            phjText = "Trend line p-value = {0:.4f}".format(phjTrendPValue)
+        
+        else:
+            phjText = "Logistic regression model failed to converge"
+        
+        # Add p value for logistic regression model (or failure-to-converge notice)
+        ax.text(ax.get_xlim()[1],
+                ax.get_ylim()[1],
+                phjText,
+                horizontalalignment = 'right',
+                verticalalignment = 'bottom')
+    
+    ax.set_xlabel(phjYearVarName)
+    ax.set_ylabel('Proportion / probability')
+    ax.set_title(phjGraphTitleStr)
+    
+    major_xticks = phjPropDF[phjYearVarName].tolist()
+    ax.set_xticks(major_xticks, minor = False)
+    
+    plt.show()
+    
+    return
+ 
+ 
+ 
+def phjGenerateBinaryOutcomeChunks(phjDF,
+                                   phjCountVarName,
+                                   phjChunkSizeInt):
+    
+    # Each row of phjDF represents phjDF[phjCountVarName] rows of the expanded data.
+    # The cumulative counts are used to identify which row of phjDF each row of the
+    # expanded data comes from, so that only phjChunkSizeInt rows are created at a time.
+    phjCumCountArr = np.cumsum(phjDF[phjCountVarName].to_numpy(dtype = np.int64))
+    phjTotalInt = int(phjCumCountArr[-1]) if len(phjCumCountArr) > 0 else 0
+    
+    phjDF = phjDF[[x for x in phjDF.columns if x != phjCountVarName]]
+    
+    for phjStartInt in range(0,phjTotalInt,phjChunkSizeInt):
+        phjStopInt = min(phjStartInt + phjChunkSizeInt,phjTotalInt)
+        
+        phjRowsArr = np.searchsorted(phjCumCountArr,
+                                     np.arange(phjStartInt,phjStopInt),
+                                     side = 'right')
+        
+        phjChunkDF = phjDF.iloc[phjRowsArr]
+        phjChunkDF.index = pd.RangeIndex(phjStartInt,phjStopInt)
+        
+        yield phjChunkDF
 
 
 
@@ -70,6 +70,7 @@ from .phjRROR import phjOddsRatio
 from .phjRROR import phjRemoveNaNRows
 from .phjCalculateProportions import phjDefineSuffixDict
 from .phjCalculateProportions import phjGetYErrors
+from .phjCalculateProportions import phjGetNonMissingMask
 from .phjExtFuncs import getJenksBreaks
 from .phjTestFunctionParameters import phjAssert
 
@@ -166,13 +167,16 @@ def phjCategoriseContinuousVariable(phjDF,
     
     else:
         # Deal with missing values in continuous variable by replacing missing value
-        # with np.nan.
+        # with np.nan (using the mask returned by phjGetNonMissingMask()).
         # If a variable contains a missing value string, the dtype is 'object'. If
         # the missing value string is replaced by np.nan then the variable is changed
-        # to 'float' and number strings are converted to actual numbers. However, if
-        # there is another string in the variable, the dtype remains as 'object'; the
-        # latter situation should have been identified by the assert statement above.
-        phjContinuousSer = phjDF[phjContinuousVarName].replace(phjMissingValue,np.nan)
+        # to 'float' (using infer_objects()). However, if there is another string in the
+        # variable, the dtype remains as 'object'; the latter situation should have been
+        # identified by the assert statement above.
+        phjContinuousSer = phjDF[phjContinuousVarName].where(phjGetNonMissingMask(phjDF = phjDF,
+                                                                                  phjVarNamesList = [phjContinuousVarName],
+                                                                                  phjMissingValue = phjMissingValue,
+                                                                                  phjWhiteSpaceIsMissing = False)).infer_objects()
         
         
         # Check if phjCategorisationMethod is a list.
@@ -280,7 +284,10 @@ def phjViewLogOdds(phjDF,
     try:
         phjAssert('phjDF',phjDF,pd.DataFrame)
         phjAssert('phjBinaryDepVarName',phjBinaryDepVarName,str,phjMustBePresentColumnList = list(phjDF.columns))
-        phjAssert('phjCaseValue',phjCaseValue,(str,int,float),phjAllowedOptions = list(phjDF[phjBinaryDepVarName].replace(phjMissingValue,np.nan).dropna().unique()))
+        phjAssert('phjCaseValue',phjCaseValue,(str,int,float),phjAllowedOptions = list(phjDF.loc[phjGetNonMissingMask(phjDF = phjDF,
+                                                                                                                      phjVarNamesList = [phjBinaryDepVarName],
+                                                                                                                      phjMissingValue = phjMissingValue,
+                                                                                                                      phjWhiteSpaceIsMissing = False),phjBinaryDepVarName].unique()))
         phjAssert('phjContIndepVarName',phjContIndepVarName,str,phjMustBePresentColumnList = list(phjDF.columns))
         phjAssert('phjMissingValue',phjMissingValue,(str,int,float))
         phjAssert('phjNumberOfCategoriesInt',phjNumberOfCategoriesInt,int,phjAllowedOptions = {'min':2,'max':len(phjDF.index)})
@@ -573,7 +580,10 @@ def phjImplementGetBreaks(phjDF,
                           phjCategorisationMethod = 'jenks',
                           phjPrintResults = False):
     
-    phjTempSer = phjDF[phjContinuousVarName].replace(phjMissingValue,np.nan).dropna(axis = 0)
+    phjTempSer = phjDF.loc[phjGetNonMissingMask(phjDF = phjDF,
+                                                phjVarNamesList = [phjContinuousVarName],
+                                                phjMissingValue = phjMissingValue,
+                                                phjWhiteSpaceIsMissing = False),phjContinuousVarName]
     
     if phjCategorisationMethod == 'jenks':
         if len(phjTempSer.index) <= 1000:
@@ -28,10 +28,16 @@ except pkg_resources.DistributionNotFound:
 else:
     scipyPresent = True
     from scipy.stats import norm
+    from scipy.stats import chi2
+    from scipy.special import gammaln
+    from scipy.optimize import brentq
 
 
 import math
 import inspect
+import itertools
+import functools
+import concurrent.futures
 
 
 # Import minor epydemiology functions from other epydemiology files
@@ -44,6 +50,7 @@ import inspect
 # For more details, see tutorial at https://www.youtube.com/watch?v=0oTh1CXRaQ0.
 
 from .phjCalculateProportions import phjDefineSuffixDict
+from .phjCalculateProportions import phjGetNonMissingMask
 
 from .phjTestFunctionParameters import phjAssert
 
@@ -55,6 +62,12 @@ def phjOddsRatio(phjDF,
                  phjRiskFactorBaseValue,
                  phjMissingValue = np.nan,
                  phjAlpha = 0.05,
+                 phjStratumVarName = None,    # If given, Mantel-Haenszel estimates adjusted for this variable are returned
+                 phjFreqVarName = None,       # If given, each row of phjDF represents this number of individuals
+                 phjContTableInput = False,   # If True, phjDF is a contingency table (risk factor levels as index, case and control values as columns)
+                 phjCIMethod = None,          # None (chosen automatically), 'bootpercentile', 'bootbca', 'exact' or 'midp'
+                 phjBootstrapReplicatesInt = 1000,
+                 phjRandomSeedInt = None,
                  phjPrintResults = False):
     
     try:
@@ -67,6 +80,12 @@ def phjOddsRatio(phjDF,
                                  phjRiskFactorBaseValue = phjRiskFactorBaseValue,
                                  phjMissingValue = phjMissingValue,
                                  phjAlpha = phjAlpha,
+                                 phjStratumVarName = phjStratumVarName,
+                                 phjFreqVarName = phjFreqVarName,
+                                 phjContTableInput = phjContTableInput,
+                                 phjCIMethod = phjCIMethod,
+                                 phjBootstrapReplicatesInt = phjBootstrapReplicatesInt,
+                                 phjRandomSeedInt = phjRandomSeedInt,
                                  phjPrintResults = phjPrintResults)
     
     except AssertionError as e:
@@ -96,6 +115,12 @@ def phjRelativeRisk(phjDF,
                     phjRiskFactorBaseValue,
                     phjMissingValue = np.nan,
                     phjAlpha = 0.05,
+                    phjStratumVarName = None,    # If given, Mantel-Haenszel estimates adjusted for this variable are returned
+                    phjFreqVarName = None,       # If given, each row of phjDF represents this number of individuals
+                    phjContTableInput = False,   # If True, phjDF is a contingency table (risk factor levels as index, case and control values as columns)
+                    phjCIMethod = None,          # None (chosen automatically), 'bootpercentile' or 'bootbca'
+                    phjBootstrapReplicatesInt = 1000,
+                    phjRandomSeedInt = None,
                     phjPrintResults = False):
     
     try:
@@ -108,6 +133,12 @@ def phjRelativeRisk(phjDF,
                                  phjRiskFactorBaseValue = phjRiskFactorBaseValue,
                                  phjMissingValue = phjMissingValue,
                                  phjAlpha = phjAlpha,
+                                 phjStratumVarName = phjStratumVarName,
+                                 phjFreqVarName = phjFreqVarName,
+                                 phjContTableInput = phjContTableInput,
+                                 phjCIMethod = phjCIMethod,
+                                 phjBootstrapReplicatesInt = phjBootstrapReplicatesInt,
+                                 phjRandomSeedInt = phjRandomSeedInt,
                                  phjPrintResults = phjPrintResults)
     
     except AssertionError as e:
@@ -130,6 +161,321 @@ def phjRelativeRisk(phjDF,
 
 
 
+def phjMatchedOddsRatio(phjDF,
+                        phjRiskFactorVarName,
+                        phjRiskFactorBaseValue,
+                        phjGroupVarName = 'group',
+                        phjCaseVarName = 'case',
+                        phjCaseValue = 1,
+                        phjMissingValue = np.nan,
+                        phjAlpha = 0.05,
+                        phjPrintResults = False):
+    
+    # Calculates the Mantel-Haenszel odds ratio for matched case-control data (such as
+    # that produced by phjGenerateCaseControlDataset()) with each matched set treated
+    # as a separate stratum. The confidence interval is calculated using the variance
+    # described by Robins, Breslow and Greenland (1986. Biometrics 42:311-323). For each
+    # level of the risk factor, the number of exposed and unexposed cases and controls
+    # in each set are calculated using a single groupby-sum and, therefore, the time taken
+    # increases linearly with the number of matched sets.
+    try:
+        phjAssert('phjDF',phjDF,pd.DataFrame)
+        phjAssert('phjRiskFactorVarName',phjRiskFactorVarName,str,phjMustBePresentColumnList = list(phjDF.columns))
+        phjAssert('phjRiskFactorBaseValue',phjRiskFactorBaseValue,(str,int),phjAllowedOptions = list(phjDF[phjRiskFactorVarName].unique()),phjBespokeMessage = "Risk factor value not found in risk factor variable ('{}')".format(phjRiskFactorVarName))
+        phjAssert('phjGroupVarName',phjGroupVarName,str,phjMustBePresentColumnList = list(phjDF.columns))
+        phjAssert('phjCaseVarName',phjCaseVarName,str,phjMustBePresentColumnList = list(phjDF.columns))
+        phjAssert('phjCaseValue',phjCaseValue,(str,int),phjAllowedOptions = list(phjDF[phjCaseVarName].unique()),phjBespokeMessage = "Case value not found in case variable ('{}')".format(phjCaseVarName))
+        phjAssert('phjMissingValue',phjMissingValue,(str,int,float))
+        phjAssert('phjAlpha',phjAlpha,float,phjAllowedOptions = {'min':0.0001,'max':0.9999})
+        phjAssert('phjPrintResults',phjPrintResults,bool)
+    
+    except AssertionError as e:
+        # If function has been called directly, present message.
+        if inspect.stack()[1][3] == '<module>':
+            print("An AssertionError occurred in {fname}() function. ({msg})\n".format(msg = e,
+                                                                                       fname = inspect.stack()[0][3]))
+        
+        # If function has been called by another function then modify message and re-raise exception
+        else:
+            print("An AssertionError occurred in {fname}() function when called by {callfname}() function. ({msg})\n".format(msg = e,
+                                                                                                                             fname = inspect.stack()[0][3],
+                                                                                                                             callfname = inspect.stack()[1][3]))
+            raise
+        
+        phjORTable = None
+    
+    else:
+        # Set default suffixes and join strings to create column names
+        # to use in output tables and dataframes.
+        phjSuffixDict = phjDefineSuffixDict(phjAlpha = phjAlpha)
+        
+        phjCIColsNamesList = phjCreateCIColsNamesList(phjRatioType = 'oddsratio',
+                                                      phjCIMethod = 'rbg',
+                                                      phjAlpha = phjAlpha)
+        
+        # Retain only the required columns and remove rows with missing values
+        # (the group variable is retained as a stratum variable)
+        phjDF = phjRemoveNaNRows(phjDF = phjDF[[phjGroupVarName,phjCaseVarName,phjRiskFactorVarName]].copy(),
+                                 phjCaseVarName = phjCaseVarName,
+                                 phjRiskFactorVarName = phjRiskFactorVarName,
+                                 phjMissingValue = phjMissingValue,
+                                 phjStratumVarName = phjGroupVarName)
+        
+        # Calculate the number of cases and controls at each level of the risk factor in
+        # each matched set (one row per set, one column per case status and risk factor level)
+        phjCountsDF = pd.crosstab(phjDF[phjGroupVarName],
+                                  [phjDF[phjCaseVarName] == phjCaseValue,phjDF[phjRiskFactorVarName]])
+        
+        phjLevelsList = [phjRiskFactorBaseValue] + [l for l in phjCountsDF.columns.levels[1] if l != phjRiskFactorBaseValue]
+        phjCountsDF = phjCountsDF.reindex(columns = pd.MultiIndex.from_product([[True,False],phjLevelsList]),
+                                          fill_value = 0)
+        
+        # Array of counts (sets x risk factor levels x [cases, controls]) with the base
+        # level first; the Mantel-Haenszel estimates for all levels are calculated at once
+        phjCountsArr = np.stack([phjCountsDF[True].to_numpy(),
+                                 phjCountsDF[False].to_numpy()],
+                                axis = 2)
+        
+        phjMHDict = phjCalcMantelHaenszelRatios(phjCountsArr = phjCountsArr,
+                                                phjRatioType = 'oddsratio',
+                                                phjAlpha = phjAlpha)
+        
+        phjORTable = pd.DataFrame({phjSuffixDict['matchedsets']: np.concatenate([[(phjCountsArr[:,0,:].sum(axis = 1) > 0).sum()],phjMHDict['strata']]),
+                                   phjCIColsNamesList[0]: np.concatenate([[1.0],phjMHDict['ratio']]),
+                                   phjCIColsNamesList[1]: np.concatenate([[np.nan],phjMHDict['llim']]),
+                                   phjCIColsNamesList[2]: np.concatenate([[np.nan],phjMHDict['ulim']])},
+                                  index = pd.Index(phjLevelsList,name = phjRiskFactorVarName))
+        
+        phjORTable[phjSuffixDict['matchedsets']] = phjORTable[phjSuffixDict['matchedsets']].astype(np.int64)
+        
+        if phjPrintResults == True:
+            print("\nTable showing Mantel-Haenszel odds ratio for matched sets with '{0}' considered as the base value.".format(phjRiskFactorBaseValue))
+            print(phjORTable)
+            print('\n')
+    
+    return phjORTable
+
+
+
+def phjScreenRiskFactors(phjDF,
+                         phjCaseVarName,
+                         phjCaseValue,
+                         phjRiskFactorVarNamesList,
+                         phjRiskFactorBaseValuesDict = None,   # Dict of {risk factor name: base value}; if a risk factor is not included then the first (sorted) level is used
+                         phjRatioTypesList = None,             # List containing 'oddsratio' and/or 'relrisk' (default both)
+                         phjMissingValue = np.nan,
+                         phjAlpha = 0.05,
+                         phjCIMethod = None,                   # None (Woolf/Gart) or 'exact' or 'midp' for odds ratios
+                         phjNumberOfWorkersInt = 1,            # Number of worker processes used to count cases and controls in blocks of risk factors
+                         phjPrintResults = False):
+    
+    # Calculates crude odds ratios and/or relative risks (with confidence intervals) for
+    # a large number of candidate risk factors against the same outcome. Rather than
+    # calling phjOddsRatio() for each variable in turn (which would validate, copy, replace
+    # missing values and crosstab the data for each variable), the risk factor columns are
+    # melted into a single long column and the number of cases and controls at each level
+    # of each risk factor is calculated using a single groupby. The ratios and confidence
+    # intervals are then calculated for all rows at once. The method used to calculate the
+    # confidence intervals is chosen for each risk factor in the same way as phjRatios()
+    # (i.e. Woolf and Katz unless any cell in the risk factor's table is zero, in which case
+    # Gart and adjusted log are used) and is recorded in the returned table.
+    # The function returns a long dataframe with one row for each level of each risk factor.
+    try:
+        phjAssert('phjDF',phjDF,pd.DataFrame)
+        phjAssert('phjCaseVarName',phjCaseVarName,str,phjMustBePresentColumnList = list(phjDF.columns))
+        assert phjDF.loc[phjGetNonMissingMask(phjDF = phjDF,
+                                              phjVarNamesList = [phjCaseVarName],
+                                              phjMissingValue = phjMissingValue),phjCaseVarName].nunique() == 2, 'The selected variable must contain only 2 levels, one representing a case and one a control.'
+        phjAssert('phjCaseValue',phjCaseValue,(str,int),phjAllowedOptions = list(phjDF[phjCaseVarName].unique()),phjBespokeMessage = "Case value not found in case variable ('{}')".format(phjCaseVarName))
+        phjAssert('phjRiskFactorVarNamesList',phjRiskFactorVarNamesList,list,phjMustBePresentColumnList = list(phjDF.columns))
+        assert phjCaseVarName not in phjRiskFactorVarNamesList, "The case variable ('{}') cannot also be included as a risk factor.".format(phjCaseVarName)
+        
+        if phjRiskFactorBaseValuesDict is not None:
+            phjAssert('phjRiskFactorBaseValuesDict',phjRiskFactorBaseValuesDict,dict)
+            assert set(phjRiskFactorBaseValuesDict.keys()).issubset(phjRiskFactorVarNamesList), "The keys in 'phjRiskFactorBaseValuesDict' must all be included in 'phjRiskFactorVarNamesList'."
+            
+            for k,v in phjRiskFactorBaseValuesDict.items():
+                phjAssert('phjRiskFactorBaseValue',v,(str,int),phjAllowedOptions = list(phjDF[k].unique()),phjBespokeMessage = "Risk factor value not found in risk factor variable ('{}')".format(k))
+        
+        if phjRatioTypesList is not None:
+            phjAssert('phjRatioTypesList',phjRatioTypesList,list)
+            assert (len(phjRatioTypesList) > 0) and set(phjRatioTypesList).issubset(['oddsratio','relrisk']), "The elements in 'phjRatioTypesList' must be 'oddsratio' and/or 'relrisk'."
+        
+        phjAssert('phjMissingValue',phjMissingValue,(str,int,float))
+        phjAssert('phjAlpha',phjAlpha,float,phjAllowedOptions = {'min':0.0001,'max':0.9999})
+        
+        if phjCIMethod is not None:
+            phjAssert('phjCIMethod',phjCIMethod,str,phjAllowedOptions = ['exact','midp'])
+        
+        phjAssert('phjNumberOfWorkersInt',phjNumberOfWorkersInt,int,phjAllowedOptions = {'min':1})
+        phjAssert('phjPrintResults',phjPrintResults,bool)
+    
+    except AssertionError as e:
+        # If function has been called directly, present message.
+        if inspect.stack()[1][3] == '<module>':
+            print("An AssertionError occurred in {fname}() function. ({msg})\n".format(msg = e,
+                                                                                       fname = inspect.stack()[0][3]))
+        
+        # If function has been called by another function then modify message and re-raise exception
+        else:
+            print("An AssertionError occurred in {fname}() function when called by {callfname}() function. ({msg})\n".format(msg = e,
+                                                                                                                             fname = inspect.stack()[0][3],
+                                                                                                                             callfname = inspect.stack()[1][3]))
+            raise
+        
+        phjScreenDF = None
+    
+    else:
+        # Set default suffixes and join strings to create column names
+        # to use in output tables and dataframes.
+        phjSuffixDict = phjDefineSuffixDict(phjAlpha = phjAlpha)
+        
+        if phjRatioTypesList is None:
+            phjRatioTypesList = ['oddsratio','relrisk']
+        
+        if phjRiskFactorBaseValuesDict is None:
+            phjRiskFactorBaseValuesDict = {}
+        
+        # Remove rows where the case variable is missing and replace the case variable
+        # with a boolean indicating whether each row is a case. (Missing values in the risk
+        # factors are removed after the risk factors have been melted so that a missing value
+        # in one risk factor does not remove the row for all other risk factors.)
+        phjCaseMaskArr = phjGetNonMissingMask(phjDF = phjDF,
+                                              phjVarNamesList = [phjCaseVarName],
+                                              phjMissingValue = phjMissingValue)
+        
+        phjControlValue = [v for v in phjDF.loc[phjCaseMaskArr,phjCaseVarName].unique() if v != phjCaseValue][0]
+        
+        phjTempDF = phjDF.loc[phjCaseMaskArr,phjRiskFactorVarNamesList].copy()
+        phjTempDF[phjCaseVarName] = (phjDF.loc[phjCaseMaskArr,phjCaseVarName] == phjCaseValue)
+        
+        # Count cases and controls at each level of each risk factor. If required, the
+        # risk factors are divided into blocks and each block is counted in a separate process.
+        if (phjNumberOfWorkersInt > 1) and (len(phjRiskFactorVarNamesList) > 1):
+            phjBlocksList = [list(b) for b in np.array_split(np.array(phjRiskFactorVarNamesList,dtype = object),
+                                                             min(phjNumberOfWorkersInt,len(phjRiskFactorVarNamesList)))]
+            
+            with concurrent.futures.ProcessPoolExecutor(max_workers = phjNumberOfWorkersInt) as phjExecutor:
+                phjCountsDFList = list(phjExecutor.map(phjCountCasesByRiskFactorLevel,
+                                                       [phjTempDF[b + [phjCaseVarName]] for b in phjBlocksList],
+                                                       itertools.repeat(phjCaseVarName),
+                                                       phjBlocksList,
+                                                       itertools.repeat(phjMissingValue)))
+            
+            phjScreenDF = pd.concat(phjCountsDFList,axis = 0,ignore_index = True)
+        
+        else:
+            phjScreenDF = phjCountCasesByRiskFactorLevel(phjDF = phjTempDF,
+                                                         phjCaseVarName = phjCaseVarName,
+                                                         phjRiskFactorVarNamesList = phjRiskFactorVarNamesList,
+                                                         phjMissingValue = phjMissingValue)
+        
+        phjScreenDF = phjScreenDF.rename(columns = {'cases': phjCaseValue,
+                                                    'controls': phjControlValue})
+        
+        # Sort rows in the order that the risk factors were listed and, within each risk
+        # factor, in order of level (numeric levels are sorted numerically and other levels
+        # alphabetically; sorting the level column directly would fail if different risk
+        # factors contained levels of different types).
+        phjVarCodesArr = pd.Categorical(phjScreenDF['variable'],categories = phjRiskFactorVarNamesList).codes
+        
+        phjScreenDF = phjScreenDF.assign(phjVarCode = phjVarCodesArr,
+                                         phjLevelNum = pd.to_numeric(phjScreenDF['level'],errors = 'coerce'),
+                                         phjLevelStr = phjScreenDF['level'].astype(str))
+        
+        phjScreenDF = phjScreenDF.sort_values(['phjVarCode','phjLevelNum','phjLevelStr'],
+                                              kind = 'mergesort').reset_index(drop = True)
+        
+        phjVarCodesArr = phjScreenDF['phjVarCode'].to_numpy()
+        phjScreenDF = phjScreenDF.drop(columns = ['phjVarCode','phjLevelNum','phjLevelStr'])
+        
+        # Identify the row representing the base level of each risk factor
+        phjBaseValuesSer = phjScreenDF['variable'].map(phjRiskFactorBaseValuesDict)
+        
+        phjBaseMaskArr = np.where(phjBaseValuesSer.notna().to_numpy(),
+                                  (phjScreenDF['level'] == phjBaseValuesSer).to_numpy(),
+                                  (phjScreenDF.groupby('variable',sort = False).cumcount() == 0).to_numpy())
+        
+        # Cells a and b are the cases and controls at each level; cells c and d are the
+        # cases and controls at the base level of the same risk factor
+        a = phjScreenDF[phjCaseValue].to_numpy(dtype = np.float64)
+        b = phjScreenDF[phjControlValue].to_numpy(dtype = np.float64)
+        
+        phjNumVarsInt = len(phjRiskFactorVarNamesList)
+        c = np.bincount(phjVarCodesArr,weights = np.where(phjBaseMaskArr,a,0),minlength = phjNumVarsInt)[phjVarCodesArr]
+        d = np.bincount(phjVarCodesArr,weights = np.where(phjBaseMaskArr,b,0),minlength = phjNumVarsInt)[phjVarCodesArr]
+        
+        # Identify risk factors where any cell in the contingency table is zero
+        phjZeroCellArr = (np.bincount(phjVarCodesArr,weights = (np.minimum(a,b) == 0),minlength = phjNumVarsInt) > 0)[phjVarCodesArr]
+        
+        for phjRatioType in ['relrisk','oddsratio']:
+            
+            if phjRatioType not in phjRatioTypesList:
+                continue
+            
+            if phjRatioType == 'relrisk':
+                phjScreenDF[phjSuffixDict['totalnumber']] = phjScreenDF[phjCaseValue] + phjScreenDF[phjControlValue]
+                
+                with np.errstate(divide = 'ignore',invalid = 'ignore'):
+                    phjScreenDF[phjSuffixDict['risk']] = a / (a + b)
+                
+                phjCIMethodsList = ['katz','adj_log']
+            
+            else:
+                with np.errstate(divide = 'ignore',invalid = 'ignore'):
+                    phjScreenDF[phjSuffixDict['odds']] = a / b
+                
+                phjCIMethodsList = ['woolf','gart']
+            
+            phjRatioArr, phjLogSEArr = phjCalcRatioAndLogSE(a,b,c,d,phjCIMethod = phjCIMethodsList[0])
+            phjAdjRatioArr, phjAdjLogSEArr = phjCalcRatioAndLogSE(a,b,c,d,phjCIMethod = phjCIMethodsList[1])
+            
+            # Confidence intervals are not calculated for the base level
+            phjRatioArr = np.where(phjZeroCellArr,phjAdjRatioArr,phjRatioArr)
+            phjLogSEArr = np.where(phjBaseMaskArr,np.nan,np.where(phjZeroCellArr,phjAdjLogSEArr,phjLogSEArr))
+            
+            with np.errstate(divide = 'ignore',invalid = 'ignore'):
+                phjCIList = phjCalcCI_lognormal(phjUntransformedPointEstimate = phjRatioArr,
+                                                phjTransformedSE = phjLogSEArr,
+                                                phjAlpha = phjAlpha)
+            
+            # Column names are the same as produced by phjRatios() except that the CI method
+            # (which can differ between risk factors) is stored in a separate column
+            phjCIMethodArr = np.where(phjZeroCellArr,
+                                      phjSuffixDict[phjCIMethodsList[1]],
+                                      phjSuffixDict[phjCIMethodsList[0]])
+            
+            # If requested, odds ratios are replaced by conditional MLEs with exact (or
+            # mid-p) CIs. Results are cached by table so identical tables in different
+            # risk factors are only calculated once.
+            if (phjRatioType == 'oddsratio') and (phjCIMethod is not None):
+                phjExactArr = np.array([phjCalcExactOddsRatioCI(a = int(a[i]),
+                                                                phjExposedInt = int(a[i] + b[i]),
+                                                                phjCasesInt = int(a[i] + c[i]),
+                                                                phjTotalInt = int(a[i] + b[i] + c[i] + d[i]),
+                                                                phjAlpha = phjAlpha,
+                                                                phjMidP = (phjCIMethod == 'midp')) for i in range(len(a))],
+                                       dtype = np.float64).reshape(-1,3)
+                
+                phjRatioArr = np.where(phjBaseMaskArr,1.0,phjExactArr[:,0])
+                phjCIList = [np.where(phjBaseMaskArr,np.nan,phjExactArr[:,1]),
+                             np.where(phjBaseMaskArr,np.nan,phjExactArr[:,2])]
+                phjCIMethodArr = np.full(len(a),phjSuffixDict[phjCIMethod])
+            
+            phjScreenDF[phjSuffixDict[phjRatioType]] = phjRatioArr
+            phjScreenDF[phjSuffixDict['joinstr'].join([phjSuffixDict[phjRatioType],phjSuffixDict['cisuffix'],phjSuffixDict['cilowlim']])] = phjCIList[0]
+            phjScreenDF[phjSuffixDict['joinstr'].join([phjSuffixDict[phjRatioType],phjSuffixDict['cisuffix'],phjSuffixDict['ciupplim']])] = phjCIList[1]
+            phjScreenDF[phjSuffixDict['joinstr'].join([phjSuffixDict[phjRatioType],phjSuffixDict['cimethod']])] = phjCIMethodArr
+        
+        if phjPrintResults == True:
+            print("\nTable showing crude ratios for {0} risk factors.".format(len(phjRiskFactorVarNamesList)))
+            print(phjScreenDF)
+            print('\n')
+    
+    return phjScreenDF
+
+
+
 def phjRatios(phjDF,
               phjRatioType,    # Should be one of the keys in phjSuffixDict
               phjCaseVarName,
@@ -138,19 +484,60 @@ def phjRatios(phjDF,
               phjRiskFactorBaseValue,
               phjMissingValue = np.nan,
               phjAlpha = 0.05,
+              phjStratumVarName = None,
+              phjFreqVarName = None,
+              phjContTableInput = False,
+              phjCIMethod = None,
+              phjBootstrapReplicatesInt = 1000,
+              phjRandomSeedInt = None,
               phjPrintResults = False):
     
     # Check whether required parameters have been set to correct type
     try:
         phjAssert('phjDF',phjDF,pd.DataFrame)
         phjAssert('phjRatioType',phjRatioType,str,phjAllowedOptions = ['oddsratio','relrisk'])
-        phjAssert('phjCaseVarName',phjCaseVarName,str,phjMustBePresentColumnList = list(phjDF.columns))
-        assert phjDF[phjCaseVarName].replace(phjMissingValue,np.nan).nunique(dropna = True) == 2, 'The selected variable must contain only 2 levels, one representing a case and one a control.'
-        phjAssert('phjCaseValue',phjCaseValue,(str,int),phjAllowedOptions = list(phjDF[phjCaseVarName].unique()),phjBespokeMessage = "Case value not found in case variable ('{}')".format(phjCaseVarName))
-        phjAssert('phjRiskFactorVarName',phjRiskFactorVarName,str,phjMustBePresentColumnList = list(phjDF.columns))
-        phjAssert('phjRiskFactorBaseValue',phjRiskFactorBaseValue,(str,int),phjAllowedOptions = list(phjDF[phjRiskFactorVarName].unique()),phjBespokeMessage = "Risk factor value not found in risk factor variable ('{}')".format(phjRiskFactorVarName))
+        phjAssert('phjContTableInput',phjContTableInput,bool)
+        
+        if phjContTableInput == True:
+            # The dataframe is a contingency table with the risk factor levels as the index
+            # and the case and control values as columns. The case and risk factor variable
+            # names are only used to name the columns and index of the returned table.
+            assert len(phjDF.columns) == 2, 'The contingency table must contain only 2 columns, one representing cases and one controls.'
+            phjAssert('phjCaseVarName',phjCaseVarName,str)
+            phjAssert('phjCaseValue',phjCaseValue,(str,int),phjAllowedOptions = list(phjDF.columns),phjBespokeMessage = "Case value not found in contingency table columns")
+            phjAssert('phjRiskFactorVarName',phjRiskFactorVarName,str)
+            phjAssert('phjRiskFactorBaseValue',phjRiskFactorBaseValue,(str,int),phjAllowedOptions = list(phjDF.index),phjBespokeMessage = "Risk factor value not found in contingency table index")
+            assert (phjStratumVarName is None) and (phjFreqVarName is None), "A stratum variable or frequency variable cannot be used with a contingency table."
+        
+        else:
+            phjAssert('phjCaseVarName',phjCaseVarName,str,phjMustBePresentColumnList = list(phjDF.columns))
+            assert phjDF.loc[phjGetNonMissingMask(phjDF = phjDF,
+                                                  phjVarNamesList = [phjCaseVarName],
+                                                  phjMissingValue = phjMissingValue),phjCaseVarName].nunique() == 2, 'The selected variable must contain only 2 levels, one representing a case and one a control.'
+            phjAssert('phjCaseValue',phjCaseValue,(str,int),phjAllowedOptions = list(phjDF[phjCaseVarName].unique()),phjBespokeMessage = "Case value not found in case variable ('{}')".format(phjCaseVarName))
+            phjAssert('phjRiskFactorVarName',phjRiskFactorVarName,str,phjMustBePresentColumnList = list(phjDF.columns))
+            phjAssert('phjRiskFactorBaseValue',phjRiskFactorBaseValue,(str,int),phjAllowedOptions = list(phjDF[phjRiskFactorVarName].unique()),phjBespokeMessage = "Risk factor value not found in risk factor variable ('{}')".format(phjRiskFactorVarName))
+        
         phjAssert('phjMissingValue',phjMissingValue,(str,int,float))
         phjAssert('phjAlpha',phjAlpha,float,phjAllowedOptions = {'min':0.0001,'max':0.9999})
+        
+        if phjStratumVarName is not None:
+            phjAssert('phjStratumVarName',phjStratumVarName,str,phjMustBePresentColumnList = list(phjDF.columns),phjMustBeAbsentColumnList = [phjCaseVarName,phjRiskFactorVarName])
+        
+        if phjFreqVarName is not None:
+            phjAssert('phjFreqVarName',phjFreqVarName,str,phjMustBePresentColumnList = list(phjDF.columns),phjMustBeAbsentColumnList = [phjCaseVarName,phjRiskFactorVarName,phjStratumVarName])
+            assert pd.api.types.is_numeric_dtype(phjDF[phjFreqVarName]) and (phjDF[phjFreqVarName].min() >= 0), "The frequency variable ('{}') must contain non-negative numbers.".format(phjFreqVarName)
+        
+        if phjCIMethod is not None:
+            phjAssert('phjCIMethod',phjCIMethod,str,phjAllowedOptions = ['bootpercentile','bootbca','exact','midp'])
+            assert (phjCIMethod not in ['exact','midp']) or (phjRatioType == 'oddsratio'), "Exact and mid-p CIs can only be calculated for odds ratios."
+            assert phjStratumVarName is None, "The CI method cannot be specified for Mantel-Haenszel estimates."
+        
+        phjAssert('phjBootstrapReplicatesInt',phjBootstrapReplicatesInt,int,phjAllowedOptions = {'min':10})
+        
+        if phjRandomSeedInt is not None:
+            phjAssert('phjRandomSeedInt',phjRandomSeedInt,int)
+        
         phjAssert('phjPrintResults',phjPrintResults,bool)
     
     
@@ -175,20 +562,74 @@ def phjRatios(phjDF,
         # Retain only those columns that will be analysed (otherwise, it is feasible that
         # unrelated columns that contain np.nan values will cause removal of rows in
         # unexpected ways.
-        phjDF = phjDF[[phjCaseVarName,phjRiskFactorVarName]].copy()
+        phjKeyVarsList = [v for v in [phjCaseVarName,phjRiskFactorVarName,phjStratumVarName] if v is not None]
+        
+        if phjContTableInput == True:
+            pass
+        
+        elif phjFreqVarName is None:
+            phjDF = phjDF[phjKeyVarsList].copy()
     
-        # Data to use - remove rows that have a missing value
-        phjDF = phjRemoveNaNRows(phjDF = phjDF,
-                                 phjCaseVarName = phjCaseVarName,
-                                 phjRiskFactorVarName = phjRiskFactorVarName,
-                                 phjMissingValue = phjMissingValue)
+            # Data to use - remove rows that have a missing value
+            phjDF = phjRemoveNaNRows(phjDF = phjDF,
+                                     phjCaseVarName = phjCaseVarName,
+                                     phjRiskFactorVarName = phjRiskFactorVarName,
+                                     phjMissingValue = phjMissingValue,
+                                     phjStratumVarName = phjStratumVarName)
+        
+        else:
+            # Pre-aggregated data: each row contains a count of individuals. The data are
+            # not copied or passed to phjRemoveNaNRows(); rows with missing values in the
+            # key variables are excluded using a mask.
+            phjDF = phjDF.loc[phjGetNonMissingMask(phjDF = phjDF,
+                                                   phjVarNamesList = phjKeyVarsList,
+                                                   phjMissingValue = phjMissingValue),
+                              phjKeyVarsList + [phjFreqVarName]]
+        
+        # If a stratum variable is given, calculate Mantel-Haenszel estimates
+        # adjusted for the stratum variable rather than crude estimates
+        if phjStratumVarName is not None:
+            phjContTable = phjStratifiedRatios(phjDF = phjDF,
+                                               phjRatioType = phjRatioType,
+                                               phjCaseVarName = phjCaseVarName,
+                                               phjCaseValue = phjCaseValue,
+                                               phjRiskFactorVarName = phjRiskFactorVarName,
+                                               phjRiskFactorBaseValue = phjRiskFactorBaseValue,
+                                               phjStratumVarName = phjStratumVarName,
+                                               phjFreqVarName = phjFreqVarName,
+                                               phjAlpha = phjAlpha)
+            
+            if phjPrintResults == True:
+                if phjRatioType == 'relrisk':
+                    print("\nTable showing Mantel-Haenszel relative risk (adjusted for '{0}') for risk factor strata with '{1}' considered as the base value.".format(phjStratumVarName,phjRiskFactorBaseValue))
+                elif phjRatioType == 'oddsratio':
+                    print("\nTable showing Mantel-Haenszel odds ratio (adjusted for '{0}') for risk factor strata with '{1}' considered as the base value.".format(phjStratumVarName,phjRiskFactorBaseValue))
+                print(phjContTable)
+                print('\n')
+            
+            return phjContTable
     
         # Create a basic 2 x 2 (or n x 2) contingency table
-        phjContTable = phjCreateContingencyTable(phjDF = phjDF,
-                                                 phjCaseVarName = phjCaseVarName,
-                                                 phjCaseValue = phjCaseValue,
-                                                 phjRiskFactorVarName = phjRiskFactorVarName,
-                                                 phjRiskFactorBaseValue = phjRiskFactorBaseValue)
+        if phjContTableInput == True:
+            phjContTable = phjDF.copy()
+            phjContTable.index.name = phjRiskFactorVarName
+            phjContTable.columns.name = phjCaseVarName
+            phjContTable = phjContTable[phjCaseFirst(phjDF = phjContTable,
+                                                     phjCaseValue = phjCaseValue)]
+        
+        elif phjFreqVarName is not None:
+            phjContTable = phjCreateContingencyTableFromCounts(phjDF = phjDF,
+                                                               phjCaseVarName = phjCaseVarName,
+                                                               phjCaseValue = phjCaseValue,
+                                                               phjRiskFactorVarName = phjRiskFactorVarName,
+                                                               phjFreqVarName = phjFreqVarName)
+        
+        else:
+            phjContTable = phjCreateContingencyTable(phjDF = phjDF,
+                                                     phjCaseVarName = phjCaseVarName,
+                                                     phjCaseValue = phjCaseValue,
+                                                     phjRiskFactorVarName = phjRiskFactorVarName,
+                                                     phjRiskFactorBaseValue = phjRiskFactorBaseValue)
     
         # Identify the code or string that represents a control value. (Take
         # all the column headings – there are only 2 of them – and convert
@@ -213,7 +654,10 @@ def phjRatios(phjDF,
                                              phjRatioType = phjRatioType,    # Should be one of the keys in phjSuffixDict
                                              phjCaseControlValuesList = phjCaseControlValuesList,
                                              phjRiskFactorBaseValue = phjRiskFactorBaseValue,
-                                             phjAlpha = 0.05,
+                                             phjAlpha = phjAlpha,
+                                             phjCIMethod = phjCIMethod,
+                                             phjBootstrapReplicatesInt = phjBootstrapReplicatesInt,
+                                             phjRandomSeedInt = phjRandomSeedInt,
                                              phjPrintResults = phjPrintResults)
     
         elif phjRatioType == 'oddsratio':
@@ -225,7 +669,10 @@ def phjRatios(phjDF,
                                              phjRatioType = phjRatioType,    # Should be one of the keys in phjSuffixDict
                                              phjCaseControlValuesList = phjCaseControlValuesList,
                                              phjRiskFactorBaseValue = phjRiskFactorBaseValue,
-                                             phjAlpha = 0.05,
+                                             phjAlpha = phjAlpha,
+                                             phjCIMethod = phjCIMethod,
+                                             phjBootstrapReplicatesInt = phjBootstrapReplicatesInt,
+                                             phjRandomSeedInt = phjRandomSeedInt,
                                              phjPrintResults = phjPrintResults)
     
         
@@ -246,6 +693,218 @@ def phjRatios(phjDF,
     return phjContTable
 
 
+def phjStratifiedRatios(phjDF,
+                        phjRatioType,
+                        phjCaseVarName,
+                        phjCaseValue,
+                        phjRiskFactorVarName,
+                        phjRiskFactorBaseValue,
+                        phjStratumVarName,
+                        phjFreqVarName = None,
+                        phjAlpha = 0.05):
+    
+    # Calculates the Mantel-Haenszel odds ratio or relative risk for each level of the
+    # risk factor (compared with the base level) adjusted for the stratum variable. The
+    # number of cases and controls at each level of the risk factor in every stratum is
+    # calculated in a single pass by coding the stratum, risk factor and case status as
+    # integers and counting the combined codes using np.bincount(). The resulting array
+    # (strata x risk factor levels x [cases, controls]) is passed to
+    # phjCalcMantelHaenszelRatios() which calculates the pooled estimates for all levels at
+    # once. If phjFreqVarName is given, each row is weighted by the number of individuals
+    # it represents. Missing values should have been removed before calling this function.
+    phjSuffixDict = phjDefineSuffixDict(phjAlpha = phjAlpha)
+    
+    phjStratumCodesArr, phjStrataArr = pd.factorize(phjDF[phjStratumVarName])
+    
+    # Risk factor levels are sorted (as in the crude contingency table) but with the base
+    # level placed first
+    phjLevelCodesArr, phjLevelsArr = pd.factorize(phjDF[phjRiskFactorVarName],sort = True)
+    phjLevelsList = list(phjLevelsArr)
+    phjBasePosInt = phjLevelsList.index(phjRiskFactorBaseValue)
+    phjLevelsList = [phjLevelsList[phjBasePosInt]] + phjLevelsList[:phjBasePosInt] + phjLevelsList[phjBasePosInt + 1:]
+    phjLevelCodesArr = np.select([phjLevelCodesArr == phjBasePosInt,phjLevelCodesArr < phjBasePosInt],
+                                 [0,phjLevelCodesArr + 1],
+                                 phjLevelCodesArr)
+    
+    # Cases are coded as 0 and controls as 1
+    phjControlCodesArr = (phjDF[phjCaseVarName] != phjCaseValue).to_numpy().astype(np.int64)
+    
+    phjNumStrataInt = len(phjStrataArr)
+    phjNumLevelsInt = len(phjLevelsList)
+    
+    if phjFreqVarName is None:
+        phjWeightsArr = None
+    else:
+        phjWeightsArr = phjDF[phjFreqVarName].to_numpy(dtype = np.float64)
+    
+    phjCountsArr = np.bincount((phjStratumCodesArr * phjNumLevelsInt + phjLevelCodesArr) * 2 + phjControlCodesArr,
+                               weights = phjWeightsArr,
+                               minlength = phjNumStrataInt * phjNumLevelsInt * 2).reshape(phjNumStrataInt,phjNumLevelsInt,2)
+    
+    # Weighted counts are returned as floats
+    if (phjFreqVarName is None) or pd.api.types.is_integer_dtype(phjDF[phjFreqVarName]):
+        phjCountsArr = phjCountsArr.astype(np.int64)
+    
+    phjControlValue = [v for v in phjDF[phjCaseVarName].unique() if v != phjCaseValue][0]
+    
+    if phjRatioType == 'oddsratio':
+        phjCIMethod = 'rbg'
+    else:
+        phjCIMethod = 'gr'
+    
+    phjCIColsNamesList = phjCreateCIColsNamesList(phjRatioType = phjRatioType,
+                                                  phjCIMethod = phjCIMethod,
+                                                  phjAlpha = phjAlpha)
+    
+    phjHomogColsNamesList = [phjSuffixDict['joinstr'].join([phjSuffixDict['homogeneity'],phjSuffixDict[s]]) for s in ['chisquare','degreesfreedom','pvalue']]
+    
+    phjMHDict = phjCalcMantelHaenszelRatios(phjCountsArr = phjCountsArr,
+                                            phjRatioType = phjRatioType,
+                                            phjAlpha = phjAlpha)
+    
+    # Table of crude counts and the pooled estimates; the base level has a ratio of 1
+    # and the other columns are empty.
+    phjMHTable = pd.DataFrame({phjCaseValue: phjCountsArr[:,:,0].sum(axis = 0),
+                               phjControlValue: phjCountsArr[:,:,1].sum(axis = 0),
+                               phjSuffixDict['strata']: np.concatenate([[((phjCountsArr[:,0,:].sum(axis = 1)) > 0).sum()],phjMHDict['strata']]),
+                               phjCIColsNamesList[0]: np.concatenate([[1.0],phjMHDict['ratio']]),
+                               phjCIColsNamesList[1]: np.concatenate([[np.nan],phjMHDict['llim']]),
+                               phjCIColsNamesList[2]: np.concatenate([[np.nan],phjMHDict['ulim']]),
+                               phjHomogColsNamesList[0]: np.concatenate([[np.nan],phjMHDict['chi2']]),
+                               phjHomogColsNamesList[1]: np.concatenate([[np.nan],phjMHDict['df']]),
+                               phjHomogColsNamesList[2]: np.concatenate([[np.nan],phjMHDict['pvalue']])},
+                              index = pd.Index(phjLevelsList,name = phjRiskFactorVarName))
+    
+    return phjMHTable
+
+
+
+def phjCalcMantelHaenszelRatios(phjCountsArr,
+                                phjRatioType,
+                                phjAlpha = 0.05):
+    
+    # The phjCountsArr is a 3-dimensional array of counts (strata x risk factor levels x
+    # [cases, controls]) with the base level of the risk factor in position 0 of the second
+    # axis. Mantel-Haenszel estimates for every non-base level are calculated at once; the
+    # sums are over the strata axis. For each stratum and level, the cells are:
+    #     a = cases at level, b = controls at level,
+    #     c = cases at base level, d = controls at base level.
+    # The odds ratio CI uses the variance described by Robins, Breslow and Greenland (1986.
+    # Biometrics 42:311-323) and homogeneity is tested using the Breslow-Day test. The
+    # relative risk CI uses the variance described by Greenland and Robins (1985.
+    # Biometrics 41:55-68) and homogeneity is tested using a chi-square test of the
+    # inverse-variance weighted deviations of the stratum-specific log relative risks
+    # from the log of the pooled estimate.
+    # Returns a dict of arrays (one value per non-base level).
+    a = phjCountsArr[:,1:,0].astype(np.float64)
+    b = phjCountsArr[:,1:,1].astype(np.float64)
+    c = phjCountsArr[:,:1,0].astype(np.float64)
+    d = phjCountsArr[:,:1,1].astype(np.float64)
+    
+    phjNArr = a + b + c + d
+    
+    # Number of strata contributing information (i.e. containing more than one
+    # observation at this and the base level)
+    phjStrataArr = (phjNArr > 1).sum(axis = 0)
+    
+    phjZ = norm.ppf(1 - phjAlpha/2)
+    
+    with np.errstate(divide = 'ignore',invalid = 'ignore'):
+        
+        # Strata with no observations contribute nothing to any of the sums
+        phjNArr = np.where(phjNArr > 0,phjNArr,np.nan)
+        
+        if phjRatioType == 'oddsratio':
+            phjRArr = a * d / phjNArr
+            phjSArr = b * c / phjNArr
+            phjPArr = (a + d) / phjNArr
+            phjQArr = (b + c) / phjNArr
+            
+            phjR = np.nansum(phjRArr,axis = 0)
+            phjS = np.nansum(phjSArr,axis = 0)
+            
+            phjRatioArr = phjR / phjS
+            
+            # Robins-Breslow-Greenland variance of log(OR)
+            phjLogVarArr = ( np.nansum(phjPArr * phjRArr,axis = 0) / (2 * phjR**2) +
+                             np.nansum((phjPArr * phjSArr) + (phjQArr * phjRArr),axis = 0) / (2 * phjR * phjS) +
+                             np.nansum(phjQArr * phjSArr,axis = 0) / (2 * phjS**2) )
+            
+            # Breslow-Day test: the expected number of exposed cases in each stratum,
+            # given the margins of the stratum table and the pooled odds ratio, is the
+            # root of a quadratic equation that lies within the bounds set by the margins.
+            phjM1Arr = a + c    # Cases
+            phjN1Arr = a + b    # Exposed (at this level)
+            
+            phjQuadAArr = 1 - phjRatioArr
+            phjQuadBArr = phjNArr - phjM1Arr - phjN1Arr + phjRatioArr * (phjM1Arr + phjN1Arr)
+            phjQuadCArr = -phjRatioArr * phjM1Arr * phjN1Arr
+            
+            phjSqrtArr = np.sqrt(phjQuadBArr**2 - 4 * phjQuadAArr * phjQuadCArr)
+            phjLowerBoundArr = np.maximum(0,phjM1Arr + phjN1Arr - phjNArr)
+            phjUpperBoundArr = np.minimum(phjM1Arr,phjN1Arr)
+            
+            phjRoot1Arr = (-phjQuadBArr + phjSqrtArr) / (2 * phjQuadAArr)
+            phjRoot2Arr = (-phjQuadBArr - phjSqrtArr) / (2 * phjQuadAArr)
+            
+            phjExpAArr = np.where((phjRoot1Arr >= phjLowerBoundArr - 1e-8) & (phjRoot1Arr <= phjUpperBoundArr + 1e-8),
+                                  phjRoot1Arr,
+                                  phjRoot2Arr)
+            
+            # If the pooled OR equals 1, the equation is linear
+            phjExpAArr = np.where(phjQuadAArr == 0,phjM1Arr * phjN1Arr / phjNArr,phjExpAArr)
+            
+            phjExpVarArr = 1 / ( (1 / phjExpAArr) +
+                                 (1 / (phjM1Arr - phjExpAArr)) +
+                                 (1 / (phjN1Arr - phjExpAArr)) +
+                                 (1 / (phjNArr - phjM1Arr - phjN1Arr + phjExpAArr)) )
+            
+            # Only strata in which all margins are non-zero contribute to the test
+            phjInformativeArr = (phjM1Arr > 0) & (phjN1Arr > 0) & (phjM1Arr < phjNArr) & (phjN1Arr < phjNArr)
+            
+            phjChi2Arr = np.where(phjInformativeArr,(a - phjExpAArr)**2 / phjExpVarArr,0).sum(axis = 0)
+        
+        else:
+            phjN1Arr = a + b    # Exposed (at this level)
+            phjN0Arr = c + d    # Base level
+            phjM1Arr = a + c    # Cases
+            
+            phjR = np.nansum(a * phjN0Arr / phjNArr,axis = 0)
+            phjS = np.nansum(c * phjN1Arr / phjNArr,axis = 0)
+            
+            phjRatioArr = phjR / phjS
+            
+            # Greenland-Robins variance of log(RR)
+            phjLogVarArr = np.nansum((phjM1Arr * phjN1Arr * phjN0Arr / phjNArr**2) - (a * c / phjNArr),axis = 0) / (phjR * phjS)
+            
+            # Homogeneity test using stratum-specific log(RR) and Katz variances
+            phjInformativeArr = (a > 0) & (c > 0)
+            
+            phjStratumLogRRArr = np.log((a / phjN1Arr) / (c / phjN0Arr))
+            phjStratumVarArr = (b / (a * phjN1Arr)) + (d / (c * phjN0Arr))
+            
+            phjChi2Arr = np.where(phjInformativeArr,(phjStratumLogRRArr - np.log(phjRatioArr))**2 / phjStratumVarArr,0).sum(axis = 0)
+        
+        phjValidArr = (phjR > 0) & (phjS > 0)
+        
+        phjLLimArr = np.where(phjValidArr,np.exp(np.log(phjRatioArr) - phjZ * np.sqrt(phjLogVarArr)),np.nan)
+        phjULimArr = np.where(phjValidArr,np.exp(np.log(phjRatioArr) + phjZ * np.sqrt(phjLogVarArr)),np.nan)
+        
+        phjDFArr = (phjInformativeArr.sum(axis = 0) - 1).astype(np.float64)
+        phjChi2Arr = np.where(phjValidArr & (phjDFArr > 0),phjChi2Arr,np.nan)
+        phjDFArr = np.where(phjValidArr & (phjDFArr > 0),phjDFArr,np.nan)
+        
+        phjPValueArr = chi2.sf(phjChi2Arr,phjDFArr)
+    
+    return {'strata': phjStrataArr,
+            'ratio': phjRatioArr,
+            'llim': phjLLimArr,
+            'ulim': phjULimArr,
+            'chi2': phjChi2Arr,
+            'df': phjDFArr,
+            'pvalue': phjPValueArr}
+
+
 
 def phjCaseFirst(phjDF,
                  phjCaseValue):
@@ -265,20 +924,20 @@ def phjCaseFirst(phjDF,
 def phjRemoveNaNRows(phjDF,
                      phjCaseVarName,
                      phjRiskFactorVarName,
-                     phjMissingValue = np.nan):
+                     phjMissingValue = np.nan,
+                     phjStratumVarName = None):
     
-    # Replace empty cells (or cells with just one or more white-space) with np.nan
-    phjDF = phjDF.replace('^\s*$',np.nan,regex = True)
+    # Remove rows where the case, risk factor or stratum (if given) variables contain
+    # np.nan, empty cells (or cells with just one or more white-space) or the missing value.
+    # Only the required columns are examined (using phjGetNonMissingMask()) and the
+    # dataframe is only copied once, when the required rows and columns are selected.
+    phjVarNamesList = [v for v in [phjCaseVarName,phjRiskFactorVarName,phjStratumVarName] if v is not None]
     
-    # Replace missing values with np.nan
-    if isinstance(phjMissingValue,str):
-        phjDF = phjDF.replace(phjMissingValue,np.nan)
-        
-    elif not np.isnan(phjMissingValue):
-        phjDF = phjDF.replace(phjMissingValue,np.nan)
+    phjMaskArr = phjGetNonMissingMask(phjDF = phjDF,
+                                      phjVarNamesList = phjVarNamesList,
+                                      phjMissingValue = phjMissingValue)
     
-    # Remove np.nan cells
-    phjDF = phjDF[[phjCaseVarName,phjRiskFactorVarName]].dropna(axis = 0, how = 'any').reset_index(drop = True)
+    phjDF = phjDF.loc[phjMaskArr,phjVarNamesList].reset_index(drop = True)
     
     return phjDF
 
@@ -305,17 +964,62 @@ def phjCreateContingencyTable(phjDF,
 
 
 
+def phjCreateContingencyTableFromCounts(phjDF,
+                                        phjCaseVarName,
+                                        phjCaseValue,
+                                        phjRiskFactorVarName,
+                                        phjFreqVarName):
+    
+    # Creates the same contingency table as phjCreateContingencyTable() but from data in
+    # which each row contains the number of individuals with that combination of risk
+    # factor level and case status. The counts are summed (rather than rows counted) and,
+    # therefore, the data never need to be expanded to one row per individual.
+    phjContTable = phjDF.groupby([phjRiskFactorVarName,phjCaseVarName])[phjFreqVarName].sum().unstack(fill_value = 0)
+    
+    phjContTable = phjContTable[phjCaseFirst(phjDF = phjContTable,
+                                             phjCaseValue = phjCaseValue)]
+    
+    return phjContTable
+
+
+
 def phjCalcRRORwithCI(phjTempContDF,
                       phjRatioType,
                       phjCaseControlValuesList = None,
                       phjRiskFactorBaseValue = None,
                       phjAlpha = 0.05,
+                      phjCIMethod = None,
+                      phjBootstrapReplicatesInt = 1000,
+                      phjRandomSeedInt = None,
                       phjPrintResults = False):
     
     # Set default suffixes and join strings to create column names
     # to use in output tables and dataframes.
     phjSuffixDict = phjDefineSuffixDict(phjAlpha = phjAlpha)
     
+    # If a bootstrap CI has been requested, the method is not chosen automatically
+    if phjCIMethod in ['bootpercentile','bootbca']:
+        phjTempContDF = phjAddBootstrapRatioAndCIValues(phjTempContDF = phjTempContDF,
+                                                        phjRatioType = phjRatioType,
+                                                        phjCIMethod = phjCIMethod,
+                                                        phjCaseControlValuesList = phjCaseControlValuesList,
+                                                        phjRiskFactorBaseValue = phjRiskFactorBaseValue,
+                                                        phjBootstrapReplicatesInt = phjBootstrapReplicatesInt,
+                                                        phjRandomSeedInt = phjRandomSeedInt,
+                                                        phjAlpha = phjAlpha)
+        
+        return phjTempContDF
+    
+    # Exact conditional (and mid-p) CIs can only be calculated for odds ratios
+    if (phjCIMethod in ['exact','midp']) and (phjRatioType == 'oddsratio'):
+        phjTempContDF = phjAddExactRatioAndCIValues(phjTempContDF = phjTempContDF,
+                                                    phjCIMethod = phjCIMethod,
+                                                    phjCaseControlValuesList = phjCaseControlValuesList,
+                                                    phjRiskFactorBaseValue = phjRiskFactorBaseValue,
+                                                    phjAlpha = phjAlpha)
+        
+        return phjTempContDF
+    
     # Create lists of risk factor strata (including base strata) using the index
     phjRiskFactorStrataList = list(phjTempContDF.index)
     
@@ -442,6 +1146,335 @@ def phjCalcRRORwithCI(phjTempContDF,
     return phjTempContDF
 
 
+def phjAddBootstrapRatioAndCIValues(phjTempContDF,
+                                    phjRatioType,
+                                    phjCIMethod,
+                                    phjCaseControlValuesList,
+                                    phjRiskFactorBaseValue,
+                                    phjBootstrapReplicatesInt = 1000,
+                                    phjRandomSeedInt = None,
+                                    phjAlpha = 0.05):
+    
+    # Calculates bootstrap confidence intervals (percentile or BCa) for relative risk or
+    # odds ratio. Rather than resampling individual rows, the contingency table itself is
+    # resampled: for odds ratios (where the numbers of cases and controls are fixed by
+    # design) the cases and controls are each drawn from a multinomial distribution across
+    # the risk factor levels; for relative risks (where the number in each level is fixed)
+    # the cases at each level are drawn from a binomial distribution. All replicates for
+    # all levels are drawn at once, producing arrays of size (replicates x levels). The
+    # point estimate (and each replicate) is calculated using the same estimator as
+    # phjCalcRRORwithCI() would use, i.e. the Katz/Woolf estimates unless any cell is zero
+    # in which case the adjusted estimates are used. A cell that contains zero is zero in
+    # every replicate and, therefore, bootstrap intervals for levels with a zero cell (in
+    # that level or the base level) are too narrow; for these levels, the exact conditional
+    # limits (odds ratios) or adjusted log limits (relative risks) are returned instead and
+    # the method used for each level is recorded in the 'cimethod' column.
+    phjRNG = np.random.default_rng(phjRandomSeedInt)
+    
+    a = phjTempContDF[phjCaseControlValuesList[0]].to_numpy(dtype = np.float64)
+    b = phjTempContDF[phjCaseControlValuesList[1]].to_numpy(dtype = np.float64)
+    
+    phjBasePosInt = list(phjTempContDF.index).index(phjRiskFactorBaseValue)
+    
+    c = np.full(len(a),a[phjBasePosInt])
+    d = np.full(len(a),b[phjBasePosInt])
+    
+    if phjRatioType == 'relrisk':
+        phjEstimatorStr = 'katz' if min(a.min(),b.min()) > 0 else 'adj_log'
+    else:
+        phjEstimatorStr = 'woolf' if min(a.min(),b.min()) > 0 else 'gart'
+    
+    # Point estimates (on log scale)
+    phjRatioArr, _ = phjCalcRatioAndLogSE(a,b,a[phjBasePosInt],b[phjBasePosInt],phjCIMethod = phjEstimatorStr)
+    
+    with np.errstate(divide = 'ignore',invalid = 'ignore'):
+        phjLogRatioArr = np.log(phjRatioArr)
+    
+    # Draw bootstrap replicates of the table
+    if phjRatioType == 'relrisk':
+        phjNArr = (a + b).astype(np.int64)
+        phjBootAArr = phjRNG.binomial(phjNArr,a / np.where(phjNArr > 0,phjNArr,1),size = (phjBootstrapReplicatesInt,len(a))).astype(np.float64)
+        phjBootBArr = phjNArr - phjBootAArr
+    else:
+        phjBootAArr = phjRNG.multinomial(int(a.sum()),a / a.sum(),size = phjBootstrapReplicatesInt).astype(np.float64)
+        phjBootBArr = phjRNG.multinomial(int(b.sum()),b / b.sum(),size = phjBootstrapReplicatesInt).astype(np.float64)
+    
+    phjBootRatioArr, _ = phjCalcRatioAndLogSE(phjBootAArr,
+                                              phjBootBArr,
+                                              phjBootAArr[:,[phjBasePosInt]],
+                                              phjBootBArr[:,[phjBasePosInt]],
+                                              phjCIMethod = phjEstimatorStr)
+    
+    with np.errstate(divide = 'ignore',invalid = 'ignore'):
+        phjBootLogRatioArr = np.log(phjBootRatioArr)
+    
+    phjLowerQArr = np.full(len(a),phjAlpha / 2)
+    phjUpperQArr = np.full(len(a),1 - (phjAlpha / 2))
+    
+    if phjCIMethod == 'bootbca':
+        # Bias correction: proportion of replicates less than the point estimate
+        phjPropLessArr = ( (phjBootLogRatioArr < phjLogRatioArr).sum(axis = 0) +
+                           0.5 * (phjBootLogRatioArr == phjLogRatioArr).sum(axis = 0) ) / phjBootstrapReplicatesInt
+        phjPropLessArr = np.clip(phjPropLessArr,1 / (phjBootstrapReplicatesInt + 1),phjBootstrapReplicatesInt / (phjBootstrapReplicatesInt + 1))
+        phjZ0Arr = norm.ppf(phjPropLessArr)
+        
+        # Acceleration: calculated from the jackknife (leave-one-out) estimates. Since all
+        # individuals in the same cell give the same leave-one-out estimate, only 4 distinct
+        # values are needed for each level (removing one from cell a, b, c or d) and these
+        # are weighted by the cell counts; removing an individual from any other level leaves
+        # the estimate unchanged.
+        phjJackWeightsList = [a,b,c,d]
+        phjJackCellsList = [[a - 1,b,c,d],
+                            [a,b - 1,c,d],
+                            [a,b,c - 1,d],
+                            [a,b,c,d - 1]]
+        
+        with np.errstate(divide = 'ignore',invalid = 'ignore'):
+            phjJackArr = np.stack([np.log(phjCalcRatioAndLogSE(*cells,phjCIMethod = phjEstimatorStr)[0]) for cells in phjJackCellsList])
+        
+        phjJackWeightsArr = np.stack(phjJackWeightsList)
+        phjJackWeightsArr = np.where(np.isfinite(phjJackArr),phjJackWeightsArr,0)
+        phjJackArr = np.where(phjJackWeightsArr > 0,phjJackArr,0)
+        
+        phjTotalInt = a.sum() + b.sum()
+        phjOtherWeightsArr = phjTotalInt - phjJackWeightsArr.sum(axis = 0)
+        
+        phjJackMeanArr = ((phjJackWeightsArr * phjJackArr).sum(axis = 0) + phjOtherWeightsArr * phjLogRatioArr) / phjTotalInt
+        
+        phjNumArr = (phjJackWeightsArr * (phjJackMeanArr - phjJackArr)**3).sum(axis = 0) + phjOtherWeightsArr * (phjJackMeanArr - phjLogRatioArr)**3
+        phjDenArr = (phjJackWeightsArr * (phjJackMeanArr - phjJackArr)**2).sum(axis = 0) + phjOtherWeightsArr * (phjJackMeanArr - phjLogRatioArr)**2
+        
+        with np.errstate(divide = 'ignore',invalid = 'ignore'):
+            phjAccArr = np.where(phjDenArr > 0,phjNumArr / (6 * phjDenArr**1.5),0)
+        
+        phjZLowerArr = phjZ0Arr + norm.ppf(phjLowerQArr)
+        phjZUpperArr = phjZ0Arr + norm.ppf(phjUpperQArr)
+        
+        phjLowerQArr = norm.cdf(phjZ0Arr + phjZLowerArr / (1 - phjAccArr * phjZLowerArr))
+        phjUpperQArr = norm.cdf(phjZ0Arr + phjZUpperArr / (1 - phjAccArr * phjZUpperArr))
+    
+    # Quantiles of the replicates for each level (each level can have a different
+    # quantile in the BCa method). Replicates that could not be calculated (NaN) are
+    # sorted to the end and ignored.
+    phjSortedArr = np.sort(phjBootLogRatioArr,axis = 0)
+    phjNumValidArr = (~np.isnan(phjSortedArr)).sum(axis = 0)
+    
+    phjLimitsList = []
+    for phjQArr in [phjLowerQArr,phjUpperQArr]:
+        phjPosArr = phjQArr * np.maximum(phjNumValidArr - 1,0)
+        phjLowPosArr = np.floor(phjPosArr).astype(np.int64)
+        phjHighPosArr = np.minimum(phjLowPosArr + 1,np.maximum(phjNumValidArr - 1,0))
+        phjFracArr = phjPosArr - phjLowPosArr
+        
+        phjLowValArr = np.take_along_axis(phjSortedArr,phjLowPosArr[np.newaxis,:],axis = 0)[0]
+        phjHighValArr = np.take_along_axis(phjSortedArr,phjHighPosArr[np.newaxis,:],axis = 0)[0]
+        
+        with np.errstate(invalid = 'ignore'):
+            phjLimitsList.append(np.round(np.exp(np.where(phjHighValArr == phjLowValArr,phjLowValArr,phjLowValArr + phjFracArr * (phjHighValArr - phjLowValArr))),4))
+    
+    phjCIColsNamesList = phjCreateCIColsNamesList(phjRatioType = phjRatioType,
+                                                  phjCIMethod = phjCIMethod,
+                                                  phjAlpha = phjAlpha)
+    
+    # Confidence intervals are not calculated for the base level
+    phjBaseMaskArr = (np.arange(len(a)) == phjBasePosInt)
+    
+    phjLimitsList = [np.where(phjBaseMaskArr | (phjNumValidArr == 0),np.nan,phjLimitsList[0]),
+                     np.where(phjBaseMaskArr | (phjNumValidArr == 0),np.nan,phjLimitsList[1])]
+    
+    # Replace the bootstrap limits for levels with a zero cell
+    phjZeroCellArr = (np.minimum(np.minimum(a,b),np.minimum(c,d)) == 0) & ~phjBaseMaskArr
+    
+    if phjRatioType == 'relrisk':
+        phjFallbackMethodStr = 'adj_log'
+    else:
+        phjFallbackMethodStr = 'exact'
+    
+    if phjZeroCellArr.any():
+        if phjRatioType == 'relrisk':
+            phjAdjRatioArr, phjAdjLogSEArr = phjCalcRatioAndLogSE(a,b,c,d,phjCIMethod = 'adj_log')
+            phjFallbackList = phjCalcCI_lognormal(phjUntransformedPointEstimate = phjAdjRatioArr,
+                                                  phjTransformedSE = phjAdjLogSEArr,
+                                                  phjAlpha = phjAlpha)
+        else:
+            phjExactArr = np.array([phjCalcExactOddsRatioCI(a = int(a[i]),
+                                                            phjExposedInt = int(a[i] + b[i]),
+                                                            phjCasesInt = int(a[i] + c[i]),
+                                                            phjTotalInt = int(a[i] + b[i] + c[i] + d[i]),
+                                                            phjAlpha = phjAlpha) if phjZeroCellArr[i] else (np.nan,np.nan,np.nan) for i in range(len(a))],
+                                   dtype = np.float64).reshape(-1,3)
+            phjFallbackList = [phjExactArr[:,1],phjExactArr[:,2]]
+        
+        phjLimitsList = [np.where(phjZeroCellArr,phjFallbackList[0],phjLimitsList[0]),
+                         np.where(phjZeroCellArr,phjFallbackList[1],phjLimitsList[1])]
+        
+        print("\nWarning: bootstrap confidence intervals cannot be calculated for levels with a zero cell; '{0}' confidence intervals have been calculated for level(s) {1}.".format(phjFallbackMethodStr,
+                                                                                                                                                                                    ', '.join(["'{}'".format(i) for i in phjTempContDF.index[phjZeroCellArr]])))
+    
+    phjSuffixDict = phjDefineSuffixDict(phjAlpha = phjAlpha)
+    
+    phjTempContDF[phjCIColsNamesList[0]] = phjRatioArr
+    phjTempContDF[phjCIColsNamesList[1]] = phjLimitsList[0]
+    phjTempContDF[phjCIColsNamesList[2]] = phjLimitsList[1]
+    phjTempContDF[phjSuffixDict['joinstr'].join([phjSuffixDict[phjRatioType],phjSuffixDict['cimethod']])] = np.where(phjZeroCellArr,
+                                                                                                                      phjSuffixDict[phjFallbackMethodStr],
+                                                                                                                      phjSuffixDict[phjCIMethod])
+    
+    return phjTempContDF
+
+
+def phjAddExactRatioAndCIValues(phjTempContDF,
+                                phjCIMethod,
+                                phjCaseControlValuesList,
+                                phjRiskFactorBaseValue,
+                                phjAlpha = 0.05):
+    
+    # Calculates the conditional maximum likelihood estimate of the odds ratio and the
+    # exact conditional (Fisher) or mid-p confidence interval for each level of the risk
+    # factor compared with the base level. The calculations for each 2 x 2 table are done
+    # by phjCalcExactOddsRatioCI() which caches results so that tables that occur more
+    # than once are only calculated once.
+    a = phjTempContDF[phjCaseControlValuesList[0]].to_numpy(dtype = np.int64)
+    b = phjTempContDF[phjCaseControlValuesList[1]].to_numpy(dtype = np.int64)
+    c = int(phjTempContDF.loc[phjRiskFactorBaseValue,phjCaseControlValuesList[0]])
+    d = int(phjTempContDF.loc[phjRiskFactorBaseValue,phjCaseControlValuesList[1]])
+    
+    phjResultsArr = np.array([phjCalcExactOddsRatioCI(a = int(a[i]),
+                                                      phjExposedInt = int(a[i] + b[i]),
+                                                      phjCasesInt = int(a[i] + c),
+                                                      phjTotalInt = int(a[i] + b[i] + c + d),
+                                                      phjAlpha = phjAlpha,
+                                                      phjMidP = (phjCIMethod == 'midp')) for i in range(len(a))],
+                             dtype = np.float64).reshape(-1,3)
+    
+    phjCIColsNamesList = phjCreateCIColsNamesList(phjRatioType = 'oddsratio',
+                                                  phjCIMethod = phjCIMethod,
+                                                  phjAlpha = phjAlpha)
+    
+    # Confidence intervals are not calculated for the base level
+    phjBaseMaskArr = (phjTempContDF.index == phjRiskFactorBaseValue)
+    
+    phjTempContDF[phjCIColsNamesList[0]] = np.where(phjBaseMaskArr,1.0,phjResultsArr[:,0])
+    phjTempContDF[phjCIColsNamesList[1]] = np.where(phjBaseMaskArr,np.nan,phjResultsArr[:,1])
+    phjTempContDF[phjCIColsNamesList[2]] = np.where(phjBaseMaskArr,np.nan,phjResultsArr[:,2])
+    
+    return phjTempContDF
+
+
+
+@functools.lru_cache(maxsize = 1024)
+def phjGetNoncentralHypergeometricLogBase(phjExposedInt,
+                                          phjCasesInt,
+                                          phjTotalInt):
+    
+    # Conditional on the margins of a 2 x 2 table (exposed, cases and total), the number
+    # of exposed cases follows a noncentral hypergeometric distribution. This function
+    # returns the support of the distribution and the log of the product of binomial
+    # coefficients for each value in the support; the log-pmf for any odds ratio is then
+    # obtained by adding x * log(OR) and normalising. The arrays depend only on the margins
+    # and are cached; they are made read-only so that the cached values cannot be modified
+    # by the calling function.
+    phjUnexposedInt = phjTotalInt - phjExposedInt
+    
+    phjSupportArr = np.arange(max(0,phjCasesInt - phjUnexposedInt),min(phjCasesInt,phjExposedInt) + 1)
+    
+    phjLogBaseArr = ( gammaln(phjExposedInt + 1) - gammaln(phjSupportArr + 1) - gammaln(phjExposedInt - phjSupportArr + 1) +
+                      gammaln(phjUnexposedInt + 1) - gammaln(phjCasesInt - phjSupportArr + 1) - gammaln(phjUnexposedInt - phjCasesInt + phjSupportArr + 1) )
+    
+    phjSupportArr.setflags(write = False)
+    phjLogBaseArr.setflags(write = False)
+    
+    return phjSupportArr, phjLogBaseArr
+
+
+
+def phjNoncentralHypergeometricPMF(phjLogBaseArr,
+                                   phjSupportArr,
+                                   phjLogOR):
+    
+    # Probabilities for all values in the support calculated at once
+    phjLogPMFArr = phjLogBaseArr + phjSupportArr * phjLogOR
+    phjPMFArr = np.exp(phjLogPMFArr - phjLogPMFArr.max())
+    
+    return phjPMFArr / phjPMFArr.sum()
+
+
+
+@functools.lru_cache(maxsize = 1024)
+def phjCalcExactOddsRatioCI(a,
+                            phjExposedInt,
+                            phjCasesInt,
+                            phjTotalInt,
+                            phjAlpha = 0.05,
+                            phjMidP = False):
+    
+    # Returns the conditional maximum likelihood estimate of the odds ratio and the lower
+    # and upper limits of the exact conditional (or mid-p) confidence interval for a 2 x 2
+    # table with a exposed cases and the given margins. The limits are the odds ratios at
+    # which the upper and lower tail probabilities equal alpha/2; these are found by
+    # root-finding on the log scale. Results are cached by table and margins.
+    phjSupportArr, phjLogBaseArr = phjGetNoncentralHypergeometricLogBase(phjExposedInt = phjExposedInt,
+                                                                         phjCasesInt = phjCasesInt,
+                                                                         phjTotalInt = phjTotalInt)
+    
+    # If the margins allow only one table, the data contain no information about the OR
+    if len(phjSupportArr) < 2:
+        return (np.nan,0.0,np.inf)
+    
+    # Weight given to probability of observed table (0.5 for mid-p)
+    phjObsWeight = 0.5 if phjMidP else 1.0
+    
+    def phjUpperTail(phjLogOR):
+        p = phjNoncentralHypergeometricPMF(phjLogBaseArr,phjSupportArr,phjLogOR)
+        return p[phjSupportArr > a].sum() + phjObsWeight * p[phjSupportArr == a].sum()
+    
+    def phjLowerTail(phjLogOR):
+        p = phjNoncentralHypergeometricPMF(phjLogBaseArr,phjSupportArr,phjLogOR)
+        return p[phjSupportArr < a].sum() + phjObsWeight * p[phjSupportArr == a].sum()
+    
+    def phjExpectedDiff(phjLogOR):
+        p = phjNoncentralHypergeometricPMF(phjLogBaseArr,phjSupportArr,phjLogOR)
+        return (phjSupportArr * p).sum() - a
+    
+    def phjFindRoot(phjFunc):
+        # All functions are monotonic in log(OR); widen the bracket until it contains the root
+        phjBoundFloat = 10.0
+        while (np.sign(phjFunc(-phjBoundFloat)) == np.sign(phjFunc(phjBoundFloat))) and (phjBoundFloat < 1000):
+            phjBoundFloat = phjBoundFloat * 2
+        
+        # If the root is still not bracketed, it lies beyond one end of the bracket and the
+        # odds ratio is returned as 0 or infinity (rather than brentq() raising an error).
+        # An increasing function that is positive at both ends (or a decreasing function
+        # that is negative at both ends) has its root below the lower end.
+        phjLowFloat = phjFunc(-phjBoundFloat)
+        phjHighFloat = phjFunc(phjBoundFloat)
+        
+        if (phjLowFloat * phjHighFloat) > 0:
+            if (phjLowFloat > 0) == (phjHighFloat >= phjLowFloat):
+                return 0.0
+            else:
+                return np.inf
+        
+        return math.exp(brentq(phjFunc,-phjBoundFloat,phjBoundFloat,xtol = 1e-10))
+    
+    if a == phjSupportArr[0]:
+        phjOR = 0.0
+        phjLowerLimit = 0.0
+    else:
+        phjLowerLimit = phjFindRoot(lambda t: phjUpperTail(t) - phjAlpha/2)
+    
+    if a == phjSupportArr[-1]:
+        phjOR = np.inf
+        phjUpperLimit = np.inf
+    else:
+        phjUpperLimit = phjFindRoot(lambda t: phjLowerTail(t) - phjAlpha/2)
+    
+    if phjSupportArr[0] < a < phjSupportArr[-1]:
+        phjOR = phjFindRoot(phjExpectedDiff)
+    
+    return (phjOR,round(phjLowerLimit,4),round(phjUpperLimit,4))
+
+
 
 def phjCreateCIColsNamesList(phjRatioType,
                              phjCIMethod,
@@ -468,12 +1501,14 @@ def phjAddEmptyColumns(phjTempContDF,
                        phjRiskFactorStrataList,
                        phjCIColsNamesList):
     
-    # Create an empty dataframe containing '---' values and join it to the main dataframe.
+    # Create an empty dataframe containing missing values and join it to the main dataframe.
+    # (The columns used to be filled with '---' strings but this resulted in columns with
+    # an object dtype; the columns are now float64.)
     # Originally, it was intended to create a table containing CI only but, for some
     # approximations, it is necessary to access the original cell counts. Therefore, the
     # whole dataframe is passed to this function and empty columns added to it, later to
     # be filled with calculated values.
-    phjEmptyDF = pd.DataFrame(index = phjRiskFactorStrataList,columns = phjCIColsNamesList).fillna('---')
+    phjEmptyDF = pd.DataFrame(index = phjRiskFactorStrataList,columns = phjCIColsNamesList,dtype = np.float64)
     phjTempContDF = phjTempContDF.join(phjEmptyDF)
     
     return phjTempContDF
@@ -487,175 +1522,135 @@ def phjAddRatioAndCIValues(phjTempContDF,
                            phjCIColsNamesList,
                            phjAlpha = 0.05):
     
-    # Set default suffixes and join strings to create column names
-    # to use in output tables and dataframes.
-    phjSuffixDict = phjDefineSuffixDict(phjAlpha = phjAlpha)
+    # The ratios and confidence intervals are calculated for all strata of the risk factor
+    # at once using arrays of cell values. For each stratum, the cells are:
+    #     a = cases in stratum, b = controls in stratum,
+    #     c = cases in base stratum, d = controls in base stratum.
+    a = phjTempContDF[phjCaseControlValuesList[0]].to_numpy(dtype = np.float64)
+    b = phjTempContDF[phjCaseControlValuesList[1]].to_numpy(dtype = np.float64)
+    c = float(phjTempContDF.loc[phjRiskFactorBaseValue,phjCaseControlValuesList[0]])
+    d = float(phjTempContDF.loc[phjRiskFactorBaseValue,phjCaseControlValuesList[1]])
     
-    # Create lists of risk factor strata (including base strata) using the index
-    phjRiskFactorStrataList = list(phjTempContDF.index)
+    if phjCIMethod not in ['katz','adj_log','woolf','gart']:
+        return phjTempContDF
     
-    if phjCIMethod == 'katz':
-        # Calculate relative risk
-        phjTempContDF[phjSuffixDict['relrisk']] = phjTempContDF[phjSuffixDict['risk']] / phjTempContDF.loc[phjRiskFactorBaseValue,phjSuffixDict['risk']]
-        
-        # Calculate confidence intervals
-        # Step through each stratum of the risk factor (except the base value)
-        phjRiskFactorStrataList.remove(phjRiskFactorBaseValue)
-        for phjStratum in phjRiskFactorStrataList:
-            # Create a dictionary containing cells a, b, c and d
-            phjCellValuesDict = phjDefineCellValuesDict(phjTempContDF = phjTempContDF,
-                                                        phjStratum = phjStratum,
-                                                        phjCaseControlValuesList = phjCaseControlValuesList,
-                                                        phjRiskFactorBaseValue = phjRiskFactorBaseValue)
+    phjRatioArr, phjLogSEArr = phjCalcRatioAndLogSE(a,b,c,d,phjCIMethod = phjCIMethod)
+    
+    # Calculate CI (not calculated for the base stratum).
+    # Returned as a list in order of lower limit and upper limit.
+    with np.errstate(divide = 'ignore',invalid = 'ignore'):
+        phjRiskFactorCIList = phjCalcCI_lognormal(phjUntransformedPointEstimate = phjRatioArr,
+                                                  phjTransformedSE = np.where(phjTempContDF.index == phjRiskFactorBaseValue,np.nan,phjLogSEArr),
+                                                  phjAlpha = phjAlpha)
+    
+    # Add ratio and CI values to dataframe
+    # (N.B. The phjCIColsNamesList consists of [ratio, ci_lower, ci_upper].)
+    phjTempContDF[phjCIColsNamesList[0]] = phjRatioArr
+    phjTempContDF[phjCIColsNamesList[1]] = phjRiskFactorCIList[0]
+    phjTempContDF[phjCIColsNamesList[2]] = phjRiskFactorCIList[1]
+    
+    return phjTempContDF
+
+
+
+def phjCalcRatioAndLogSE(a,
+                         b,
+                         c,
+                         d,
+                         phjCIMethod):
+    
+    # Calculates relative risk or odds ratio and the SE of the natural log of the ratio
+    # for the given CI method. Cells a and b are the cases and controls in each stratum and
+    # cells c and d are the cases and controls in the base stratum; each can be a single
+    # value or a numpy array.
+    with np.errstate(divide = 'ignore',invalid = 'ignore'):
+        
+        if phjCIMethod == 'katz':
+            # Calculate relative risk
+            phjRatioArr = (a / (a + b)) / (c / (c + d))
             
             # Calculate SE of natural log of relative risk.
             # SE of log of RR is calulcated as sqrt( b/(a(a+b)) + d/(c(c+d)) ).
             # Alternatively, sqrt( 1/a + 1/c - 1/(a+b) - 1/(c+d))
-            phjLogSE = math.sqrt( ( phjCellValuesDict['b'] / ( phjCellValuesDict['a']*( phjCellValuesDict['a'] + phjCellValuesDict['b'] ) ) ) +
-                               ( phjCellValuesDict['d'] / ( phjCellValuesDict['c']*( phjCellValuesDict['c'] + phjCellValuesDict['d'] ) ) ) )
-            
-            # Calculate 95% CI.
-            # Returned as a list in order of lower limit and upper limit.
-            phjRiskFactorCIList = phjCalcCI_lognormal(phjUntransformedPointEstimate = phjTempContDF.loc[phjStratum,phjSuffixDict['relrisk']],
-                                                      phjTransformedSE = phjLogSE,
-                                                      phjAlpha = phjAlpha)
-            
-            # Add 95CI values to dataframe
-            phjTempContDF.loc[phjStratum,phjCIColsNamesList[1]] = phjRiskFactorCIList[0]
-            phjTempContDF.loc[phjStratum,phjCIColsNamesList[2]] = phjRiskFactorCIList[1]
-    
-    
-    elif phjCIMethod == 'adj_log':
-        # Step through each stratum of the risk factor (except the base value)
-        phjRiskFactorStrataList.remove(phjRiskFactorBaseValue)
-        for phjStratum in phjRiskFactorStrataList:
-            # Create a dictionary containing cells a, b, c and d
-            phjCellValuesDict = phjDefineCellValuesDict(phjTempContDF = phjTempContDF,
-                                                        phjStratum = phjStratum,
-                                                        phjCaseControlValuesList = phjCaseControlValuesList,
-                                                        phjRiskFactorBaseValue = phjRiskFactorBaseValue)
-            
+            phjLogSEArr = np.sqrt( (b / (a * (a + b))) + (d / (c * (c + d))) )
+        
+        elif phjCIMethod == 'adj_log':
             # Estimate relative risk (since at least one of the cell values is zero)
             # (Ref: Morten et al (2011_. Recommended confidence intervals for two independent
             #       binomial proportions. Statistical Methods in Medical Research 0(0) 1–31; see page 14)
-            phjTempContDF.loc[phjStratum,phjSuffixDict['relrisk']] = ((phjCellValuesDict['a'] + 0.5) / (phjCellValuesDict['a'] + phjCellValuesDict['b'] + 0.5)) / ((phjCellValuesDict['c'] + 0.5) / (phjCellValuesDict['c'] + phjCellValuesDict['d'] + 0.5))
+            phjRatioArr = ((a + 0.5) / (a + b + 0.5)) / ((c + 0.5) / (c + d + 0.5))
             
             # Calculate SE of natural log of relative risk.
             # Adjusted SE of log of RR is calulcated as sqrt( 1/(a + 0.5) + 1/(c + 0.5) - 1/((a+b) + 0.5) - 1/((c+d) + 0.5) ).
-            # Alternatively, sqrt( 1/a + 1/c - 1/(a+b) - 1/(c+d))
-            phjLogSE = math.sqrt( (1 / (phjCellValuesDict['a'] + 0.5)) +
-                               (1 / (phjCellValuesDict['c'] + 0.5)) -
-                               (1 / (phjCellValuesDict['a'] + phjCellValuesDict['b'] + 0.5)) -
-                               (1 / (phjCellValuesDict['c'] + phjCellValuesDict['d'] + 0.5)))
-            
-            # Calculate 95% CI
-            phjRiskFactorCIList = phjCalcCI_lognormal(phjUntransformedPointEstimate = phjTempContDF.loc[phjStratum,phjSuffixDict['relrisk']],
-                                                      phjTransformedSE = phjLogSE,
-                                                      phjAlpha = phjAlpha)
-            
-            # Add list of 95CI to dataframe
-            phjTempContDF.loc[phjStratum,phjCIColsNamesList[1]] = phjRiskFactorCIList[0]
-            phjTempContDF.loc[phjStratum,phjCIColsNamesList[2]] = phjRiskFactorCIList[1]
-    
-    
-    elif phjCIMethod == 'woolf':
-        # Calculate odds ratio
-        phjTempContDF[phjSuffixDict['oddsratio']] = phjTempContDF[phjSuffixDict['odds']] / phjTempContDF.loc[phjRiskFactorBaseValue,phjSuffixDict['odds']]
+            phjLogSEArr = np.sqrt( (1 / (a + 0.5)) + (1 / (c + 0.5)) - (1 / (a + b + 0.5)) - (1 / (c + d + 0.5)) )
         
-        # Calculate confidence intervals
-        # Step through each stratum of the risk factor (except the base value)
-        phjRiskFactorStrataList.remove(phjRiskFactorBaseValue)
-        for phjStratum in phjRiskFactorStrataList:
-            # Produce a list that contains the values contained in risk factor stratum and base stratum
-            # The following is a list comprehension of the form given below. It was given by Alex Martelli at:
-            # http://stackoverflow.com/questions/952914/making-a-flat-list-out-of-list-of-lists-in-python
-            # myList = [item for sublist in tempList for item in sublist].
-            # Also, see comment relating to calculation of CI for relative risk and the
-            # retrieval of cell data in the wrong order.
-            phjCellValuesList = [item for sublist in phjTempContDF.loc[[phjStratum,phjRiskFactorBaseValue],phjCaseControlValuesList].values.tolist() for item in sublist]
+        elif phjCIMethod == 'woolf':
+            # Calculate odds ratio
+            phjRatioArr = (a / b) / (c / d)
             
             # Calculate SE of natural log of odds ratio.
             # SE of log of OR is calulcated as sqrt(1/a + 1/b + 1/c + 1/d).
-            phjLogSE = math.sqrt(sum([1/n for n in phjCellValuesList]))
-            
-            # Calculate 95% CI.
-            # Returned as a list in order of lower limit and upper limit.
-            phjRiskFactorCIList = phjCalcCI_lognormal(phjUntransformedPointEstimate = phjTempContDF.loc[phjStratum,phjSuffixDict['oddsratio']],
-                                                      phjTransformedSE = phjLogSE,
-                                                      phjAlpha = phjAlpha)
-            
-            # Add 95CI values to dataframe
-            # (N.B. The phjCIColsNamesList consists of [or, ci_lower, ci_upper].
-            #       Therefore, to put data in correct cells, use list[1] and list[2].
-            #       Perhaps I should use a dict.
-            phjTempContDF.loc[phjStratum,phjCIColsNamesList[1]] = phjRiskFactorCIList[0]
-            phjTempContDF.loc[phjStratum,phjCIColsNamesList[2]] = phjRiskFactorCIList[1]
-    
-    
-    elif phjCIMethod == 'gart':
-        # Step through each stratum of the risk factor (except the base value)
-        phjRiskFactorStrataList.remove(phjRiskFactorBaseValue)
-        for phjStratum in phjRiskFactorStrataList:
-            # Create a dictionary containing cells a, b, c and d
-            phjCellValuesDict = phjDefineCellValuesDict(phjTempContDF = phjTempContDF,
-                                                        phjStratum = phjStratum,
-                                                        phjCaseControlValuesList = phjCaseControlValuesList,
-                                                        phjRiskFactorBaseValue = phjRiskFactorBaseValue)
-            
+            phjLogSEArr = np.sqrt( (1 / a) + (1 / b) + (1 / c) + (1 / d) )
+        
+        elif phjCIMethod == 'gart':
             # Estimate odds ratio (since at least one of the cell values is zero)
             # (Ref: Morten et al (2011_. Recommended confidence intervals for two independent
             #       binomial proportions. Statistical Methods in Medical Research 0(0) 1–31; see page 14)
-            phjTempContDF.loc[phjStratum,phjSuffixDict['oddsratio']] = ( ((phjCellValuesDict['a'] + 0.5) * (phjCellValuesDict['d'] + 0.5)) / ((phjCellValuesDict['b'] + 0.5) * (phjCellValuesDict['c'] + 0.5)) )
-            
-            # Calculate SE of natural log of relative risk.
-            # Adjusted SE of log of RR is calulcated as sqrt( 1/(a + 0.5) + 1/(c + 0.5) - 1/((a+b) + 0.5) - 1/((c+d) + 0.5) ).
-            # Alternatively, sqrt( 1/a + 1/c - 1/(a+b) - 1/(c+d))
-            phjLogSE = math.sqrt( (1 / (phjCellValuesDict['a'] + 0.5)) +
-                               (1 / (phjCellValuesDict['b'] + 0.5)) +
-                               (1 / (phjCellValuesDict['c'] + 0.5)) +
-                               (1 / (phjCellValuesDict['d'] + 0.5)) )
-            
-            # Calculate 95% CI
-            phjRiskFactorCIList = phjCalcCI_lognormal(phjUntransformedPointEstimate = phjTempContDF.loc[phjStratum,phjSuffixDict['oddsratio']],
-                                                      phjTransformedSE = phjLogSE,
-                                                      phjAlpha = phjAlpha)
+            phjRatioArr = ((a + 0.5) * (d + 0.5)) / ((b + 0.5) * (c + 0.5))
             
-            # Add list of 95CI to dataframe
-            phjTempContDF.loc[phjStratum,phjCIColsNamesList[1]] = phjRiskFactorCIList[0]
-            phjTempContDF.loc[phjStratum,phjCIColsNamesList[2]] = phjRiskFactorCIList[1]
-    
-    
-    else:
-        phjTempContDF = phTempContDF
+            # Calculate SE of natural log of odds ratio.
+            # Adjusted SE of log of OR is calulcated as sqrt( 1/(a + 0.5) + 1/(b + 0.5) + 1/(c + 0.5) + 1/(d + 0.5) ).
+            phjLogSEArr = np.sqrt( (1 / (a + 0.5)) + (1 / (b + 0.5)) + (1 / (c + 0.5)) + (1 / (d + 0.5)) )
     
-    return phjTempContDF
+    return phjRatioArr, phjLogSEArr
 
 
 
-def phjDefineCellValuesDict(phjTempContDF,
-                            phjStratum,
-                            phjCaseControlValuesList,
-                            phjRiskFactorBaseValue):
-                                                        
-    # The values in the cells that represent a, b, c, and d can't be stored in a list
-    # using a list comprehension (as with the odds ratio calculation) because there is
-    # a bug in Pandas 0.19.2 and several subsequent releases that caused the 
-    # results in the cells to be retrieved in the wrong order; for the OR calculation,
-    # the order was not important. This bug was reported to the Pandas GitHub page.
-    # Instead, retrieve values from table and allocate to variables named a, b, c, d and
-    # then stored in a list
-    a = phjTempContDF.loc[phjStratum,phjCaseControlValuesList[0]]
-    b = phjTempContDF.loc[phjStratum,phjCaseControlValuesList[1]]
-    c = phjTempContDF.loc[phjRiskFactorBaseValue,phjCaseControlValuesList[0]]
-    d = phjTempContDF.loc[phjRiskFactorBaseValue,phjCaseControlValuesList[1]]
+def phjCountCasesByRiskFactorLevel(phjDF,
+                                   phjCaseVarName,
+                                   phjRiskFactorVarNamesList,
+                                   phjMissingValue = np.nan):
+    
+    # The dataframe contains the risk factor columns and a boolean case column. Each risk
+    # factor is coded as integers using pd.factorize() and the codes are offset so that
+    # every level of every risk factor has a unique code. The codes are stacked into a
+    # single array (equivalent to melting the risk factor columns into one long column)
+    # and the number of cases and observations for every level of every risk factor are
+    # counted in a single pass using np.bincount(). This avoids melting values of mixed
+    # types into an object column and grouping on that column, which is slow.
+    phjCaseArr = phjDF[phjCaseVarName].to_numpy(dtype = bool)
+    
+    phjCodesArr = np.empty((len(phjRiskFactorVarNamesList),len(phjCaseArr)),dtype = np.int64)
+    phjVarNamesList = []
+    phjLevelsArrList = []
+    phjOffsetInt = 0
+    
+    for i,phjVarName in enumerate(phjRiskFactorVarNamesList):
+        # Missing values (including empty cells) are coded as -1 and only the
+        # remaining values are factorized
+        phjMaskArr = phjGetNonMissingMask(phjDF = phjDF,
+                                          phjVarNamesList = [phjVarName],
+                                          phjMissingValue = phjMissingValue)
+        
+        phjCodes, phjUniques = pd.factorize(phjDF.loc[phjMaskArr,phjVarName])
+        
+        phjCodesArr[i] = -1
+        phjCodesArr[i,phjMaskArr] = phjCodes + phjOffsetInt
+        phjVarNamesList = phjVarNamesList + [phjVarName]*len(phjUniques)
+        phjLevelsArrList.append(np.asarray(phjUniques,dtype = object))
+        phjOffsetInt = phjOffsetInt + len(phjUniques)
+    
+    phjValidArr = (phjCodesArr >= 0)
     
-    phjCellValuesDict = {}
-    phjCellValuesDict['a'] = a
-    phjCellValuesDict['b'] = b
-    phjCellValuesDict['c'] = c
-    phjCellValuesDict['d'] = d
+    phjCasesArr = np.bincount(phjCodesArr[phjValidArr],
+                              weights = np.broadcast_to(phjCaseArr,phjCodesArr.shape)[phjValidArr],
+                              minlength = phjOffsetInt).astype(np.int64)
+    phjObsArr = np.bincount(phjCodesArr[phjValidArr],minlength = phjOffsetInt).astype(np.int64)
     
-    return phjCellValuesDict
+    return pd.DataFrame({'variable': phjVarNamesList,
+                         'level': pd.Series(np.concatenate(phjLevelsArrList) if len(phjLevelsArrList) > 0 else [],dtype = object),
+                         'cases': phjCasesArr,
+                         'controls': phjObsArr - phjCasesArr})
 
 
 
@@ -669,8 +1664,9 @@ def phjCalcCI_lognormal (phjUntransformedPointEstimate,
     # This function takes an UNTRANSFORMED, log-normally distributed point estimate (e.g. either RR or OR) together with SE of
     # the LOG-TRANSFORMED point estimate and returns a list containing the lower and upper limits of the confidence interval,
     # back-transformed to the origianl scale.
-    phjLowerLimit = "{0:.4f}".format(round(math.exp(math.log(phjUntransformedPointEstimate) - phjReliabilityCoefficient*phjTransformedSE),4))
-    phjUpperLimit = "{0:.4f}".format(round(math.exp(math.log(phjUntransformedPointEstimate) + phjReliabilityCoefficient*phjTransformedSE),4))
+    # Point estimates and SEs can be single values or numpy arrays; limits are rounded to 4 decimal places.
+    phjLowerLimit = np.round(np.exp(np.log(phjUntransformedPointEstimate) - phjReliabilityCoefficient*phjTransformedSE),4)
+    phjUpperLimit = np.round(np.exp(np.log(phjUntransformedPointEstimate) + phjReliabilityCoefficient*phjTransformedSE),4)
     
     return [phjLowerLimit, phjUpperLimit]
 
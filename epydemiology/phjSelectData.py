@@ -20,10 +20,34 @@ else:
     import pandas as pd
 
 
+# The pyahocorasick package provides a fast multi-pattern string search that is
+# used to pre-screen free text before running the (slow) screening regex. If it
+# is not installed then a pure Python search for each literal is used instead.
+try:
+    import ahocorasick
+    ahocorasickPresent = True
+except ImportError:
+    ahocorasickPresent = False
+
+
 import collections
+import concurrent.futures
+import functools
+import hashlib
+import itertools
+import os
 import re
+import tempfile
 import inspect
 
+# The regex parser is used to extract literal fragments that must be present in
+# any string matched by the screening regex. In Python 3.11, the sre_parse module
+# was deprecated and moved to re._parser.
+try:
+    import re._parser as phjRegexParser
+except ImportError:
+    import sre_parse as phjRegexParser
+
 
 from .phjMiscFuncs import phjGetStrFromArgOrFile
 from .phjMiscFuncs import phjReadTextFromFile
@@ -243,6 +267,14 @@ def phjGenerateCaseControlDataset(phjAllDataDF,             # A dataframe contai
                                   phjScreeningRegexPathAndFileName = None,
                                   phjControlType = 'consultation',   # The only other option would be 'patient'
                                   phjAggDict = None,
+                                  phjNumberOfWorkersInt = 1,         # Number of worker processes used to screen free text with the regex
+                                  phjScreeningCache = None,          # None (no caching), True (cache in memory) or path to a directory in which to store regex match results
+                                  phjOutputColumnsList = None,       # List of columns to include in the returned dataframe (in addition to ID, 'group' and 'case'); None returns all columns
+                                  phjNumReplicates = None,           # If an integer, the given number of replicate selections of controls is returned in long format (columns 'replicate', ID, 'group', 'case')
+                                  phjMatchingType = 'individual',    # Type of matching ('individual' or 'frequency')
+                                  phjAllocationMethod = 'greedy',    # Method used to allocate matched controls to cases ('greedy' or 'optimal')
+                                  phjLazyColumns = False,            # If True, returns a tuple of the skeleton dataframe (ID, 'group', 'case') and a function to retrieve other columns
+                                  phjRandomSeedInt = None,
                                   phjPrintResults = False):
     
     try:
@@ -278,6 +310,31 @@ def phjGenerateCaseControlDataset(phjAllDataDF,             # A dataframe contai
             phjAssert('phjAggDict',phjAggDict,collections.abc.Mapping)   # collections mapping works for Dict, OrderedDict and UserDict
             # N.B. Other checks on the contents of phjAggDict are done in the phjCollapseOnPatientID() function
         
+        phjAssert('phjNumberOfWorkersInt',phjNumberOfWorkersInt,int,phjAllowedOptions = {'min':1})
+        
+        if phjScreeningCache is not None:
+            assert (phjScreeningCache is True) or isinstance(phjScreeningCache,str), "Parameter 'phjScreeningCache' needs to be None, True (to cache results in memory) or the path to a directory in which to cache results."
+        
+        if phjOutputColumnsList is not None:
+            phjAssert('phjOutputColumnsList',phjOutputColumnsList,list)
+        
+        if phjNumReplicates is not None:
+            phjAssert('phjNumReplicates',phjNumReplicates,int,phjAllowedOptions = {'min':1})
+        
+        phjAssert('phjMatchingType',phjMatchingType,str,phjAllowedOptions = ['individual','frequency'])
+        phjAssert('phjAllocationMethod',phjAllocationMethod,str,phjAllowedOptions = ['greedy','optimal'])
+        
+        # Replicate selections of controls are drawn using individual matching with
+        # controls allocated to cases in the order in which cases are listed (see the
+        # phjSelectReplicateCaseControlSubjects() function).
+        if phjNumReplicates is not None:
+            assert (phjMatchingType == 'individual') and (phjAllocationMethod == 'greedy'), "Replicate datasets (phjNumReplicates = {0}) can only be produced with phjMatchingType = 'individual' and phjAllocationMethod = 'greedy' (phjMatchingType = '{1}' and phjAllocationMethod = '{2}' were requested).".format(phjNumReplicates,phjMatchingType,phjAllocationMethod)
+        
+        phjAssert('phjLazyColumns',phjLazyColumns,bool)
+        
+        if phjRandomSeedInt is not None:
+            phjAssert('phjRandomSeedInt',phjRandomSeedInt,int)
+        
         phjAssert('phjPrintResults',phjPrintResults,bool)
         
         
@@ -369,6 +426,8 @@ def phjGenerateCaseControlDataset(phjAllDataDF,             # A dataframe contai
                                                                      phjFreeTextVarName = phjFreeTextVarName,
                                                                      phjControlType = 'consultation',   # Other option would be 'patient'
                                                                      phjAggDict = phjAggDict,
+                                                                     phjNumberOfWorkersInt = phjNumberOfWorkersInt,
+                                                                     phjScreeningCache = phjScreeningCache,
                                                                      phjPrintResults = phjPrintResults)
                 
                 except AssertionError as e:
@@ -438,12 +497,28 @@ def phjGenerateCaseControlDataset(phjAllDataDF,             # A dataframe contai
             if (phjVerifiedCasesDF is not None) and (phjPotentialControlsDF is not None):
                 
                 # Get a skeleton case-control dataset
-                phjSkeletonCaseControlDF = phjSelectCaseControlDataset(phjCasesDF = phjVerifiedCasesDF,
-                                                                       phjPotentialControlsDF = phjPotentialControlsDF,
-                                                                       phjUniqueIdentifierVarName = phjConsultationIDVarName,
-                                                                       phjMatchingVariablesList = phjMatchingVariablesList,
-                                                                       phjControlsPerCaseInt = phjControlsPerCaseInt,
-                                                                       phjPrintResults = phjPrintResults)
+                if phjNumReplicates is None:
+                    phjSkeletonCaseControlDF = phjSelectCaseControlDataset(phjCasesDF = phjVerifiedCasesDF,
+                                                                           phjPotentialControlsDF = phjPotentialControlsDF,
+                                                                           phjUniqueIdentifierVarName = phjConsultationIDVarName,
+                                                                           phjMatchingVariablesList = phjMatchingVariablesList,
+                                                                           phjControlsPerCaseInt = phjControlsPerCaseInt,
+                                                                           phjMatchingType = phjMatchingType,
+                                                                           phjAllocationMethod = phjAllocationMethod,
+                                                                           phjRNG = np.random.default_rng(phjRandomSeedInt),
+                                                                           phjPrintResults = phjPrintResults)
+                
+                else:
+                    # Draw all replicate selections of controls from the same verified
+                    # cases and potential controls
+                    phjSkeletonCaseControlDF = phjSelectReplicateCaseControlSubjects(phjCasesDF = phjVerifiedCasesDF,
+                                                                                     phjPotentialControlsDF = phjPotentialControlsDF,
+                                                                                     phjUniqueIdentifierVarName = phjConsultationIDVarName,
+                                                                                     phjMatchingVariablesList = phjMatchingVariablesList,
+                                                                                     phjControlsPerCaseInt = phjControlsPerCaseInt,
+                                                                                     phjNumReplicates = phjNumReplicates,
+                                                                                     phjRandomSeedInt = phjRandomSeedInt,
+                                                                                     phjPrintResults = phjPrintResults)
             
             else:
                 phjSkeletonCaseControlDF = None
@@ -481,6 +556,8 @@ def phjGenerateCaseControlDataset(phjAllDataDF,             # A dataframe contai
                                                                  phjFreeTextVarName = phjFreeTextVarName,
                                                                  phjControlType = 'patient',
                                                                  phjAggDict = phjAggDict,
+                                                                 phjNumberOfWorkersInt = phjNumberOfWorkersInt,
+                                                                 phjScreeningCache = phjScreeningCache,
                                                                  phjPrintResults = phjPrintResults)
             
             
@@ -503,12 +580,28 @@ def phjGenerateCaseControlDataset(phjAllDataDF,             # A dataframe contai
                 # Get a skeleton case-control dataset
                 # (i.e. a dataset containing just be bare minimum variables, for example
                 #       unique identifier, case, group and matching variables.)
-                phjSkeletonCaseControlDF = phjSelectCaseControlDataset(phjCasesDF = phjVerifiedCasesDF,
-                                                                       phjPotentialControlsDF = phjPotentialControlsDF,
-                                                                       phjUniqueIdentifierVarName = phjPatientIDVarName,
-                                                                       phjMatchingVariablesList = phjMatchingVariablesList,
-                                                                       phjControlsPerCaseInt = phjControlsPerCaseInt,
-                                                                       phjPrintResults = phjPrintResults)
+                if phjNumReplicates is None:
+                    phjSkeletonCaseControlDF = phjSelectCaseControlDataset(phjCasesDF = phjVerifiedCasesDF,
+                                                                           phjPotentialControlsDF = phjPotentialControlsDF,
+                                                                           phjUniqueIdentifierVarName = phjPatientIDVarName,
+                                                                           phjMatchingVariablesList = phjMatchingVariablesList,
+                                                                           phjControlsPerCaseInt = phjControlsPerCaseInt,
+                                                                           phjMatchingType = phjMatchingType,
+                                                                           phjAllocationMethod = phjAllocationMethod,
+                                                                           phjRNG = np.random.default_rng(phjRandomSeedInt),
+                                                                           phjPrintResults = phjPrintResults)
+                
+                else:
+                    # Draw all replicate selections of controls from the same verified
+                    # cases and potential controls
+                    phjSkeletonCaseControlDF = phjSelectReplicateCaseControlSubjects(phjCasesDF = phjVerifiedCasesDF,
+                                                                                     phjPotentialControlsDF = phjPotentialControlsDF,
+                                                                                     phjUniqueIdentifierVarName = phjPatientIDVarName,
+                                                                                     phjMatchingVariablesList = phjMatchingVariablesList,
+                                                                                     phjControlsPerCaseInt = phjControlsPerCaseInt,
+                                                                                     phjNumReplicates = phjNumReplicates,
+                                                                                     phjRandomSeedInt = phjRandomSeedInt,
+                                                                                     phjPrintResults = phjPrintResults)
             
             else:
                 phjSkeletonCaseControlDF = None
@@ -526,7 +619,12 @@ def phjGenerateCaseControlDataset(phjAllDataDF,             # A dataframe contai
         ### Join skeleton case-control dataframe with full dataframe(s) to retrieve all columns. ###
         ############################################################################################
         
-        if phjSkeletonCaseControlDF is not None:
+        if phjNumReplicates is not None:
+            # Replicate selections are returned in compact long format; other variables
+            # can be added by merging with the required dataframe using the ID variable.
+            phjCaseControlDF = phjSkeletonCaseControlDF
+        
+        elif phjSkeletonCaseControlDF is not None:
             
             if phjControlType == 'consultation':
                 
@@ -551,14 +649,18 @@ def phjGenerateCaseControlDataset(phjAllDataDF,             # A dataframe contai
                     # merge with the cases dataframe (which may have updated or different
                     # content) rather than merge with the overall dataframe.
                     if set(phjVerifiedCasesDF.columns.values) == set(phjAllDataDF.columns.values):
-                        phjCaseControlDF = phjSkeletonCaseControlDF[phjSkeletonCaseControlColumnsList].merge(phjAllDataDF,
-                                                                                                             on = phjConsultationIDVarName,
-                                                                                                             how = 'left')
+                        phjCaseControlDF = phjMergeCaseControlDF(phjSkeletonDF = phjSkeletonCaseControlDF[phjSkeletonCaseControlColumnsList],
+                                                                 phjDataDF = phjAllDataDF,
+                                                                 phjIDVarName = phjConsultationIDVarName,
+                                                                 phjOutputColumnsList = phjOutputColumnsList,
+                                                                 phjLazyColumns = phjLazyColumns)
                     
                     else:
-                        phjCaseControlDF = phjSkeletonCaseControlDF[phjSkeletonCaseControlColumnsList].merge(phjAllDataDF,
-                                                                                                             on = phjConsultationIDVarName,
-                                                                                                             how = 'left')
+                        phjCaseControlDF = phjMergeCaseControlDF(phjSkeletonDF = phjSkeletonCaseControlDF[phjSkeletonCaseControlColumnsList],
+                                                                 phjDataDF = phjAllDataDF,
+                                                                 phjIDVarName = phjConsultationIDVarName,
+                                                                 phjOutputColumnsList = phjOutputColumnsList,
+                                                                 phjLazyColumns = phjLazyColumns)
                 
                 else:
                     # If list of case consultations is NOT a subset of the full dataset
@@ -567,22 +669,12 @@ def phjGenerateCaseControlDataset(phjAllDataDF,             # A dataframe contai
                     # the controls.
                     if set(phjVerifiedCasesDF.columns.values) == set(phjAllDataDF.columns.values):
                         
-                        phjGroupsList = []
-                        
-                        phjTempCaseControlGroups = phjSkeletonCaseControlDF.groupby('case')
-                        for name, group in phjTempCaseControlGroups:
-                            if name == 1:
-                                group = group[phjSkeletonCaseControlColumnsList].merge(phjVerifiedCasesDF,
-                                                                                       on = phjConsultationIDVarName,
-                                                                                       how = 'left')
-                            elif name == 0:
-                                group = group[phjSkeletonCaseControlColumnsList].merge(phjAllDataDF,
-                                                                                       on = phjConsultationIDVarName,
-                                                                                       how = 'left')
-                            
-                            phjGroupsList.append(group)
-                        
-                        phjCaseControlDF = pd.concat(phjGroupsList)
+                        phjCaseControlDF = phjAssembleCaseControlDF(phjSkeletonDF = phjSkeletonCaseControlDF[phjSkeletonCaseControlColumnsList],
+                                                                    phjCasesDF = phjVerifiedCasesDF,
+                                                                    phjControlsDF = phjAllDataDF,
+                                                                    phjIDVarName = phjConsultationIDVarName,
+                                                                    phjOutputColumnsList = phjOutputColumnsList,
+                                                                    phjLazyColumns = phjLazyColumns)
                     
                     else:
                         print("\nThe cases are not a subset of all the data and the two dataframes do not contain the same columns. Therefore, verified cases cannot be identified.")
@@ -636,9 +728,11 @@ def phjGenerateCaseControlDataset(phjAllDataDF,             # A dataframe contai
                                                                            phjAggDict = phjAggDict,
                                                                            phjPrintResults = phjPrintResults)
                         
-                        phjCaseControlDF = phjSkeletonCaseControlDF[phjSkeletonCaseControlColumnsList].merge(phjTempIncludedPatientsDF,
-                                                                                                             on = phjPatientIDVarName,
-                                                                                                             how = 'left')
+                        phjCaseControlDF = phjMergeCaseControlDF(phjSkeletonDF = phjSkeletonCaseControlDF[phjSkeletonCaseControlColumnsList],
+                                                                 phjDataDF = phjTempIncludedPatientsDF,
+                                                                 phjIDVarName = phjPatientIDVarName,
+                                                                 phjOutputColumnsList = phjOutputColumnsList,
+                                                                 phjLazyColumns = phjLazyColumns)
                     
                     else:
                         # Otherwise, the columns in cases dataframe are NOT the same as
@@ -655,9 +749,11 @@ def phjGenerateCaseControlDataset(phjAllDataDF,             # A dataframe contai
                                                                            phjAggDict = phjAggDict,
                                                                            phjPrintResults = phjPrintResults)
                         
-                        phjCaseControlDF = phjSkeletonCaseControlDF[phjSkeletonCaseControlColumnsList].merge(phjTempIncludedPatientsDF,
-                                                                                                             on = phjPatientIDVarName,
-                                                                                                             how = 'left')
+                        phjCaseControlDF = phjMergeCaseControlDF(phjSkeletonDF = phjSkeletonCaseControlDF[phjSkeletonCaseControlColumnsList],
+                                                                 phjDataDF = phjTempIncludedPatientsDF,
+                                                                 phjIDVarName = phjPatientIDVarName,
+                                                                 phjOutputColumnsList = phjOutputColumnsList,
+                                                                 phjLazyColumns = phjLazyColumns)
                 
                 else:
                     # Otherwise, patients in the skeleton case-control dataset are not
@@ -683,22 +779,12 @@ def phjGenerateCaseControlDataset(phjAllDataDF,             # A dataframe contai
                                                                            phjAggDict = phjAggDict,
                                                                            phjPrintResults = phjPrintResults)
                         
-                        phjGroupsList = []
-                        
-                        phjTempCaseControlGroups = phjSkeletonCaseControlDF.groupby('case')
-                        for name, group in phjTempCaseControlGroups:
-                            if name == 1:
-                                group = group[phjSkeletonCaseControlColumnsList].merge(phjVerifiedCasesDF,
-                                                                                       on = phjPatientIDVarName,
-                                                                                       how = 'left')
-                            elif name == 0:
-                                group = group[phjSkeletonCaseControlColumnsList].merge(phjTempIncludedPatientsDF,
-                                                                                       on = phjPatientIDVarName,
-                                                                                       how = 'left')
-                            
-                            phjGroupsList.append(group)
-                    
-                        phjCaseControlDF = pd.concat(phjGroupsList)
+                        phjCaseControlDF = phjAssembleCaseControlDF(phjSkeletonDF = phjSkeletonCaseControlDF[phjSkeletonCaseControlColumnsList],
+                                                                    phjCasesDF = phjVerifiedCasesDF,
+                                                                    phjControlsDF = phjTempIncludedPatientsDF,
+                                                                    phjIDVarName = phjPatientIDVarName,
+                                                                    phjOutputColumnsList = phjOutputColumnsList,
+                                                                    phjLazyColumns = phjLazyColumns)
                 
                 
                     else:
@@ -727,11 +813,633 @@ def phjGenerateCaseControlDataset(phjAllDataDF,             # A dataframe contai
 
 
 
+# The following function produces a case-control dataset from consultation data that
+# are too large to hold in memory as a single dataframe (e.g. data stored as a series of
+# monthly Parquet files). The partitions are read twice. The first pass reads only the
+# columns needed to screen free text and to define strata (i.e. patient ID, consultation ID,
+# date, free text and matching variables) and keeps only counts of consultations for each
+# patient in each stratum. Controls are then sampled from these counts and the second pass
+# reads the full data but retains only the selected consultations (or the consultations of
+# the selected patients). Memory use is, therefore, proportional to the number of patients
+# and the size of the selected dataset rather than the size of the source data.
+def phjGenerateCaseControlDatasetFromPartitions(phjPartitionsList,         # A list of partitions (paths to Parquet files or dataframes) which together contain all the data
+                                                phjPatientIDVarName,
+                                                phjConsultationIDVarName,
+                                                phjConsultationDateVarName,
+                                                phjFreeTextVarName,
+                                                phjCasesDF,                # Consultation IDs (for consultation controls) or patient IDs (for patient controls) of cases; cases must be included in the partitions
+                                                phjMatchingVariablesList = None,
+                                                phjControlsPerCaseInt = 1,
+                                                phjScreeningRegexStr = None,
+                                                phjScreeningRegexPathAndFileName = None,
+                                                phjControlType = 'consultation',   # The only other option would be 'patient'
+                                                phjAggDict = None,
+                                                phjNumberOfWorkersInt = 1,
+                                                phjOutputColumnsList = None,
+                                                phjRandomSeedInt = None,
+                                                phjPrintResults = False):
+    
+    try:
+        phjAssert('phjPartitionsList',phjPartitionsList,(list,tuple))
+        assert len(phjPartitionsList) > 0, "Parameter 'phjPartitionsList' needs to contain at least one partition."
+        
+        for p in phjPartitionsList:
+            assert isinstance(p,(str,pd.DataFrame)), "Partitions need to be paths to Parquet files (string) or Pandas dataframes."
+        
+        phjAssert('phjPatientIDVarName',phjPatientIDVarName,str)
+        phjAssert('phjConsultationIDVarName',phjConsultationIDVarName,str)
+        phjAssert('phjConsultationDateVarName',phjConsultationDateVarName,str)
+        phjAssert('phjFreeTextVarName',phjFreeTextVarName,str)
+        phjAssert('phjCasesDF',phjCasesDF,(pd.DataFrame,pd.Series,list,tuple,np.ndarray))
+        
+        if phjMatchingVariablesList is not None:
+            phjAssert('phjMatchingVariablesList',phjMatchingVariablesList,(list,str))
+            
+            if isinstance(phjMatchingVariablesList,str):
+                phjMatchingVariablesList = [phjMatchingVariablesList]
+            
+            assert None not in phjMatchingVariablesList, "List of matching variables cannot contain None values."
+        
+        phjAssert('phjControlsPerCaseInt',phjControlsPerCaseInt,int,phjAllowedOptions = {'min':1})
+        
+        if phjScreeningRegexStr is not None:
+            phjAssert('phjScreeningRegexStr',phjScreeningRegexStr,str)
+        
+        if phjScreeningRegexPathAndFileName is not None:
+            phjAssert('phjScreeningRegexPathAndFileName',phjScreeningRegexPathAndFileName,str)
+        
+        phjAssert('phjControlType',phjControlType,str,phjAllowedOptions = ['consultation','patient'])
+        
+        if phjAggDict is not None:
+            phjAssert('phjAggDict',phjAggDict,collections.abc.Mapping)
+        
+        phjAssert('phjNumberOfWorkersInt',phjNumberOfWorkersInt,int,phjAllowedOptions = {'min':1})
+        
+        if phjOutputColumnsList is not None:
+            phjAssert('phjOutputColumnsList',phjOutputColumnsList,list)
+        
+        if phjRandomSeedInt is not None:
+            phjAssert('phjRandomSeedInt',phjRandomSeedInt,int)
+        
+        phjAssert('phjPrintResults',phjPrintResults,bool)
+        
+        # Get regex used to screen for original potential cases
+        phjScreeningRegex = phjGetRegexStr(phjRegexStr = phjScreeningRegexStr,
+                                           phjRegexPathAndFileName = phjScreeningRegexPathAndFileName,
+                                           phjPrintResults = phjPrintResults)
+        
+        assert phjScreeningRegex is not None, "Could not identify the screening regex."
+    
+    except AssertionError as e:
+        
+        # Define phjCaseControlDF as None before returning
+        phjCaseControlDF = None
+        
+        # If function has been called directly, present message.
+        if inspect.stack()[1][3] == '<module>':
+            print("An AssertionError occurred in {fname}() function. ({msg})\n".format(msg = e,
+                                                                                       fname = inspect.stack()[0][3]))
+        
+        # If function has been called by another function then modify message and re-raise exception
+        else:
+            print("An AssertionError occurred in {fname}() function when called by {callfname}() function. ({msg})\n".format(msg = e,
+                                                                                                                             fname = inspect.stack()[0][3],
+                                                                                                                             callfname = inspect.stack()[1][3]))
+            raise
+    
+    else:
+        
+        if phjMatchingVariablesList is None:
+            phjMatchingVariablesList = []
+        
+        if phjControlType == 'consultation':
+            phjUniqueIdentifierVarName = phjConsultationIDVarName
+        else:
+            phjUniqueIdentifierVarName = phjPatientIDVarName
+        
+        # Get an array of case IDs
+        if isinstance(phjCasesDF,pd.DataFrame):
+            phjCaseIDArr = pd.unique(phjCasesDF[phjUniqueIdentifierVarName].to_numpy())
+        else:
+            phjCaseIDArr = pd.unique(np.asarray(phjCasesDF))
+        
+        phjRNG = np.random.default_rng(phjRandomSeedInt)
+        
+        
+        #####################################################################
+        ### FIRST PASS                                                    ###
+        ### ==========                                                    ###
+        ### Identify cases, excluded patients and counts of consultations ###
+        ### for each patient in each stratum.                             ###
+        #####################################################################
+        phjPass1ColumnsList = list(collections.OrderedDict.fromkeys([phjPatientIDVarName,
+                                                                     phjConsultationIDVarName,
+                                                                     phjConsultationDateVarName,
+                                                                     phjFreeTextVarName] + phjMatchingVariablesList))
+        
+        phjExcludedPatientIDList = []
+        phjCaseRowsList = []
+        phjCountsList = []
+        
+        for i,phjPartition in enumerate(phjPartitionsList):
+            phjTempDF = phjReadPartition(phjPartition = phjPartition,
+                                         phjColumnsList = phjPass1ColumnsList)
+            
+            # Patients with any consultation that matches the screening regex cannot be controls
+            phjRegexMask = phjScreenFreeText(phjFreeTextSer = phjTempDF[phjFreeTextVarName],
+                                             phjRegexStr = phjScreeningRegex,
+                                             phjNumberOfWorkersInt = phjNumberOfWorkersInt,
+                                             phjPrintResults = False)
+            
+            phjExcludedPatientIDList.append(pd.unique(phjTempDF.loc[phjRegexMask,phjPatientIDVarName].to_numpy()))
+            
+            if phjControlType == 'consultation':
+                phjCaseRowsList.append(phjTempDF.loc[phjTempDF[phjConsultationIDVarName].isin(phjCaseIDArr),
+                                                     [phjConsultationIDVarName,phjPatientIDVarName] + phjMatchingVariablesList])
+                
+                # Number of consultations for each patient in each stratum in this partition
+                phjTempCountsDF = phjTempDF.groupby(phjMatchingVariablesList + [phjPatientIDVarName],
+                                                    sort = False,
+                                                    dropna = False).size().rename('count').reset_index(drop = False)
+            
+            else:
+                # For patient controls, the matching variables take the last recorded value
+                # for each patient (as in phjCollapseOnPatientID()). The last values in
+                # each partition are kept and the overall last value is found after the pass.
+                phjTempCountsDF = phjAggregateOnSortedID(phjDF = phjTempDF,
+                                                         phjIDVarName = phjPatientIDVarName,
+                                                         phjSortVarsList = [phjConsultationDateVarName],
+                                                         phjAggDict = collections.OrderedDict([(c,'last') for c in [phjConsultationDateVarName] + [m for m in phjMatchingVariablesList if m != phjPatientIDVarName]])).reset_index(drop = False)
+            
+            phjTempCountsDF['partition'] = i
+            phjCountsList.append(phjTempCountsDF)
+            
+            del phjTempDF
+        
+        phjCountsDF = pd.concat(phjCountsList,axis = 0,ignore_index = True)
+        phjExcludedPatientIDArr = pd.unique(np.concatenate(phjExcludedPatientIDList))
+        
+        
+        ##############################################################
+        ### SAMPLING                                               ###
+        ### ========                                               ###
+        ### Select controls from the counts of potential controls. ###
+        ##############################################################
+        if phjControlType == 'consultation':
+            phjCasesStrataDF = pd.concat(phjCaseRowsList,axis = 0,ignore_index = True).drop_duplicates(subset = [phjConsultationIDVarName])
+            
+            # Patients who are cases cannot be controls
+            phjExcludedPatientIDArr = pd.unique(np.concatenate([phjExcludedPatientIDArr,phjCasesStrataDF[phjPatientIDVarName].to_numpy()]))
+            
+            phjSelectedDF = phjSampleControlsFromCounts(phjCasesStrataDF = phjCasesStrataDF,
+                                                        phjCountsDF = phjCountsDF.loc[~phjCountsDF[phjPatientIDVarName].isin(phjExcludedPatientIDArr),:],
+                                                        phjUniqueIdentifierVarName = phjConsultationIDVarName,
+                                                        phjPatientIDVarName = phjPatientIDVarName,
+                                                        phjMatchingVariablesList = phjMatchingVariablesList,
+                                                        phjControlsPerCaseInt = phjControlsPerCaseInt,
+                                                        phjRNG = phjRNG)
+        
+        else:
+            # Find the last value of the matching variables for each patient across all partitions
+            phjPatientsDF = phjAggregateOnSortedID(phjDF = phjCountsDF,
+                                                   phjIDVarName = phjPatientIDVarName,
+                                                   phjSortVarsList = [phjConsultationDateVarName,'partition'],
+                                                   phjAggDict = collections.OrderedDict([(c,'last') for c in phjMatchingVariablesList if c != phjPatientIDVarName])).reset_index(drop = False)
+            
+            phjPatientsDF['count'] = 1
+            
+            phjCaseMask = phjPatientsDF[phjPatientIDVarName].isin(phjCaseIDArr)
+            
+            # Cases are kept in the order in which they were supplied
+            phjCasesStrataDF = pd.DataFrame({phjPatientIDVarName:phjCaseIDArr}).merge(phjPatientsDF.loc[phjCaseMask,[phjPatientIDVarName] + phjMatchingVariablesList],
+                                                                                      on = phjPatientIDVarName,
+                                                                                      how = 'inner')
+            
+            phjSelectedDF = phjSampleControlsFromCounts(phjCasesStrataDF = phjCasesStrataDF,
+                                                        phjCountsDF = phjPatientsDF.loc[~(phjCaseMask | phjPatientsDF[phjPatientIDVarName].isin(phjExcludedPatientIDArr)),:],
+                                                        phjUniqueIdentifierVarName = phjPatientIDVarName,
+                                                        phjPatientIDVarName = phjPatientIDVarName,
+                                                        phjMatchingVariablesList = phjMatchingVariablesList,
+                                                        phjControlsPerCaseInt = phjControlsPerCaseInt,
+                                                        phjRNG = phjRNG)
+        
+        if len(phjCaseIDArr) > len(phjCasesStrataDF.index):
+            print("\n{0} of the {1} cases were not found in the partitions and have been ignored.".format(len(phjCaseIDArr) - len(phjCasesStrataDF.index),len(phjCaseIDArr)))
+        
+        if phjPrintResults == True:
+            print("\nSelected cases and controls")
+            print(phjSelectedDF)
+        
+        
+        ###################################################################
+        ### SECOND PASS                                                 ###
+        ### ===========                                                 ###
+        ### Retrieve the full data for selected consultations/patients. ###
+        ###################################################################
+        if phjControlType == 'consultation':
+            
+            # Identify the partition in which each selected control consultation lies and
+            # the position of the consultation amongst the consultations for the same patient
+            # and stratum in that partition.
+            phjKeysList = phjMatchingVariablesList + [phjPatientIDVarName]
+            
+            phjControlsDF = phjSelectedDF.loc[phjSelectedDF['case'] == 0,phjKeysList + ['ordinal','group']]
+            
+            phjPartitionCountsDF = phjCountsDF.merge(phjControlsDF[phjKeysList].drop_duplicates(),
+                                                     on = phjKeysList,
+                                                     how = 'inner')
+            
+            phjPartitionCountsDF['start'] = phjPartitionCountsDF.groupby(phjKeysList,sort = False,dropna = False)['count'].cumsum() - phjPartitionCountsDF['count']
+            
+            phjControlsDF = phjControlsDF.merge(phjPartitionCountsDF,
+                                                on = phjKeysList,
+                                                how = 'inner')
+            
+            phjControlsDF = phjControlsDF.loc[(phjControlsDF['ordinal'] >= phjControlsDF['start']) & (phjControlsDF['ordinal'] < phjControlsDF['start'] + phjControlsDF['count']),:].copy()
+            phjControlsDF['ordinal'] = phjControlsDF['ordinal'] - phjControlsDF['start']
+            
+            phjSelectedRowsList = []
+            phjSelectedControlsList = []
+            
+            for i,phjPartition in enumerate(phjPartitionsList):
+                phjTempDF = phjReadPartition(phjPartition = phjPartition,
+                                             phjColumnsList = phjGetPartitionColumnsList(phjPass1ColumnsList,phjOutputColumnsList))
+                
+                phjSelectedRowsList.append(phjTempDF.loc[phjTempDF[phjConsultationIDVarName].isin(phjCasesStrataDF[phjConsultationIDVarName]),:])
+                
+                phjTempControlsDF = phjControlsDF.loc[phjControlsDF['partition'] == i,phjKeysList + ['ordinal','group']]
+                
+                if len(phjTempControlsDF.index) > 0:
+                    # The position of each consultation amongst consultations for the same
+                    # patient and stratum (in the same order as counted in the first pass)
+                    phjTempDF['ordinal'] = phjTempDF.groupby(phjKeysList,sort = False,dropna = False).cumcount()
+                    
+                    phjTempDF = phjTempDF.merge(phjTempControlsDF,
+                                                on = phjKeysList + ['ordinal'],
+                                                how = 'inner')
+                    
+                    phjSelectedControlsList.append(phjTempDF[[phjConsultationIDVarName,'group']])
+                    phjSelectedRowsList.append(phjTempDF.drop(['ordinal','group'],axis = 1))
+                
+                del phjTempDF
+            
+            phjSelectedRowsDF = pd.concat(phjSelectedRowsList,axis = 0,ignore_index = True).drop_duplicates(subset = [phjConsultationIDVarName])
+            
+            # Case consultation IDs are retrieved from the cases (rather than the selected
+            # dataframe which contains missing IDs for controls) to retain the original dtype
+            phjSkeletonCaseControlDF = phjCasesStrataDF[[phjConsultationIDVarName]].merge(phjSelectedDF.loc[phjSelectedDF['case'] == 1,[phjConsultationIDVarName,'group','case']],
+                                                                                          on = phjConsultationIDVarName,
+                                                                                          how = 'inner')
+            
+            if len(phjSelectedControlsList) > 0:
+                phjSkeletonCaseControlDF = pd.concat([phjSkeletonCaseControlDF,
+                                                      pd.concat(phjSelectedControlsList,axis = 0,ignore_index = True).assign(case = 0)],
+                                                     axis = 0,
+                                                     ignore_index = True,
+                                                     sort = False)
+        
+        else:
+            phjSkeletonCaseControlDF = phjSelectedDF[[phjPatientIDVarName,'group','case']]
+            
+            phjSelectedRowsList = []
+            
+            for i,phjPartition in enumerate(phjPartitionsList):
+                phjTempDF = phjReadPartition(phjPartition = phjPartition,
+                                             phjColumnsList = phjGetPartitionColumnsList(phjPass1ColumnsList,phjOutputColumnsList))
+                
+                phjSelectedRowsList.append(phjTempDF.loc[phjTempDF[phjPatientIDVarName].isin(phjSkeletonCaseControlDF[phjPatientIDVarName]),:])
+                
+                del phjTempDF
+            
+            # Collapse the consultations of the selected patients on patient ID
+            phjSelectedRowsDF = phjCollapseOnPatientID(phjAllDataDF = pd.concat(phjSelectedRowsList,axis = 0,ignore_index = True),
+                                                       phjPatientIDVarName = phjPatientIDVarName,
+                                                       phjConsultationIDVarName = phjConsultationIDVarName,
+                                                       phjConsultationDateVarName = phjConsultationDateVarName,
+                                                       phjFreeTextVarName = phjFreeTextVarName,
+                                                       phjAggDict = phjAggDict,
+                                                       phjPrintResults = phjPrintResults)
+        
+        # Unmatched datasets do not contain a 'group' column
+        if len(phjMatchingVariablesList) == 0:
+            phjSkeletonCaseControlDF = phjSkeletonCaseControlDF.drop('group',axis = 1)
+        
+        phjCaseControlDF = phjAssembleCaseControlDF(phjSkeletonDF = phjSkeletonCaseControlDF,
+                                                    phjCasesDF = phjSelectedRowsDF,
+                                                    phjControlsDF = phjSelectedRowsDF,
+                                                    phjIDVarName = phjUniqueIdentifierVarName,
+                                                    phjOutputColumnsList = phjOutputColumnsList)
+        
+        if phjPrintResults == True:
+            print("\nFull case-control dataframe")
+            print(phjCaseControlDF)
+    
+    return phjCaseControlDF
+
+
+
+def phjReadPartition(phjPartition,
+                     phjColumnsList = None):
+    
+    # Returns the data in a single partition. Partitions can be paths to Parquet files
+    # (in which case only the required columns are read from disk) or dataframes.
+    if isinstance(phjPartition,pd.DataFrame):
+        if phjColumnsList is None:
+            return phjPartition.copy()
+        else:
+            return phjPartition.loc[:,phjColumnsList]
+    
+    else:
+        return pd.read_parquet(phjPartition,
+                               columns = phjColumnsList)
+
+
+
+def phjGetPartitionColumnsList(phjRequiredColumnsList,
+                               phjOutputColumnsList = None):
+    
+    # Returns the list of columns to read from each partition in the second pass; if
+    # no output columns are defined, all columns are read.
+    if phjOutputColumnsList is None:
+        return None
+    
+    else:
+        return list(collections.OrderedDict.fromkeys(phjRequiredColumnsList + phjOutputColumnsList))
+
+
+
+def phjSampleControlsFromCounts(phjCasesStrataDF,
+                                phjCountsDF,
+                                phjUniqueIdentifierVarName,
+                                phjPatientIDVarName,
+                                phjMatchingVariablesList,
+                                phjControlsPerCaseInt = 1,
+                                phjRNG = None):
+    
+    # Selects controls at random (without replacement) from counts of potential controls
+    # for each patient in each stratum (defined by the matching variables). Each control
+    # is identified by the patient ID, the stratum and the position (ordinal) of the
+    # consultation amongst all consultations for that patient in that stratum; the actual
+    # consultation is retrieved in the second pass through the data. In matched datasets,
+    # the controls selected in each stratum are allocated to the cases in that stratum in
+    # the order in which cases were supplied and cases with no available controls are
+    # excluded (as in phjSelectMatchedCaseControlSubjects()).
+    if phjRNG is None:
+        phjRNG = np.random.default_rng()
+    
+    # Add the counts for each patient and stratum across partitions
+    phjTotalsDF = phjCountsDF.groupby(phjMatchingVariablesList + [phjPatientIDVarName],
+                                      sort = False,
+                                      dropna = False)['count'].sum().reset_index(drop = False)
+    
+    # Give each stratum an integer code that is the same for cases and controls
+    if len(phjMatchingVariablesList) > 0:
+        phjStrataCodesArr = pd.concat([phjCasesStrataDF[phjMatchingVariablesList],
+                                       phjTotalsDF[phjMatchingVariablesList]],
+                                      axis = 0,
+                                      ignore_index = True).groupby(phjMatchingVariablesList,
+                                                                   sort = False,
+                                                                   dropna = False).ngroup().to_numpy()
+    else:
+        phjStrataCodesArr = np.zeros(len(phjCasesStrataDF.index) + len(phjTotalsDF.index),dtype = np.int64)
+    
+    phjCaseCodesArr = phjStrataCodesArr[:len(phjCasesStrataDF.index)]
+    phjControlCodesArr = phjStrataCodesArr[len(phjCasesStrataDF.index):]
+    
+    # Sort potential controls by stratum so that each stratum is a contiguous slice
+    phjOrderArr = np.argsort(phjControlCodesArr,kind = 'mergesort')
+    phjSortedCodesArr = phjControlCodesArr[phjOrderArr]
+    phjSortedCountsArr = phjTotalsDF['count'].to_numpy()[phjOrderArr]
+    
+    phjCaseGroupArr = np.full(len(phjCasesStrataDF.index),-1,dtype = np.int64)
+    phjControlRowsList = []
+    phjControlOrdinalsList = []
+    phjControlCasesList = []
+    
+    for phjCode in pd.unique(phjCaseCodesArr):
+        phjCasePosArr = np.flatnonzero(phjCaseCodesArr == phjCode)
+        
+        phjStartInt = np.searchsorted(phjSortedCodesArr,phjCode,side = 'left')
+        phjEndInt = np.searchsorted(phjSortedCodesArr,phjCode,side = 'right')
+        
+        phjCumCountsArr = np.cumsum(phjSortedCountsArr[phjStartInt:phjEndInt])
+        phjTotalInt = int(phjCumCountsArr[-1]) if len(phjCumCountsArr) > 0 else 0
+        
+        phjTakeInt = min(phjControlsPerCaseInt * len(phjCasePosArr),phjTotalInt)
+        
+        if phjTakeInt > 0:
+            # Position of each selected control amongst all potential controls in stratum
+            phjPosArr = phjRNG.choice(phjTotalInt,size = phjTakeInt,replace = False)
+            
+            phjIdxArr = np.searchsorted(phjCumCountsArr,phjPosArr,side = 'right')
+            
+            phjControlRowsList.append(phjOrderArr[phjStartInt + phjIdxArr])
+            phjControlOrdinalsList.append(phjPosArr - (phjCumCountsArr[phjIdxArr] - phjSortedCountsArr[phjStartInt + phjIdxArr]))
+            phjControlCasesList.append(phjCasePosArr[np.arange(phjTakeInt) // phjControlsPerCaseInt])
+    
+    if len(phjControlRowsList) > 0:
+        phjControlRowsArr = np.concatenate(phjControlRowsList)
+        phjControlOrdinalsArr = np.concatenate(phjControlOrdinalsList)
+        phjControlCasesArr = np.concatenate(phjControlCasesList)
+    else:
+        phjControlRowsArr = np.array([],dtype = np.int64)
+        phjControlOrdinalsArr = np.array([],dtype = np.int64)
+        phjControlCasesArr = np.array([],dtype = np.int64)
+    
+    if len(phjMatchingVariablesList) > 0:
+        # Only cases with at least one control are retained; groups are numbered in the
+        # order in which cases were supplied
+        phjRetainedCasesArr = np.unique(phjControlCasesArr)
+        phjCaseGroupArr[phjRetainedCasesArr] = np.arange(len(phjRetainedCasesArr))
+    else:
+        phjRetainedCasesArr = np.arange(len(phjCasesStrataDF.index))
+    
+    phjCasesOutDF = phjCasesStrataDF.iloc[phjRetainedCasesArr,:].copy()
+    phjCasesOutDF['group'] = phjCaseGroupArr[phjRetainedCasesArr]
+    phjCasesOutDF['case'] = 1
+    
+    phjControlsOutDF = phjTotalsDF.iloc[phjControlRowsArr,:].drop('count',axis = 1).copy()
+    phjControlsOutDF['ordinal'] = phjControlOrdinalsArr
+    phjControlsOutDF['group'] = phjCaseGroupArr[phjControlCasesArr]
+    phjControlsOutDF['case'] = 0
+    
+    if phjUniqueIdentifierVarName == phjPatientIDVarName:
+        phjControlsOutDF[phjUniqueIdentifierVarName] = phjControlsOutDF[phjPatientIDVarName]
+    
+    phjSelectedDF = pd.concat([phjCasesOutDF,phjControlsOutDF],
+                              axis = 0,
+                              ignore_index = True,
+                              sort = False)
+    
+    return phjSelectedDF
+
+
+
+def phjGetRequiredColumnsDF(phjDF,
+                            phjIDVarName,
+                            phjOutputColumnsList = None):
+    
+    # Returns the dataframe containing only the ID variable and the requested columns
+    # (in the order in which they appear in the dataframe). This is used to avoid copying
+    # unwanted columns when merging with the skeleton case-control dataframe. If no list
+    # of columns is given, the original dataframe is returned.
+    if phjOutputColumnsList is None:
+        return phjDF
+    
+    else:
+        return phjDF[[c for c in phjDF.columns.values.tolist() if (c == phjIDVarName) or (c in phjOutputColumnsList)]]
+
+
+
+def phjMergeCaseControlDF(phjSkeletonDF,
+                          phjDataDF,
+                          phjIDVarName,
+                          phjOutputColumnsList = None,
+                          phjLazyColumns = False):
+    
+    # Adds the full set of variables to the skeleton case-control dataframe when both
+    # cases and controls are retrieved from the same dataframe.
+    if phjLazyColumns == True:
+        return phjGetLazyCaseControlDF(phjSkeletonDF = phjSkeletonDF,
+                                       phjCasesDF = phjDataDF,
+                                       phjControlsDF = phjDataDF,
+                                       phjIDVarName = phjIDVarName)
+    
+    return phjSkeletonDF.merge(phjGetRequiredColumnsDF(phjDF = phjDataDF,
+                                                       phjIDVarName = phjIDVarName,
+                                                       phjOutputColumnsList = phjOutputColumnsList),
+                               on = phjIDVarName,
+                               how = 'left')
+
+
+
+def phjAssembleCaseControlDF(phjSkeletonDF,
+                             phjCasesDF,
+                             phjControlsDF,
+                             phjIDVarName,
+                             phjOutputColumnsList = None,
+                             phjLazyColumns = False):
+    
+    # Adds the full set of variables to the skeleton case-control dataframe (containing
+    # ID, 'case' and, possibly, 'group' columns) when the cases and controls need to be
+    # retrieved from different dataframes. Case rows are merged with the cases dataframe
+    # and control rows with the controls dataframe; the two resulting dataframes are
+    # concatenated and sorted so that each case is followed by its matched controls.
+    if phjLazyColumns == True:
+        return phjGetLazyCaseControlDF(phjSkeletonDF = phjSkeletonDF,
+                                       phjCasesDF = phjCasesDF,
+                                       phjControlsDF = phjControlsDF,
+                                       phjIDVarName = phjIDVarName)
+    
+    phjCaseMask = phjSkeletonDF['case'] == 1
+    
+    phjCaseRowsDF = phjSkeletonDF.loc[phjCaseMask,:].merge(phjGetRequiredColumnsDF(phjDF = phjCasesDF,
+                                                                                   phjIDVarName = phjIDVarName,
+                                                                                   phjOutputColumnsList = phjOutputColumnsList),
+                                                           on = phjIDVarName,
+                                                           how = 'left')
+    
+    phjControlRowsDF = phjSkeletonDF.loc[~phjCaseMask,:].merge(phjGetRequiredColumnsDF(phjDF = phjControlsDF,
+                                                                                       phjIDVarName = phjIDVarName,
+                                                                                       phjOutputColumnsList = phjOutputColumnsList),
+                                                               on = phjIDVarName,
+                                                               how = 'left')
+    
+    phjCaseControlDF = pd.concat([phjCaseRowsDF,phjControlRowsDF],
+                                 axis = 0,
+                                 ignore_index = True,
+                                 sort = False)
+    
+    # Stable sort so that the order of rows within each group is retained
+    if 'group' in phjCaseControlDF.columns.values:
+        phjCaseControlDF = phjCaseControlDF.sort_values(['group','case'],
+                                                        ascending = [True,False],
+                                                        kind = 'mergesort').reset_index(drop = True)
+    else:
+        phjCaseControlDF = phjCaseControlDF.sort_values('case',
+                                                        ascending = False,
+                                                        kind = 'mergesort').reset_index(drop = True)
+    
+    return phjCaseControlDF
+
+
+
+def phjGetLazyCaseControlDF(phjSkeletonDF,
+                            phjCasesDF,
+                            phjControlsDF,
+                            phjIDVarName):
+    
+    # Returns a tuple containing the skeleton case-control dataframe (ID, 'case' and,
+    # possibly, 'group' columns) and a function that can be used to retrieve other
+    # columns when required, for example:
+    #
+    #     phjSkeletonDF, phjGetColumns = phjGenerateCaseControlDataset(..., phjLazyColumns = True)
+    #     phjCaseControlDF = phjGetColumns(['age','sex'])
+    #
+    # The row positions of each case and control in the cases and controls dataframes are
+    # found once and the requested columns are then retrieved by position. This avoids
+    # copying all the columns of a wide dataframe into the case-control dataframe.
+    phjSkeletonDF = phjSkeletonDF.reset_index(drop = True)
+    
+    phjCaseMaskArr = (phjSkeletonDF['case'] == 1).to_numpy()
+    
+    phjPositionsArr = np.full(len(phjSkeletonDF.index),-1,dtype = np.int64)
+    phjPositionsArr[phjCaseMaskArr] = pd.Index(phjCasesDF[phjIDVarName]).get_indexer(phjSkeletonDF.loc[phjCaseMaskArr,phjIDVarName])
+    phjPositionsArr[~phjCaseMaskArr] = pd.Index(phjControlsDF[phjIDVarName]).get_indexer(phjSkeletonDF.loc[~phjCaseMaskArr,phjIDVarName])
+    
+    phjGetColumns = functools.partial(phjTakeCaseControlColumns,
+                                      phjSkeletonDF = phjSkeletonDF,
+                                      phjCasesDF = phjCasesDF,
+                                      phjControlsDF = phjControlsDF,
+                                      phjIDVarName = phjIDVarName,
+                                      phjPositionsArr = phjPositionsArr,
+                                      phjCaseMaskArr = phjCaseMaskArr)
+    
+    return phjSkeletonDF, phjGetColumns
+
+
+
+def phjTakeCaseControlColumns(phjColumnsList,
+                              phjSkeletonDF,
+                              phjCasesDF,
+                              phjControlsDF,
+                              phjIDVarName,
+                              phjPositionsArr,
+                              phjCaseMaskArr):
+    
+    # Returns the skeleton case-control dataframe with the requested columns added. Values
+    # for cases are taken from the cases dataframe and values for controls are taken from
+    # the controls dataframe using the row positions calculated in phjGetLazyCaseControlDF().
+    # Rows that could not be found in the dataframes will contain missing values.
+    if isinstance(phjColumnsList,str):
+        phjColumnsList = [phjColumnsList]
+    
+    phjColumnsList = [c for c in phjColumnsList if c not in phjSkeletonDF.columns.values.tolist()]
+    
+    phjTempList = []
+    
+    for phjSourceDF, phjMaskArr in [(phjCasesDF,phjCaseMaskArr),(phjControlsDF,~phjCaseMaskArr)]:
+        phjRowsArr = np.flatnonzero(phjMaskArr & (phjPositionsArr >= 0))
+        
+        phjTempDF = phjSourceDF[phjColumnsList].take(phjPositionsArr[phjRowsArr])
+        phjTempDF.index = phjRowsArr
+        
+        phjTempList.append(phjTempDF)
+    
+    phjTempDF = pd.concat(phjTempList,axis = 0).reindex(np.arange(len(phjSkeletonDF.index)))
+    
+    return pd.concat([phjSkeletonDF,phjTempDF],axis = 1)
+
+
+
 def phjSelectCaseControlDataset(phjCasesDF,
                                 phjPotentialControlsDF,
                                 phjUniqueIdentifierVarName,
                                 phjMatchingVariablesList = None,
                                 phjControlsPerCaseInt = 1,
+                                phjMatchingType = 'individual',   # 'individual' (each case matched with controls) or 'frequency' (controls selected to match distribution of cases across strata)
+                                phjAllocationMethod = 'greedy',   # 'greedy' (each case in turn) or 'optimal' (allocation calculated for each stratum)
+                                phjRNG = None,                    # np.random.Generator used to select controls with 'frequency' matching or the 'optimal' method
                                 phjPrintResults = False):
     
     try:
@@ -769,6 +1477,9 @@ def phjSelectCaseControlDataset(phjCasesDF,
             
         
         phjAssert('phjControlsPerCaseInt',phjControlsPerCaseInt,int)
+        
+        phjAssert('phjMatchingType',phjMatchingType,str,phjAllowedOptions = ['individual','frequency'])
+        phjAssert('phjAllocationMethod',phjAllocationMethod,str,phjAllowedOptions = ['greedy','optimal'])
     
     
         # Check that phjUniqueIdentifierVarName columns in both case and controls dataframe
@@ -836,6 +1547,16 @@ def phjSelectCaseControlDataset(phjCasesDF,
                                                                          phjControlsPerCaseInt = phjControlsPerCaseInt,
                                                                          phjPrintResults = phjPrintResults)
         
+        elif phjMatchingType == 'frequency':
+            # Select FREQUENCY MATCHED controls
+            phjTempCaseControlDF = phjSelectFrequencyMatchedCaseControlSubjects(phjCasesDF = phjCasesDF,
+                                                                                phjPotentialControlsDF = phjPotentialControlsDF,
+                                                                                phjUniqueIdentifierVarName = phjUniqueIdentifierVarName,
+                                                                                phjMatchingVariablesList = phjMatchingVariablesList,
+                                                                                phjControlsPerCaseInt = phjControlsPerCaseInt,
+                                                                                phjRNG = phjRNG,
+                                                                                phjPrintResults = phjPrintResults)
+        
         else:
             # Select MATCHED controls
             phjTempCaseControlDF = phjSelectMatchedCaseControlSubjects(phjCasesDF = phjCasesDF,
@@ -843,18 +1564,158 @@ def phjSelectCaseControlDataset(phjCasesDF,
                                                                        phjUniqueIdentifierVarName = phjUniqueIdentifierVarName,
                                                                        phjMatchingVariablesList = phjMatchingVariablesList,
                                                                        phjControlsPerCaseInt = phjControlsPerCaseInt,
+                                                                       phjAllocationMethod = phjAllocationMethod,
+                                                                       phjRNG = phjRNG,
                                                                        phjPrintResults = phjPrintResults)
     
     return phjTempCaseControlDF
 
 
 
+def phjSelectReplicateCaseControlSubjects(phjCasesDF,
+                                          phjPotentialControlsDF,
+                                          phjUniqueIdentifierVarName,
+                                          phjMatchingVariablesList = None,
+                                          phjControlsPerCaseInt = 1,
+                                          phjNumReplicates = 1,
+                                          phjRandomSeedInt = None,
+                                          phjPrintResults = False):
+    
+    # Draws phjNumReplicates independent selections of controls for the same cases and
+    # returns them in long format with a 'replicate' column. Cases and potential controls
+    # are divided into strata (based on the matching variables) once and, within each
+    # stratum, the controls for all replicates are selected together by sorting a matrix
+    # of random numbers (one row per replicate) and taking the first required columns in
+    # each row; this is a random sample without replacement for each replicate. As in
+    # phjSelectMatchedCaseControlSubjects(), controls are allocated to cases in the order
+    # in which cases are listed and cases with no available controls are excluded. In
+    # unmatched datasets, all cases are retained and no 'group' column is returned.
+    if phjMatchingVariablesList is None:
+        phjMatchingVariablesList = []
+    
+    elif isinstance(phjMatchingVariablesList,str):
+        phjMatchingVariablesList = [phjMatchingVariablesList]
+    
+    phjRNG = np.random.default_rng(phjRandomSeedInt)
+    
+    phjNCasesInt = len(phjCasesDF.index)
+    
+    # Give each stratum an integer code that is the same for cases and controls
+    if len(phjMatchingVariablesList) > 0:
+        phjStrataCodesArr = pd.concat([phjCasesDF[phjMatchingVariablesList],
+                                       phjPotentialControlsDF[phjMatchingVariablesList]],
+                                      axis = 0,
+                                      ignore_index = True).groupby(phjMatchingVariablesList,
+                                                                   sort = False,
+                                                                   dropna = False).ngroup().to_numpy()
+    else:
+        phjStrataCodesArr = np.zeros(phjNCasesInt + len(phjPotentialControlsDF.index),dtype = np.int64)
+    
+    phjCaseCodesArr = phjStrataCodesArr[:phjNCasesInt]
+    phjControlCodesArr = phjStrataCodesArr[phjNCasesInt:]
+    
+    phjOrderArr = np.argsort(phjControlCodesArr,kind = 'mergesort')
+    phjSortedCodesArr = phjControlCodesArr[phjOrderArr]
+    
+    phjCaseGroupArr = np.full(phjNCasesInt,-1,dtype = np.int64)
+    phjReplicatesList = []
+    phjControlRowsList = []
+    phjControlCasesList = []
+    
+    # Limit the size of the matrix of random numbers by processing replicates in blocks
+    phjMaxElementsInt = 10000000
+    
+    for phjCode in pd.unique(phjCaseCodesArr):
+        phjCasePosArr = np.flatnonzero(phjCaseCodesArr == phjCode)
+        
+        phjStartInt = np.searchsorted(phjSortedCodesArr,phjCode,side = 'left')
+        phjEndInt = np.searchsorted(phjSortedCodesArr,phjCode,side = 'right')
+        phjAvailableInt = phjEndInt - phjStartInt
+        
+        phjTakeInt = min(phjControlsPerCaseInt * len(phjCasePosArr),phjAvailableInt)
+        
+        if phjTakeInt == 0:
+            continue
+        
+        phjBlockInt = max(1,phjMaxElementsInt // phjAvailableInt)
+        
+        for phjFirstRepInt in range(0,phjNumReplicates,phjBlockInt):
+            phjNRepsInt = min(phjBlockInt,phjNumReplicates - phjFirstRepInt)
+            
+            phjRandomArr = phjRNG.random((phjNRepsInt,phjAvailableInt))
+            
+            if phjTakeInt < phjAvailableInt:
+                # The selected controls are returned by argpartition() in partition order
+                # (not random order) and are, therefore, sorted by their random values
+                # before being paired with cases.
+                phjSelectedArr = np.argpartition(phjRandomArr,phjTakeInt - 1,axis = 1)[:,:phjTakeInt]
+                phjSelectedArr = np.take_along_axis(phjSelectedArr,
+                                                    np.argsort(np.take_along_axis(phjRandomArr,phjSelectedArr,axis = 1),axis = 1),
+                                                    axis = 1)
+            else:
+                phjSelectedArr = np.argsort(phjRandomArr,axis = 1)
+            
+            phjReplicatesList.append(np.repeat(np.arange(phjFirstRepInt,phjFirstRepInt + phjNRepsInt),phjTakeInt))
+            phjControlRowsList.append(phjOrderArr[phjStartInt + phjSelectedArr.ravel()])
+            phjControlCasesList.append(np.tile(phjCasePosArr[np.arange(phjTakeInt) // phjControlsPerCaseInt],phjNRepsInt))
+    
+    if len(phjControlRowsList) > 0:
+        phjReplicatesArr = np.concatenate(phjReplicatesList)
+        phjControlRowsArr = np.concatenate(phjControlRowsList)
+        phjControlCasesArr = np.concatenate(phjControlCasesList)
+    else:
+        phjReplicatesArr = np.array([],dtype = np.int64)
+        phjControlRowsArr = np.array([],dtype = np.int64)
+        phjControlCasesArr = np.array([],dtype = np.int64)
+    
+    if len(phjMatchingVariablesList) > 0:
+        # Cases retained are the same in every replicate; groups are numbered in the
+        # order in which cases are listed
+        phjRetainedCasesArr = np.unique(phjControlCasesArr)
+        phjCaseGroupArr[phjRetainedCasesArr] = np.arange(len(phjRetainedCasesArr))
+    else:
+        phjRetainedCasesArr = np.arange(phjNCasesInt)
+    
+    phjCasesIDArr = phjCasesDF[phjUniqueIdentifierVarName].to_numpy()[phjRetainedCasesArr]
+    
+    phjCasesOutDF = pd.DataFrame({'replicate':np.repeat(np.arange(phjNumReplicates),len(phjRetainedCasesArr)),
+                                  phjUniqueIdentifierVarName:np.tile(phjCasesIDArr,phjNumReplicates),
+                                  'group':np.tile(phjCaseGroupArr[phjRetainedCasesArr],phjNumReplicates),
+                                  'case':1})
+    
+    phjControlsOutDF = pd.DataFrame({'replicate':phjReplicatesArr,
+                                     phjUniqueIdentifierVarName:phjPotentialControlsDF[phjUniqueIdentifierVarName].to_numpy()[phjControlRowsArr],
+                                     'group':phjCaseGroupArr[phjControlCasesArr],
+                                     'case':0})
+    
+    phjTempCaseControlDF = pd.concat([phjCasesOutDF,phjControlsOutDF],
+                                     axis = 0,
+                                     ignore_index = True)
+    
+    if len(phjMatchingVariablesList) > 0:
+        phjTempCaseControlDF = phjTempCaseControlDF.sort_values(['replicate','group','case'],
+                                                                ascending = [True,True,False],
+                                                                kind = 'mergesort').reset_index(drop = True)
+    else:
+        phjTempCaseControlDF = phjTempCaseControlDF.drop('group',axis = 1).sort_values(['replicate','case'],
+                                                                                       ascending = [True,False],
+                                                                                       kind = 'mergesort').reset_index(drop = True)
+    
+    if phjPrintResults == True:
+        print("\nReplicate case-control selections")
+        print(phjTempCaseControlDF)
+    
+    return phjTempCaseControlDF
+
+
+
 def phjCollapseOnPatientID(phjAllDataDF,       # Dataframe containing all columns of data to be collapsed based on patient ID
                            phjPatientIDVarName,
                            phjConsultationIDVarName = None,
                            phjConsultationDateVarName = None,
                            phjFreeTextVarName = None,
                            phjAggDict = None,
+                           phjCategoricalPatientID = False,
                            phjPrintResults = False):
     
     
@@ -891,7 +1752,8 @@ def phjCollapseOnPatientID(phjAllDataDF,       # Dataframe containing all column
         
         if phjAggDict is not None:
             assert isinstance(phjAggDict,dict), "Parameter phjAggDict needs to be a dictionary."
-            
+        
+        assert isinstance(phjCategoricalPatientID,bool), "Parameter 'phjCategoricalPatientID' needs to be a boolean (True, False) value."
         assert isinstance(phjPrintResults,bool), "Parameter 'phjPrintResults' needs to be a boolean (True, False) value."
         
         # 2. Check whether entered parameters have been set to an appropriate value
@@ -942,45 +1804,32 @@ def phjCollapseOnPatientID(phjAllDataDF,       # Dataframe containing all column
                                            phjDateVarName = phjConsultationDateVarName,   # This can be a string or a list of variable names
                                            phjDateFormat = '%Y-%m-%d',
                                            phjMissingValue = 'missing',
-                                           phjPrintResults = phjPrintResults)
-        
-        # Construct a dict for aggregating variables.
-        # The consultation variable will be counted and the free text field will be concatenated.
-        # Everything else will be concatenated by taking the last in the list unless otherwise defined
-        # in the phjAggDict argument (in which case, the user-defined options will replace these
-        # values). If the consultation date variable is defined, two columns will be produced,
-        # one for the first consultation, one for the last.
-        phjColList = phjAllDataDF.columns.values.tolist()
-        phjColList = [c for c in phjColList if c != phjPatientIDVarName]
-        
-        
-        # Initially create an ordered dict where each variable reports the 'last' entry
-        phjCollapseAggDict = collections.OrderedDict((c,'last') for c in phjColList)   # This creates an ordered dict using a list comprehension-type syntax
-        
-        
-        # Modify the dict so some of the important variables will be collapsed using different
-        # methods (e.g. count, first and last dates and concatenating text)
-        phjCollapseAggDict[phjConsultationIDVarName] = 'count'
-        
-        if phjConsultationDateVarName is not None:
-            phjCollapseAggDict[phjConsultationDateVarName] = ['first','last']
-        
-        if phjFreeTextVarName is not None:
-            phjCollapseAggDict[phjFreeTextVarName] = lambda x: ' /// '.join(x.fillna('EMPTY FIELD'))
+                                           phjPrintResults = phjPrintResults)
         
-        # Update phjCollapseAggDict with the phjAggDict items supplied by user. The values in
-        # phjAggDict will replace those in phjCollapseAggDict.
-        # Then remove any column names in phjCollapseAggDict that doesn't exist in dataframe.
-        if phjAggDict is not None:
-            phjCollapseAggDict.update(phjAggDict)
-            phjCollapseAggDict = collections.OrderedDict((k,v) for k,v in phjCollapseAggDict.items() if k in phjAllDataDF.columns.values.tolist())
+        # Construct a dict for aggregating variables.
+        phjCollapseAggDict = phjGetCollapseAggDict(phjColumnsList = phjAllDataDF.columns.values.tolist(),
+                                                   phjPatientIDVarName = phjPatientIDVarName,
+                                                   phjConsultationIDVarName = phjConsultationIDVarName,
+                                                   phjConsultationDateVarName = phjConsultationDateVarName,
+                                                   phjFreeTextVarName = phjFreeTextVarName,
+                                                   phjAggDict = phjAggDict)
         
         
-        # Sort data based on patient ID and date of consultation and groupby patient ID.
+        # Sort data based on patient ID and date of consultation and collapse on patient ID.
         # Variables are aggregated based on definitions in the phjCollapseAggDict.
-        phjGroupedDF = phjAllDataDF.sort_values([phjPatientIDVarName,phjConsultationDateVarName],
-                                                axis = 0,
-                                                ascending = True).groupby(phjPatientIDVarName).agg(phjCollapseAggDict)
+        # (N.B. This used to be done using df.groupby().agg(phjCollapseAggDict) but the
+        #       lambda function used to concatenate free text forced Pandas to use a slow
+        #       Python path for every patient. The data are now sorted once and the first,
+        #       last and count values are taken using arrays of group boundaries; the
+        #       resulting dataframe is the same as that produced by groupby().agg().)
+        if phjCategoricalPatientID == True:
+            phjAllDataDF = phjAllDataDF.copy()
+            phjAllDataDF[phjPatientIDVarName] = phjAllDataDF[phjPatientIDVarName].astype('category')
+        
+        phjGroupedDF = phjAggregateOnSortedID(phjDF = phjAllDataDF,
+                                              phjIDVarName = phjPatientIDVarName,
+                                              phjSortVarsList = [c for c in [phjConsultationDateVarName] if c is not None],
+                                              phjAggDict = phjCollapseAggDict)
         
         # Set phjMultiIndex to True or False
         phjMultiIndex = phjGroupedDF.columns.nlevels > 1
@@ -1018,6 +1867,192 @@ def phjCollapseOnPatientID(phjAllDataDF,       # Dataframe containing all column
 
 
 
+def phjGetCollapseAggDict(phjColumnsList,
+                          phjPatientIDVarName,
+                          phjConsultationIDVarName = None,
+                          phjConsultationDateVarName = None,
+                          phjFreeTextVarName = None,
+                          phjAggDict = None):
+    
+    # Construct a dict for aggregating variables.
+    # The consultation variable will be counted and the free text field will be concatenated.
+    # Everything else will be concatenated by taking the last in the list unless otherwise defined
+    # in the phjAggDict argument (in which case, the user-defined options will replace these
+    # values). If the consultation date variable is defined, two columns will be produced,
+    # one for the first consultation, one for the last.
+    phjColList = [c for c in phjColumnsList if c != phjPatientIDVarName]
+    
+    
+    # Initially create an ordered dict where each variable reports the 'last' entry
+    phjCollapseAggDict = collections.OrderedDict((c,'last') for c in phjColList)   # This creates an ordered dict using a list comprehension-type syntax
+    
+    
+    # Modify the dict so some of the important variables will be collapsed using different
+    # methods (e.g. count, first and last dates and concatenating text)
+    if phjConsultationIDVarName is not None:
+        phjCollapseAggDict[phjConsultationIDVarName] = 'count'
+    
+    if phjConsultationDateVarName is not None:
+        phjCollapseAggDict[phjConsultationDateVarName] = ['first','last']
+    
+    if phjFreeTextVarName is not None:
+        phjCollapseAggDict[phjFreeTextVarName] = phjJoinFreeText
+    
+    # Update phjCollapseAggDict with the phjAggDict items supplied by user. The values in
+    # phjAggDict will replace those in phjCollapseAggDict.
+    # Then remove any column names in phjCollapseAggDict that doesn't exist in dataframe.
+    if phjAggDict is not None:
+        phjCollapseAggDict.update(phjAggDict)
+    
+    phjCollapseAggDict = collections.OrderedDict((k,v) for k,v in phjCollapseAggDict.items() if k in phjColumnsList)
+    
+    return phjCollapseAggDict
+
+
+
+def phjGetAggFuncName(phjFunc):
+    # Returns the name that Pandas gives to the column produced by an aggregation
+    # function when a list of functions is used (e.g. 'last', 'sum' or '<lambda>').
+    if isinstance(phjFunc,str):
+        return phjFunc
+    else:
+        return getattr(phjFunc,'__name__','<lambda>')
+
+
+
+def phjJoinFreeText(x):
+    # Default aggregation function for free text when collapsing on patient ID. Entries
+    # are concatenated (separated by ' /// ') with missing values shown as 'EMPTY FIELD'.
+    # The phjAggregateOnSortedID() function recognises this function and concatenates
+    # the text for all groups in a single pass rather than calling it for each group.
+    return ' /// '.join(x.fillna('EMPTY FIELD'))
+
+
+
+def phjAggregateOnSortedID(phjDF,
+                           phjIDVarName,
+                           phjSortVarsList = None,
+                           phjAggDict = None):
+    
+    # Returns the same dataframe as:
+    #     phjDF.sort_values([phjIDVarName] + phjSortVarsList).groupby(phjIDVarName).agg(phjAggDict)
+    # The dataframe is sorted once and the boundaries of each group (i.e. the position of
+    # the first and last row for each ID) are identified. The 'first', 'last' and 'count'
+    # aggregations (which ignore missing values, as in Pandas) are then calculated for all
+    # groups at once using numpy reduceat() functions on arrays of row positions, and the
+    # free text (phjJoinFreeText) is concatenated by joining all the text in one string and
+    # slicing at the group boundaries. Any other aggregation function is passed to the
+    # usual Pandas groupby().agg() method for that column only.
+    if phjSortVarsList is None:
+        phjSortVarsList = []
+    
+    # Rows with missing IDs are excluded by groupby() and are therefore removed here too.
+    # A stable sort is used so that the order of rows with the same ID and date is retained.
+    phjSortedDF = phjDF.loc[phjDF[phjIDVarName].notna(),:].sort_values([phjIDVarName] + phjSortVarsList,
+                                                                       axis = 0,
+                                                                       ascending = True,
+                                                                       kind = 'mergesort')
+    
+    phjNRowsInt = len(phjSortedDF.index)
+    
+    if isinstance(phjSortedDF[phjIDVarName].dtype,pd.CategoricalDtype):
+        phjIDCodesArr = phjSortedDF[phjIDVarName].cat.codes.to_numpy()
+    else:
+        phjIDCodesArr = phjSortedDF[phjIDVarName].to_numpy()
+    
+    # Position of first row of each group and the position after the last row of each group
+    if phjNRowsInt > 0:
+        phjStartsArr = np.flatnonzero(np.concatenate([[True],phjIDCodesArr[1:] != phjIDCodesArr[:-1]]))
+    else:
+        phjStartsArr = np.array([],dtype = np.int64)
+    
+    phjEndsArr = np.append(phjStartsArr[1:],phjNRowsInt)
+    phjPositionsArr = np.arange(phjNRowsInt)
+    
+    phjGroupIndex = pd.Index(phjSortedDF[phjIDVarName].iloc[phjStartsArr].to_numpy(),
+                             name = phjIDVarName)
+    
+    if isinstance(phjSortedDF[phjIDVarName].dtype,pd.CategoricalDtype):
+        phjGroupIndex = pd.CategoricalIndex(phjGroupIndex,
+                                            categories = phjSortedDF[phjIDVarName].cat.categories,
+                                            name = phjIDVarName)
+    
+    # If any of the aggregation functions is a list then Pandas would return a column
+    # multi-index (with the function names as the second level)
+    phjMultiIndex = any(isinstance(v,(list,tuple)) for v in phjAggDict.values())
+    
+    phjGroupby = None
+    phjColumnsList = []
+    phjValuesList = []
+    
+    for phjVarName, phjFuncs in phjAggDict.items():
+        
+        if not isinstance(phjFuncs,(list,tuple)):
+            phjFuncs = [phjFuncs]
+        
+        phjSer = phjSortedDF[phjVarName]
+        
+        for phjFunc in phjFuncs:
+            
+            if (phjNRowsInt > 0) and (isinstance(phjFunc,str)) and (phjFunc in ['first','last','count']):
+                phjNotNullArr = phjSer.notna().to_numpy()
+                
+                if phjFunc == 'count':
+                    phjAggSer = pd.Series(np.add.reduceat(phjNotNullArr.astype(np.int64),phjStartsArr),
+                                          index = phjGroupIndex)
+                
+                else:
+                    if phjFunc == 'first':
+                        phjTakeArr = np.minimum.reduceat(np.where(phjNotNullArr,phjPositionsArr,phjNRowsInt),phjStartsArr)
+                        phjValidArr = phjTakeArr < phjEndsArr
+                    else:
+                        phjTakeArr = np.maximum.reduceat(np.where(phjNotNullArr,phjPositionsArr,-1),phjStartsArr)
+                        phjValidArr = phjTakeArr >= phjStartsArr
+                    
+                    phjAggSer = phjSer.take(np.where(phjValidArr,phjTakeArr,phjStartsArr))
+                    phjAggSer.index = phjGroupIndex
+                    
+                    if not phjValidArr.all():
+                        phjAggSer = phjAggSer.where(phjValidArr)
+            
+            elif (phjNRowsInt > 0) and (phjFunc is phjJoinFreeText):
+                # Join all text into a single string and slice at the group boundaries
+                phjTextList = phjSer.fillna('EMPTY FIELD').astype(str).tolist()
+                phjSepStr = ' /// '
+                
+                phjLengthsArr = np.array([len(t) for t in phjTextList],dtype = np.int64) + len(phjSepStr)
+                phjOffsetsArr = np.concatenate([[0],np.cumsum(phjLengthsArr)])
+                phjAllTextStr = phjSepStr.join(phjTextList)
+                
+                phjAggSer = pd.Series([phjAllTextStr[s:e - len(phjSepStr)] for s,e in zip(phjOffsetsArr[phjStartsArr],phjOffsetsArr[phjEndsArr])],
+                                      index = phjGroupIndex,
+                                      dtype = object)
+            
+            else:
+                if phjGroupby is None:
+                    phjGroupby = phjSortedDF.groupby(phjIDVarName,sort = True,observed = True)
+                
+                phjAggSer = phjGroupby[phjVarName].agg(phjFunc).reindex(phjGroupIndex)
+            
+            if phjMultiIndex == True:
+                phjColumnsList.append((phjVarName,phjGetAggFuncName(phjFunc)))
+            else:
+                phjColumnsList.append(phjVarName)
+            
+            phjValuesList.append(phjAggSer)
+    
+    phjGroupedDF = pd.concat(phjValuesList,axis = 1) if len(phjValuesList) > 0 else pd.DataFrame(index = phjGroupIndex)
+    phjGroupedDF.index = phjGroupIndex
+    
+    if phjMultiIndex == True:
+        phjGroupedDF.columns = pd.MultiIndex.from_tuples(phjColumnsList)
+    else:
+        phjGroupedDF.columns = phjColumnsList
+    
+    return phjGroupedDF
+
+
+
 # Secondary functions
 # ===================
 
@@ -1152,39 +2187,39 @@ def phjGetCollapsedPatientDataframeColumns(phjAllDataDF,       # Dataframe conta
                                            phjPrintResults = False):
     
     # This function simply returns a list of the column headings that will be created
-    # when the dataframe of consultations is collapsed on patient ID. There is probably
-    # a clever way to work this out based on the given arguments but this function takes
-    # the pragmatic approach of selecting a small sample of consultations, collapsing
-    # them on patient ID and then returning the column headings of the resulting dataframe.
-    # Why a random sample of 5 patients (or, indeed, any number greater than 1)? Not sure.
-    # I wanted to minimise any unforeseen problems of a single patient containing all
-    # NaN values or some other unexpected data; a sample of 5 should contain some valid
-    # data that can be used to collapse the dataframe based on patient ID.
-    phjTempUniquePatientsSer = phjAllDataDF.loc[:,phjPatientIDVarName]
-    
-    if len(phjTempUniquePatientsSer) > 5:
-        
-        phjTempPatientSample = phjTempUniquePatientsSer.sample(n = 5)
-        print(phjTempPatientSample)
-        
-        phjTempMask = phjAllDataDF[phjPatientIDVarName].isin(phjTempPatientSample)
-        
-        phjTempSampleDF = phjAllDataDF.loc[phjTempMask,:]
-    
+    # when the dataframe of consultations is collapsed on patient ID. (Previously, this
+    # was done by collapsing a random sample of 5 patients and returning the column
+    # headings of the resulting dataframe.) The column headings are now worked out
+    # directly from the column names, the aggregation dict and the rules used to rename
+    # the columns in phjCollapseOnPatientID(); the data themselves are not required.
+    # N.B. Aggregation functions that return more than one value per patient (e.g.
+    #      'describe') are assumed to produce a single column.
+    phjCollapseAggDict = phjGetCollapseAggDict(phjColumnsList = phjAllDataDF.columns.values.tolist(),
+                                               phjPatientIDVarName = phjPatientIDVarName,
+                                               phjConsultationIDVarName = phjConsultationIDVarName,
+                                               phjConsultationDateVarName = phjConsultationDateVarName,
+                                               phjFreeTextVarName = phjFreeTextVarName,
+                                               phjAggDict = phjAggDict)
+    
+    # If any of the aggregation functions is a list then a column multi-index would be
+    # produced and flattened to give column names of the form varname_func
+    phjMultiIndex = any(isinstance(v,(list,tuple)) for v in phjCollapseAggDict.values())
+    
+    if phjMultiIndex == True:
+        phjTempColumnsList = ['_'.join([k,phjGetAggFuncName(f)]).strip() for k,v in phjCollapseAggDict.items() for f in (v if isinstance(v,(list,tuple)) else [v])]
     else:
-        # Otherwise, original dataframe contains 10 or fewer patients and therefore
-        # use all the data
-        phjTempSampleDF = phjAllDataDF
-        
-    phjTempSampleDF = phjCollapseOnPatientID(phjAllDataDF = phjTempSampleDF,       # Dataframe containing all columns of data to be collapsed based on patient ID
-                                             phjPatientIDVarName = phjPatientIDVarName,
-                                             phjConsultationIDVarName = phjConsultationIDVarName,
-                                             phjConsultationDateVarName = phjConsultationDateVarName,
-                                             phjFreeTextVarName = phjFreeTextVarName,
-                                             phjAggDict = phjAggDict,
-                                             phjPrintResults = phjPrintResults)
+        phjTempColumnsList = list(phjCollapseAggDict.keys())
     
-    phjTempCollapsedColumnsList = phjTempSampleDF.columns.values
+    phjRenameDict = phjGetRenameCollapsedColumnsDict(phjPatientDataframeColumnHeadingsList = phjTempColumnsList,
+                                                     phjPatientIDVarName = phjPatientIDVarName,
+                                                     phjConsultationIDVarName = phjConsultationIDVarName,
+                                                     phjAggDict = phjCollapseAggDict,
+                                                     phjMultiIndex = phjMultiIndex,
+                                                     phjPrintResults = phjPrintResults)
+    
+    # The patient ID variable is the first column (after the index has been reset)
+    phjTempCollapsedColumnsList = np.array([phjPatientIDVarName] + [phjRenameDict.get(c,c) for c in phjTempColumnsList],
+                                           dtype = object)
     
     if phjPrintResults == True:
         print("\nColumn headings in collapsed patient-based dataframe")
@@ -1334,6 +2369,8 @@ def phjGetPotentialControls(phjDF,                      # A pandas dataframe con
                             phjFreeTextVarName = None,
                             phjControlType = 'consultation',   # Other option would be 'patient'
                             phjAggDict = None,
+                            phjNumberOfWorkersInt = 1,
+                            phjScreeningCache = None,
                             phjPrintResults = False):
     ### THINGS TO CHECK
     ### phjPatientIDVarName is a string and not a list and that is contained in dataframe
@@ -1397,21 +2434,28 @@ def phjGetPotentialControls(phjDF,                      # A pandas dataframe con
     
     else:
         if phjScreeningRegex is not None:
-            # Compile regex
-            phjRegex = re.compile(phjScreeningRegex,flags=re.I|re.X)
-        
             # Run regex against freetext field and create a binary mask to identify all
             # consultations that match the regex.
             # NA values are set to FALSE.
-            phjRegexMask = phjDF[phjFreeTextVarName].str.contains(phjRegex, na = False)
+            # (N.B. This used to be done using phjDF[phjFreeTextVarName].str.contains()
+            #       but running a large verbose regex over every consultation was very
+            #       slow. The free text is now pre-screened for literal fragments that
+            #       must be present in any match and the full regex is only run on the
+            #       consultations that survive; the resulting mask is the same.)
+            # If a cache is requested, the mask is retrieved from (or saved to) the cache.
+            phjRegexMask = phjScreenFreeText(phjFreeTextSer = phjDF[phjFreeTextVarName],
+                                             phjRegexStr = phjScreeningRegex,
+                                             phjNumberOfWorkersInt = phjNumberOfWorkersInt,
+                                             phjCache = phjScreeningCache,
+                                             phjPrintResults = phjPrintResults)
         
             # Retrieve patient IDs for consultations where freetext field contains a match
             phjCasesPatientID = phjDF.loc[phjRegexMask,phjPatientIDVarName]
         
             # Combine with Patient IDs passed to function to produce an array of all
             # patient IDs that should not be included in potential control dataframe
-            #phjCasesPatientIDArr = phjCasesPatientID.append(phjCasesPatientIDSer).unique()
-            phjCasesPatientIDArr = phjCasesPatientID.append(phjCasesPatientIDSer).unique()
+            # (N.B. Series.append() was removed in Pandas 2.0; use pd.concat() instead.)
+            phjCasesPatientIDArr = pd.concat([phjCasesPatientID,pd.Series(phjCasesPatientIDSer)]).unique()
         
             # Create a mask of all patients that could be included in potentials control
             # list. (This is, in fact, the inverse of the output from .isin() method)
@@ -1605,12 +2649,97 @@ def phjSelectUnmatchedCaseControlSubjects(phjCasesDF,
 
 
 
+def phjSelectFrequencyMatchedCaseControlSubjects(phjCasesDF,
+                                                 phjPotentialControlsDF,
+                                                 phjUniqueIdentifierVarName,
+                                                 phjMatchingVariablesList,
+                                                 phjControlsPerCaseInt = 1,
+                                                 phjRNG = None,
+                                                 phjPrintResults = False):
+    
+    # Frequency matching selects controls so that the distribution of controls across
+    # strata (defined by the matching variables) mirrors the distribution of the cases;
+    # individual cases are not matched with individual controls. The number of controls
+    # required in each stratum is the number of cases multiplied by phjControlsPerCaseInt.
+    # All potential controls are ranked in a random order within their stratum (using a
+    # single sort) and those with a rank lower than the number required are selected.
+    # The 'group' column contains a code identifying the stratum and can be used in
+    # stratified analyses. Random numbers are generated using phjRNG (a np.random.Generator)
+    # so results can be reproduced by passing a generator created with a fixed seed.
+    if phjRNG is None:
+        phjRNG = np.random.default_rng()
+    
+    if isinstance(phjMatchingVariablesList,str):
+        phjMatchingVariablesList = [phjMatchingVariablesList]
+    
+    phjCaseCodesArr, phjControlCodesArr, phjStrataDF = phjGetStrataCodes(phjCasesDF = phjCasesDF,
+                                                                         phjPotentialControlsDF = phjPotentialControlsDF,
+                                                                         phjMatchingVariablesList = phjMatchingVariablesList)
+    
+    phjNStrataInt = len(phjStrataDF.index)
+    phjNCasesArr = np.bincount(phjCaseCodesArr,minlength = phjNStrataInt)
+    phjNControlsArr = np.bincount(phjControlCodesArr,minlength = phjNStrataInt)
+    
+    phjRequiredArr = phjNCasesArr * phjControlsPerCaseInt
+    
+    if (phjNControlsArr < phjRequiredArr).any():
+        print("{0} of {1} strata contain too few potential controls; all potential controls in these strata have been used.".format(((phjNControlsArr < phjRequiredArr) & (phjNCasesArr > 0)).sum(),
+                                                                                                                                    (phjNCasesArr > 0).sum()))
+    
+    # Rank potential controls randomly within each stratum
+    phjControlOrderArr = np.lexsort((phjRNG.random(len(phjControlCodesArr)),phjControlCodesArr))
+    phjControlRankArr = np.empty(len(phjControlCodesArr),dtype = np.int64)
+    phjControlRankArr[phjControlOrderArr] = np.arange(len(phjControlCodesArr)) - np.repeat(np.cumsum(phjNControlsArr) - phjNControlsArr,phjNControlsArr)
+    
+    phjSelectedControlsArr = np.flatnonzero(phjControlRankArr < phjRequiredArr[phjControlCodesArr])
+    
+    phjCasesOutDF = phjCasesDF[[phjUniqueIdentifierVarName] + phjMatchingVariablesList].copy()
+    phjCasesOutDF.insert(1,'group',phjCaseCodesArr)
+    phjCasesOutDF.insert(2,'case',1)
+    
+    phjControlsOutDF = phjPotentialControlsDF.iloc[phjSelectedControlsArr,:][[phjUniqueIdentifierVarName] + phjMatchingVariablesList].copy()
+    phjControlsOutDF.insert(1,'group',phjControlCodesArr[phjSelectedControlsArr])
+    phjControlsOutDF.insert(2,'case',0)
+    
+    phjTempCaseControlDF = pd.concat([phjCasesOutDF,phjControlsOutDF],
+                                     axis = 0,
+                                     ignore_index = True,
+                                     sort = False)
+    
+    phjTempCaseControlDF = phjTempCaseControlDF.sort_values(['group','case'],
+                                                            ascending = [True,False],
+                                                            kind = 'mergesort').reset_index(drop = True)
+    
+    if phjPrintResults == True:
+        print('Final returned data')
+        print(phjTempCaseControlDF)
+        print('\n')
+    
+    return phjTempCaseControlDF
+
+
+
 def phjSelectMatchedCaseControlSubjects(phjCasesDF,
                                         phjPotentialControlsDF,
                                         phjUniqueIdentifierVarName,
                                         phjMatchingVariablesList,
                                         phjControlsPerCaseInt = 1,
+                                        phjAllocationMethod = 'greedy',
+                                        phjRNG = None,
                                         phjPrintResults = False):
+    
+    # If the 'optimal' allocation method is requested, the number of controls allocated
+    # to each case is calculated for each stratum rather than working through each case
+    # in turn (see phjAllocateMatchedControls() function).
+    if phjAllocationMethod == 'optimal':
+        return phjAllocateMatchedControls(phjCasesDF = phjCasesDF,
+                                          phjPotentialControlsDF = phjPotentialControlsDF,
+                                          phjUniqueIdentifierVarName = phjUniqueIdentifierVarName,
+                                          phjMatchingVariablesList = phjMatchingVariablesList,
+                                          phjControlsPerCaseInt = phjControlsPerCaseInt,
+                                          phjRNG = phjRNG,
+                                          phjPrintResults = phjPrintResults)
+    
     # Algorithm outline
     # =================
     # 1. Create an empty dataframe in which selected cases and controls will be stored.
@@ -1905,6 +3034,189 @@ def phjSelectMatchedCaseControlSubjects(phjCasesDF,
 
 
 
+def phjGetStratumFeasibility(phjCasesDF,
+                             phjPotentialControlsDF,
+                             phjMatchingVariablesList,
+                             phjControlsPerCaseInt = 1):
+    
+    # Returns a dataframe with one row for each stratum (i.e. each combination of the
+    # matching variables) that contains cases. The table gives the number of cases,
+    # the number of potential controls and the number of controls required, together
+    # with the number of controls and matched cases that will be produced by the
+    # 'optimal' allocation and the minimum and maximum number of controls per case.
+    if isinstance(phjMatchingVariablesList,str):
+        phjMatchingVariablesList = [phjMatchingVariablesList]
+    
+    phjCaseCodesArr, phjControlCodesArr, phjStrataDF = phjGetStrataCodes(phjCasesDF = phjCasesDF,
+                                                                         phjPotentialControlsDF = phjPotentialControlsDF,
+                                                                         phjMatchingVariablesList = phjMatchingVariablesList)
+    
+    phjNStrataInt = len(phjStrataDF.index)
+    
+    phjStrataDF['cases'] = np.bincount(phjCaseCodesArr,minlength = phjNStrataInt)
+    phjStrataDF['potential_controls'] = np.bincount(phjControlCodesArr,minlength = phjNStrataInt)
+    
+    # Only strata that contain cases are relevant
+    phjStrataDF = phjStrataDF.loc[phjStrataDF['cases'] > 0,:]
+    
+    phjNCasesArr = phjStrataDF['cases'].to_numpy()
+    phjNControlsArr = phjStrataDF['potential_controls'].to_numpy()
+    
+    phjStrataDF['controls_required'] = phjNCasesArr * phjControlsPerCaseInt
+    phjStrataDF['controls_allocated'] = np.minimum(phjNControlsArr,phjNCasesArr * phjControlsPerCaseInt)
+    phjStrataDF['matched_cases'] = np.minimum(phjNCasesArr,phjNControlsArr)
+    phjStrataDF['unmatched_cases'] = phjNCasesArr - phjStrataDF['matched_cases'].to_numpy()
+    phjStrataDF['min_ratio'] = np.where(phjNControlsArr >= phjNCasesArr,
+                                        np.minimum(phjNControlsArr // phjNCasesArr,phjControlsPerCaseInt),
+                                        0)
+    phjStrataDF['max_ratio'] = np.minimum(-(-phjNControlsArr // phjNCasesArr),phjControlsPerCaseInt)
+    phjStrataDF['feasible'] = phjNControlsArr >= phjNCasesArr * phjControlsPerCaseInt
+    
+    return phjStrataDF.reset_index(drop = True)
+
+
+
+def phjGetStrataCodes(phjCasesDF,
+                      phjPotentialControlsDF,
+                      phjMatchingVariablesList):
+    
+    # Gives each stratum (combination of matching variables) an integer code that is the
+    # same for cases and controls. Returns arrays of codes for cases and controls and a
+    # dataframe of the matching variables for each stratum (row number = code).
+    phjTempDF = pd.concat([phjCasesDF[phjMatchingVariablesList],
+                           phjPotentialControlsDF[phjMatchingVariablesList]],
+                          axis = 0,
+                          ignore_index = True)
+    
+    phjStrataCodesArr = phjTempDF.groupby(phjMatchingVariablesList,
+                                          sort = False,
+                                          dropna = False).ngroup().to_numpy()
+    
+    phjStrataDF = phjTempDF.iloc[np.unique(phjStrataCodesArr,return_index = True)[1],:].reset_index(drop = True)
+    
+    phjNCasesInt = len(phjCasesDF.index)
+    
+    return phjStrataCodesArr[:phjNCasesInt], phjStrataCodesArr[phjNCasesInt:], phjStrataDF
+
+
+
+def phjAllocateMatchedControls(phjCasesDF,
+                               phjPotentialControlsDF,
+                               phjUniqueIdentifierVarName,
+                               phjMatchingVariablesList,
+                               phjControlsPerCaseInt = 1,
+                               phjRNG = None,
+                               phjPrintResults = False):
+    
+    # Exact matching divides cases and controls into independent strata and, therefore,
+    # the number of controls allocated to each case can be calculated for each stratum
+    # from the number of cases (n), the number of potential controls (m) and the number
+    # of controls requested per case (k):
+    #   i.   m >= n*k   - each case is allocated k controls.
+    #   ii.  n <= m < n*k - all cases are matched; each case is allocated m//n controls
+    #                       and (m mod n) randomly chosen cases are allocated one more.
+    #   iii. m < n      - m randomly chosen cases are allocated one control each.
+    # This maximises the number of matched cases and balances the number of controls per
+    # case. Unlike the greedy method, the result does not depend on the order of the cases.
+    # Controls are chosen at random within each stratum. The random numbers are generated
+    # using phjRNG (a np.random.Generator) so results can be reproduced by passing a
+    # generator created with a fixed seed (see phjRandomSeedInt argument in the
+    # phjGenerateCaseControlDataset() function).
+    if phjRNG is None:
+        phjRNG = np.random.default_rng()
+    
+    if isinstance(phjMatchingVariablesList,str):
+        phjMatchingVariablesList = [phjMatchingVariablesList]
+    
+    phjFeasibilityDF = phjGetStratumFeasibility(phjCasesDF = phjCasesDF,
+                                                phjPotentialControlsDF = phjPotentialControlsDF,
+                                                phjMatchingVariablesList = phjMatchingVariablesList,
+                                                phjControlsPerCaseInt = phjControlsPerCaseInt)
+    
+    if phjPrintResults == True:
+        print('\nStratum feasibility report')
+        print('--------------------------')
+        print(phjFeasibilityDF)
+        print('\n')
+    
+    if not phjFeasibilityDF['feasible'].all():
+        print("{0} of {1} strata contain too few potential controls; {2} of {3} cases will be matched with {4} of {5} requested controls.".format((~phjFeasibilityDF['feasible']).sum(),
+                                                                                                                                                 len(phjFeasibilityDF.index),
+                                                                                                                                                 phjFeasibilityDF['matched_cases'].sum(),
+                                                                                                                                                 phjFeasibilityDF['cases'].sum(),
+                                                                                                                                                 phjFeasibilityDF['controls_allocated'].sum(),
+                                                                                                                                                 phjFeasibilityDF['controls_required'].sum()))
+    
+    phjCaseCodesArr, phjControlCodesArr, phjStrataDF = phjGetStrataCodes(phjCasesDF = phjCasesDF,
+                                                                         phjPotentialControlsDF = phjPotentialControlsDF,
+                                                                         phjMatchingVariablesList = phjMatchingVariablesList)
+    
+    phjNStrataInt = len(phjStrataDF.index)
+    phjNCasesArr = np.bincount(phjCaseCodesArr,minlength = phjNStrataInt)
+    phjNControlsArr = np.bincount(phjControlCodesArr,minlength = phjNStrataInt)
+    
+    # Order cases and controls randomly within strata and calculate the rank of each
+    # case and control within its stratum
+    phjCaseOrderArr = np.lexsort((phjRNG.random(len(phjCaseCodesArr)),phjCaseCodesArr))
+    phjCaseRankArr = np.empty(len(phjCaseCodesArr),dtype = np.int64)
+    phjCaseRankArr[phjCaseOrderArr] = np.arange(len(phjCaseCodesArr)) - np.repeat(np.cumsum(phjNCasesArr) - phjNCasesArr,phjNCasesArr)
+    
+    phjControlOrderArr = np.lexsort((phjRNG.random(len(phjControlCodesArr)),phjControlCodesArr))
+    phjControlRankArr = np.empty(len(phjControlCodesArr),dtype = np.int64)
+    phjControlRankArr[phjControlOrderArr] = np.arange(len(phjControlCodesArr)) - np.repeat(np.cumsum(phjNControlsArr) - phjNControlsArr,phjNControlsArr)
+    
+    # Number of controls allocated to each case
+    phjTotalArr = np.minimum(phjNControlsArr,phjNCasesArr * phjControlsPerCaseInt)
+    phjQuotientArr = np.where(phjNCasesArr > 0,phjTotalArr // np.maximum(phjNCasesArr,1),0)
+    phjRemainderArr = phjTotalArr - phjQuotientArr * phjNCasesArr
+    
+    phjCaseAllocArr = phjQuotientArr[phjCaseCodesArr] + (phjCaseRankArr < phjRemainderArr[phjCaseCodesArr])
+    
+    # Controls with a rank less than the total number of controls allocated in the
+    # stratum are selected and are assigned to cases in order of case rank
+    phjSelectedControlsArr = np.flatnonzero(phjControlRankArr < phjTotalArr[phjControlCodesArr])
+    
+    phjSortedCaseAllocArr = phjCaseAllocArr[phjCaseOrderArr]
+    phjCaseEndsArr = np.cumsum(phjSortedCaseAllocArr)
+    
+    phjControlPosArr = (np.cumsum(phjTotalArr) - phjTotalArr)[phjControlCodesArr[phjSelectedControlsArr]] + phjControlRankArr[phjSelectedControlsArr]
+    phjControlCaseArr = phjCaseOrderArr[np.searchsorted(phjCaseEndsArr,phjControlPosArr,side = 'right')]
+    
+    # Cases without controls are excluded. The group value is the index value of the case
+    # (as in the greedy method).
+    phjMatchedCasesArr = np.flatnonzero(phjCaseAllocArr > 0)
+    phjGroupArr = phjCasesDF.index.to_numpy()
+    
+    phjCasesOutDF = phjCasesDF.iloc[phjMatchedCasesArr,:][[phjUniqueIdentifierVarName] + phjMatchingVariablesList]
+    phjCasesOutDF.insert(1,'group',phjGroupArr[phjMatchedCasesArr])
+    phjCasesOutDF.insert(2,'case',1)
+    
+    phjControlsOutDF = phjPotentialControlsDF.iloc[phjSelectedControlsArr,:][[phjUniqueIdentifierVarName]].copy()
+    phjControlsOutDF['group'] = phjGroupArr[phjControlCaseArr]
+    phjControlsOutDF['case'] = 0
+    
+    # Matching variables for controls are taken from the case (as in the greedy method)
+    for c in phjMatchingVariablesList:
+        phjControlsOutDF[c] = phjCasesDF[c].to_numpy()[phjControlCaseArr]
+    
+    # Each case is followed by its controls (cases in the order in which they were listed)
+    phjTempCaseControlDF = pd.concat([phjCasesOutDF.assign(position = phjMatchedCasesArr,order = 0),
+                                      phjControlsOutDF.assign(position = phjControlCaseArr,order = 1)],
+                                     axis = 0,
+                                     ignore_index = True,
+                                     sort = False)
+    
+    phjTempCaseControlDF = phjTempCaseControlDF.sort_values(['position','order'],kind = 'mergesort').drop(['position','order'],axis = 1).reset_index(drop = True)
+    
+    if phjPrintResults == True:
+        print('Final returned data')
+        print(phjTempCaseControlDF)
+        print('\n')
+    
+    return phjTempCaseControlDF
+
+
+
 def phjGetRegexStr(phjRegexStr = None,
                    phjRegexPathAndFileName = None,
                    phjAllowedAttempts = 3,
@@ -1982,6 +3294,337 @@ def phjGetRegexStr(phjRegexStr = None,
 
 
 
+# When the regex is run with the IGNORECASE flag, the ASCII letters will also match
+# 4 non-ASCII characters (see the documentation for the re module). These characters
+# are translated to their ASCII equivalents before the free text is converted to lower
+# case so that the literal pre-screen never rejects a string that the regex would match.
+phjCaseFoldTable = str.maketrans({'İ':'i',    # Latin capital letter I with dot above
+                                  'ı':'i',    # Latin small letter dotless i
+                                  'ſ':'s',    # Latin small letter long s
+                                  'K':'k'})   # Kelvin sign
+
+
+
+def phjGetRegexRequiredLiterals(phjRegexStr,
+                                phjRegexFlags = re.I|re.X,
+                                phjMinLiteralLengthInt = 3,
+                                phjPrintResults = False):
+
+    # This function returns a list of lower-case literal strings such that any string
+    # that is matched by the regex must contain at least one of the literals. The list
+    # can be used as a fast pre-screen of free text; strings that contain none of the
+    # literals cannot possibly match the regex and don't need to be checked with the
+    # full regex. If no suitable set of literals can be identified (e.g. the regex can
+    # match an empty string or consists only of character classes) or the shortest
+    # literal is shorter than phjMinLiteralLengthInt characters (in which case almost
+    # every string will contain a literal and the pre-screen is pointless) then the
+    # function returns None.
+    try:
+        phjParsedRegex = phjRegexParser.parse(phjRegexStr,phjRegexFlags)
+
+    except re.error:
+        phjLiteralsList = None
+
+    else:
+        phjLiteralsSet = phjGetRequiredLiteralsFromParsedRegex(phjParsedRegex)
+
+        if (phjLiteralsSet is None) or (min([len(l) for l in phjLiteralsSet]) < phjMinLiteralLengthInt):
+            phjLiteralsList = None
+        else:
+            phjLiteralsList = sorted(phjLiteralsSet)
+
+    if phjPrintResults == True:
+        print('\nLiterals used to pre-screen free text:')
+        print(phjLiteralsList)
+
+    return phjLiteralsList
+
+
+
+def phjGetRequiredLiteralsFromParsedRegex(phjParsedRegex):
+
+    # The parsed regex consists of a sequence of (opcode, argument) items. All items in
+    # the sequence must match and, therefore, the set of literals required by any single
+    # item is also required by the whole sequence; the 'best' set (i.e. the set with the
+    # longest shortest literal) is returned. Consecutive LITERAL items are joined to
+    # form a single string. For alternations (BRANCH), at least one branch must match
+    # and, therefore, the set of literals is the union of the sets required by each
+    # branch (and if any branch does not require a literal then nor does the alternation).
+    # Only ASCII literals are used because non-ASCII characters can have complicated
+    # case-insensitive equivalents.
+    phjCandidatesList = []
+    phjLiteralRunList = []
+
+    for phjOpCode, phjArg in phjParsedRegex:
+
+        if phjOpCode is phjRegexParser.LITERAL and chr(phjArg).isascii():
+            phjLiteralRunList.append(chr(phjArg).lower())
+            continue
+
+        # Any other item ends the current run of literals
+        if len(phjLiteralRunList) > 0:
+            phjCandidatesList.append({''.join(phjLiteralRunList)})
+            phjLiteralRunList = []
+
+        if phjOpCode is phjRegexParser.SUBPATTERN:
+            # Argument is (group, add_flags, del_flags, subpattern)
+            phjRequiredSet = phjGetRequiredLiteralsFromParsedRegex(phjArg[-1])
+
+        elif phjOpCode is getattr(phjRegexParser,'ATOMIC_GROUP',None):
+            phjRequiredSet = phjGetRequiredLiteralsFromParsedRegex(phjArg)
+
+        elif phjOpCode in [phjRegexParser.MAX_REPEAT,
+                           phjRegexParser.MIN_REPEAT,
+                           getattr(phjRegexParser,'POSSESSIVE_REPEAT',None)]:
+            # Argument is (min, max, subpattern); only required if repeated at least once
+            if phjArg[0] >= 1:
+                phjRequiredSet = phjGetRequiredLiteralsFromParsedRegex(phjArg[2])
+            else:
+                phjRequiredSet = None
+
+        elif phjOpCode is phjRegexParser.BRANCH:
+            phjBranchSetsList = [phjGetRequiredLiteralsFromParsedRegex(b) for b in phjArg[1]]
+
+            if any(b is None for b in phjBranchSetsList):
+                phjRequiredSet = None
+            else:
+                phjRequiredSet = set().union(*phjBranchSetsList)
+
+        else:
+            # Character classes, wildcards, anchors, lookarounds, backreferences, etc.
+            phjRequiredSet = None
+
+        if phjRequiredSet is not None:
+            phjCandidatesList.append(phjRequiredSet)
+
+    if len(phjLiteralRunList) > 0:
+        phjCandidatesList.append({''.join(phjLiteralRunList)})
+
+    if len(phjCandidatesList) == 0:
+        phjRequiredSet = None
+    else:
+        phjRequiredSet = max(phjCandidatesList,
+                             key = lambda c: (min([len(l) for l in c]),-len(c)))
+
+    return phjRequiredSet
+
+
+
+def phjScreenFreeText(phjFreeTextSer,
+                      phjRegexStr,
+                      phjNumberOfWorkersInt = 1,
+                      phjChunkSizeInt = 100000,
+                      phjCache = None,
+                      phjPrintResults = False):
+
+    # Returns a boolean series (with the same index as phjFreeTextSer) indicating which
+    # strings are matched by the regex (compiled with re.I|re.X flags). Non-string values
+    # (e.g. NaN) are set to False. This produces the same mask as:
+    #     phjFreeTextSer.str.contains(re.compile(phjRegexStr,flags=re.I|re.X), na = False)
+    # but strings are first pre-screened for required literals and the text can be
+    # processed in chunks by several worker processes.
+    # If phjCache is True (memory) or the path to a directory, the mask is looked up in (and,
+    # if not found, saved to) a cache keyed on the regex and a fingerprint of the free text
+    # column; any change to either results in a different key and the text is re-scanned.
+    if phjCache is not None:
+        phjCacheKey = phjGetScreeningCacheKey(phjFreeTextSer = phjFreeTextSer,
+                                              phjRegexStr = phjRegexStr)
+
+        phjMaskArr = phjReadScreeningCache(phjCache = phjCache,
+                                           phjCacheKey = phjCacheKey,
+                                           phjLengthInt = len(phjFreeTextSer.index))
+
+        if phjMaskArr is not None:
+            if phjPrintResults == True:
+                print('\nRegex match results retrieved from cache ({})'.format(phjCacheKey))
+
+            return pd.Series(phjMaskArr,
+                             index = phjFreeTextSer.index,
+                             name = phjFreeTextSer.name)
+
+    phjLiteralsList = phjGetRegexRequiredLiterals(phjRegexStr = phjRegexStr,
+                                                  phjRegexFlags = re.I|re.X,
+                                                  phjPrintResults = phjPrintResults)
+
+    phjTextList = phjFreeTextSer.tolist()
+
+    if (phjNumberOfWorkersInt > 1) and (len(phjTextList) > phjChunkSizeInt):
+        phjChunksList = [phjTextList[i:i + phjChunkSizeInt] for i in range(0,len(phjTextList),phjChunkSizeInt)]
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers = phjNumberOfWorkersInt) as phjExecutor:
+            phjMaskArrList = list(phjExecutor.map(phjScreenFreeTextChunk,
+                                                  phjChunksList,
+                                                  itertools.repeat(phjRegexStr),
+                                                  itertools.repeat(phjLiteralsList)))
+
+        phjMaskArr = np.concatenate(phjMaskArrList)
+
+    else:
+        phjMaskArr = phjScreenFreeTextChunk(phjTextList,
+                                            phjRegexStr,
+                                            phjLiteralsList)
+
+    if phjCache is not None:
+        phjWriteScreeningCache(phjCache = phjCache,
+                               phjCacheKey = phjCacheKey,
+                               phjMaskArr = phjMaskArr)
+
+    phjRegexMask = pd.Series(phjMaskArr,
+                             index = phjFreeTextSer.index,
+                             name = phjFreeTextSer.name)
+
+    if phjPrintResults == True:
+        print('\nNumber of free text entries matching screening regex = {}'.format(phjRegexMask.sum()))
+
+    return phjRegexMask
+
+
+
+# In-memory cache of regex match results. Keys are produced by phjGetScreeningCacheKey()
+# and values are boolean numpy arrays. Only the most recently used results are retained.
+phjScreeningCacheDict = collections.OrderedDict()
+phjScreeningCacheMaxItemsInt = 8
+
+
+
+def phjGetScreeningCacheKey(phjFreeTextSer,
+                            phjRegexStr):
+
+    # The key is a hash of the regex string (and the flags with which it is compiled)
+    # combined with a fingerprint of the free text column. The fingerprint is created by
+    # hashing every value (and index label) of the column using Pandas' vectorised
+    # hash_pandas_object() function, which is much faster than running the regex.
+    try:
+        phjRowHashArr = pd.util.hash_pandas_object(phjFreeTextSer,index = True).values
+
+    except TypeError:
+        # Older versions of Pandas cannot hash object columns containing mixed types
+        phjRowHashArr = pd.util.hash_pandas_object(phjFreeTextSer.astype(str),index = True).values
+
+    phjHash = hashlib.sha256()
+    phjHash.update(phjRegexStr.encode('utf-8'))
+    phjHash.update(str(int(re.I|re.X)).encode('utf-8'))
+    phjHash.update(str(len(phjRowHashArr)).encode('utf-8'))
+    phjHash.update(phjRowHashArr.tobytes())
+
+    return phjHash.hexdigest()
+
+
+
+def phjReadScreeningCache(phjCache,
+                          phjCacheKey,
+                          phjLengthInt):
+
+    # Returns the cached mask or None if not found. (The in-memory cache is selected
+    # using True rather than a string so that a directory with any name can be used.)
+    if phjCache is True:
+        phjMaskArr = phjScreeningCacheDict.get(phjCacheKey)
+
+        if phjMaskArr is not None:
+            phjScreeningCacheDict.move_to_end(phjCacheKey)
+
+            # Return a copy so that changes made by the caller do not alter the cache
+            phjMaskArr = phjMaskArr.copy()
+
+    else:
+        phjPathAndFileName = os.path.join(phjCache,'{}.npy'.format(phjCacheKey))
+
+        phjMaskArr = None
+
+        if os.path.isfile(phjPathAndFileName):
+            # Masks are stored on disk as packed bits (8 rows per byte). A file that cannot
+            # be read or that does not contain the expected number of rows is treated as
+            # not found (and will be replaced).
+            try:
+                phjPackedArr = np.load(phjPathAndFileName)
+
+            except (OSError,ValueError,EOFError):
+                phjPackedArr = None
+
+            if (phjPackedArr is not None) and (len(phjPackedArr) == (phjLengthInt + 7) // 8):
+                phjMaskArr = np.unpackbits(phjPackedArr)[:phjLengthInt].astype(bool)
+
+    return phjMaskArr
+
+
+
+def phjWriteScreeningCache(phjCache,
+                           phjCacheKey,
+                           phjMaskArr):
+
+    if phjCache is True:
+        # Store a read-only copy so that later changes to phjMaskArr do not alter the cache
+        phjMaskArr = np.array(phjMaskArr,dtype = bool,copy = True)
+        phjMaskArr.setflags(write = False)
+
+        phjScreeningCacheDict[phjCacheKey] = phjMaskArr
+
+        while len(phjScreeningCacheDict) > phjScreeningCacheMaxItemsInt:
+            phjScreeningCacheDict.popitem(last = False)
+
+    else:
+        os.makedirs(phjCache,exist_ok = True)
+
+        # The mask is written to a temporary file in the same directory which then replaces
+        # the cache file in a single step; an interrupted or concurrent write can, therefore,
+        # never leave a partly written cache file.
+        phjFileDescriptor, phjTempPathAndFileName = tempfile.mkstemp(suffix = '.tmp',
+                                                                     dir = phjCache)
+
+        try:
+            with os.fdopen(phjFileDescriptor,'wb') as phjFile:
+                np.save(phjFile,
+                        np.packbits(phjMaskArr))
+
+            os.replace(phjTempPathAndFileName,
+                       os.path.join(phjCache,'{}.npy'.format(phjCacheKey)))
+
+        except Exception:
+            os.remove(phjTempPathAndFileName)
+            raise
+
+    return
+
+
+
+def phjScreenFreeTextChunk(phjTextList,
+                           phjRegexStr,
+                           phjLiteralsList = None):
+
+    # This function is run in worker processes and, therefore, needs to be defined at
+    # module level and take arguments that can be pickled (i.e. the regex is passed as
+    # a string and compiled here).
+    phjRegex = re.compile(phjRegexStr,flags=re.I|re.X)
+
+    phjMaskArr = np.zeros(len(phjTextList),dtype = bool)
+
+    if phjLiteralsList is None:
+        for i, phjText in enumerate(phjTextList):
+            if isinstance(phjText,str):
+                phjMaskArr[i] = phjRegex.search(phjText) is not None
+
+    else:
+        if ahocorasickPresent == True:
+            phjAutomaton = ahocorasick.Automaton()
+            for phjLiteral in phjLiteralsList:
+                phjAutomaton.add_word(phjLiteral,phjLiteral)
+            phjAutomaton.make_automaton()
+
+            phjContainsLiteral = lambda t: next(phjAutomaton.iter(t),None) is not None
+
+        else:
+            phjContainsLiteral = lambda t: any(l in t for l in phjLiteralsList)
+
+        for i, phjText in enumerate(phjTextList):
+            if isinstance(phjText,str):
+                # Only run the full regex if the text contains at least one literal
+                if phjContainsLiteral(phjText.translate(phjCaseFoldTable).lower()):
+                    phjMaskArr[i] = phjRegex.search(phjText) is not None
+
+    return phjMaskArr
+
+
+
 def phjGetRenameCollapsedColumnsDict(phjPatientDataframeColumnHeadingsList,
                                      phjPatientIDVarName,
                                      phjConsultationIDVarName,